@@ -0,0 +1,174 @@
+# corpus.py
+# Part of the 4xiDraw driver for Inkscape
+#
+# Writes the synthetic SVG documents that the benchmarks are run on.  Each
+# one stresses a different part of the plotting pipeline:
+#
+#   dense_lines     thousands of short, separate paths: pen lifts, planning
+#   deep_groups     groups nested hundreds deep, each with its transform
+#   use_clones      thousands of <use> clones of a handful of shapes
+#   huge_path       one path of tens of thousands of curve segments
+#   hatch_fills     filled shapes for eggbot_hatch to fill
+#
+# The documents are generated from a fixed seed, so every run of the
+# benchmarks plots exactly the same thing.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import math
+import os
+import random
+
+SEED = 4242
+
+# A4 landscape, in mm, well inside the 4xiDraw's travel
+WIDTH = 297
+HEIGHT = 210
+
+HEADER = '''<?xml version="1.0" encoding="UTF-8" standalone="no"?>
+<svg xmlns="http://www.w3.org/2000/svg"
+     xmlns:xlink="http://www.w3.org/1999/xlink"
+     xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape"
+     width="%dmm" height="%dmm" viewBox="0 0 %d %d">
+''' % (WIDTH, HEIGHT, WIDTH, HEIGHT)
+
+LAYER = '<g inkscape:groupmode="layer" inkscape:label="1 %s" id="layer1">\n'
+FOOTER = '</g>\n</svg>\n'
+STROKE = 'fill:none;stroke:#000000;stroke-width:0.3'
+
+
+def document(name, body, defs=''):
+    return HEADER + defs + (LAYER % name) + body + FOOTER
+
+
+def denseLines(rng, scale):
+    parts = []
+    for i in range(int(5000 * scale)):
+        x = rng.uniform(10, WIDTH - 20)
+        y = rng.uniform(10, HEIGHT - 20)
+        points = ['M %.3f %.3f' % (x, y)]
+        for j in range(rng.randint(1, 4)):
+            x = min(WIDTH - 10, max(10, x + rng.uniform(-8, 8)))
+            y = min(HEIGHT - 10, max(10, y + rng.uniform(-8, 8)))
+            points.append('L %.3f %.3f' % (x, y))
+        parts.append('<path style="%s" d="%s"/>\n' % (STROKE, ' '.join(points)))
+    return document('dense_lines', ''.join(parts))
+
+
+def deepGroups(rng, scale):
+    depth = int(300 * scale) or 1
+    parts = []
+    for i in range(depth):
+        parts.append('<g transform="translate(%.3f,%.3f) rotate(%.3f,148,105)">\n'
+                     % (rng.uniform(-0.2, 0.2), rng.uniform(-0.2, 0.2), rng.uniform(-1, 1)))
+        parts.append('<path style="%s" d="M 100 80 C 120 60 170 60 190 80 S 200 130 150 130 Z"/>\n'
+                     % STROKE)
+    parts.append('</g>\n' * depth)
+    return document('deep_groups', ''.join(parts))
+
+
+def useClones(rng, scale):
+    defs = ('<defs>\n'
+            '<path id="star" style="%s" d="M 0 -5 L 1.5 -1.5 L 5 -1.5 L 2.2 0.8 L 3.2 4.5 '
+            'L 0 2.3 L -3.2 4.5 L -2.2 0.8 L -5 -1.5 L -1.5 -1.5 Z"/>\n'
+            '<path id="drop" style="%s" d="M 0 -5 C 3 -1 4 1 4 2.5 A 4 4 0 0 1 -4 2.5 C -4 1 -3 -1 0 -5 Z"/>\n'
+            '<g id="pair"><use xlink:href="#star" transform="translate(-3,0) scale(0.5)"/>'
+            '<use xlink:href="#drop" transform="translate(3,0) scale(0.5)"/></g>\n'
+            '</defs>\n') % (STROKE, STROKE)
+    shapes = ('#star', '#drop', '#pair')
+    parts = []
+    for i in range(int(3000 * scale)):
+        parts.append('<use xlink:href="%s" transform="translate(%.3f,%.3f) rotate(%.1f)"/>\n'
+                     % (rng.choice(shapes), rng.uniform(15, WIDTH - 15),
+                        rng.uniform(15, HEIGHT - 15), rng.uniform(0, 360)))
+    return document('use_clones', ''.join(parts), defs)
+
+
+def hugePath(rng, scale):
+    # A spiral of cubic segments, wobbling so that each one needs flattening
+    segments = int(20000 * scale)
+    cx = WIDTH / 2.0
+    cy = HEIGHT / 2.0
+    turns = 60
+    commands = ['M %.3f %.3f' % (cx, cy)]
+    for i in range(1, segments + 1):
+        a1 = 2 * math.pi * turns * (i - 0.66) / segments
+        a2 = 2 * math.pi * turns * (i - 0.33) / segments
+        a3 = 2 * math.pi * turns * i / segments
+        r1 = 95.0 * (i - 0.66) / segments + rng.uniform(-0.3, 0.3)
+        r2 = 95.0 * (i - 0.33) / segments + rng.uniform(-0.3, 0.3)
+        r3 = 95.0 * i / segments
+        commands.append('C %.3f %.3f %.3f %.3f %.3f %.3f' % (
+            cx + r1 * math.cos(a1), cy + r1 * math.sin(a1),
+            cx + r2 * math.cos(a2), cy + r2 * math.sin(a2),
+            cx + r3 * math.cos(a3), cy + r3 * math.sin(a3)))
+    return document('huge_path', '<path style="%s" d="%s"/>\n' % (STROKE, ' '.join(commands)))
+
+
+def hatchFills(rng, scale):
+    parts = []
+    for i in range(int(300 * scale) or 1):
+        x = rng.uniform(20, WIDTH - 20)
+        y = rng.uniform(20, HEIGHT - 20)
+        r = rng.uniform(3, 12)
+        if i % 3 == 0:
+            parts.append('<circle style="fill:#808080;stroke:#000000;stroke-width:0.3" '
+                         'cx="%.3f" cy="%.3f" r="%.3f"/>\n' % (x, y, r))
+        else:
+            sides = rng.randint(3, 9)
+            points = []
+            for j in range(sides):
+                a = 2 * math.pi * j / sides + rng.uniform(-0.2, 0.2)
+                rr = r * rng.uniform(0.6, 1.0)
+                points.append('%.3f,%.3f' % (x + rr * math.cos(a), y + rr * math.sin(a)))
+            parts.append('<polygon style="fill:#404040;stroke:#000000;stroke-width:0.3" '
+                         'points="%s"/>\n' % ' '.join(points))
+    return document('hatch_fills', ''.join(parts))
+
+
+DOCUMENTS = (
+    ('dense_lines', denseLines),
+    ('deep_groups', deepGroups),
+    ('use_clones', useClones),
+    ('huge_path', hugePath),
+    ('hatch_fills', hatchFills),
+)
+
+
+def generate(directory, scale=1.0, names=None):
+    '''
+    Write the corpus to directory, unless it is already there, and return
+    {name: filename}.  scale shrinks (or grows) every document.
+    '''
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    files = {}
+    for name, build in DOCUMENTS:
+        if (names is not None) and (name not in names):
+            continue
+        filename = os.path.join(directory, '%s-%g.svg' % (name, scale))
+        if not os.path.exists(filename):
+            with open(filename, 'w') as f:
+                f.write(build(random.Random(SEED), scale))
+        files[name] = filename
+    return files
+
+
+if __name__ == '__main__':
+    import sys
+    directory = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'corpus')
+    for name, filename in sorted(generate(directory).items()):
+        print(filename)
@@ -0,0 +1,330 @@
+# run.py
+# Part of the 4xiDraw driver for Inkscape
+#
+# Times each stage of plotting on the benchmark corpus (see corpus.py):
+#
+#   traversal   walking the document and its transforms, less the two below
+#   flattening  plot_utils.subdivideCubicPath
+#   planning    PlanTrajectory
+#   emission    streaming the compiled plot to G-code, written to a file
+#   streaming   streaming it through GrblSerial to a simulated GRBL
+#   hatch       eggbot_hatch filling the hatch_fills document
+#
+# and how long the extension and the command-line tools take to import,
+# each in a fresh interpreter, under "startup".
+#
+# Pen lifts are made instant, so that the times are those of this code
+# rather than of the pen servo.  Each stage is run --repeat times and the
+# best time kept.  Results are appended to a history file and compared
+# with the median of the last few runs, so that a slower hot path shows
+# up as a regression.
+#
+#     python benchmarks/run.py [--quick] [--repeat N] [--no-serial] [--no-startup]
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCHMARKS)
+
+import corpus
+import eggbot_hatch
+import fourxidraw
+import grbl_serial
+import grbl_sim
+import plot_journal
+import plot_utils
+
+STAGES = ('traversal', 'flattening', 'planning', 'emission', 'streaming', 'hatch')
+
+# Modules whose import time is measured, as run from the command line
+STARTUP_MODULES = ('fourxidraw', 'grbl_control', 'grbl_daemon', 'grbl_fleet', 'grbl_manual', 'grbl_sim')
+IMPORT_SCRIPT = ('import time; started = time.perf_counter(); import %s; '
+                 'print(time.perf_counter() - started)')
+
+# Options the extension is run with: instant pen lifts and no speed changes
+PLOT_ARGS = ['--penLiftRate=1000000', '--penLowerRate=1000000',
+             '--penLiftDelay=0', '--penLowerDelay=0', '--applySpeed=false',
+             '--reportTime=false']
+
+# The rates and accelerations suggested in README.md
+SIM_SETTINGS = {110: 8500, 111: 8500, 120: 200, 121: 200}
+
+HISTORY_RUNS = 5        # Past runs each result is compared with
+REGRESSION = 0.20       # Slower than that, by this fraction, is flagged
+NOISE = 0.02            # Differences under this many seconds are ignored
+
+
+class Timer(object):
+    '''Wraps a function, adding up the time spent in it.'''
+
+    def __init__(self, function):
+        self.function = function
+        self.seconds = 0.0
+        self.calls = 0
+
+    def __call__(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self.function(*args, **kwargs)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.calls += 1
+
+
+def loadExtension(filename):
+    '''Return a FourxiDrawClass set up to plot filename, as effect() would.'''
+    e = fourxidraw.FourxiDrawClass()
+    e.parse_arguments(PLOT_ARGS + [filename])
+    e.load_raw()
+    e.svg = e.document.getroot()
+    e.options.mode = 'plot'
+    e.CheckSVGforWCBData()
+    e.LayersFoundToPlot = False
+    e.PrintInLayersMode = False
+    e.plotCurrentLayer = True
+    e.resume.nodeCount = 0
+    e.resume.lastPath = 0
+    e.resume.layer = 12345
+    if not e.setDocTransform():
+        raise ValueError('%s: unusable document size' % filename)
+    return e
+
+
+def compilePlot(filename):
+    '''Compile a plot; return the extension, its journal and stage times.'''
+    e = loadExtension(filename)
+    e.serialPort = grbl_serial.GcodeFile(os.devnull)
+    e.createMotion()
+    e.penUp()
+    e.EnableMotors()
+    flattening = Timer(plot_utils.subdivideCubicPath)
+    planning = Timer(e.PlanTrajectory)
+    plot_utils.subdivideCubicPath = flattening
+    e.PlanTrajectory = planning
+    try:
+        started = time.perf_counter()
+        journal = e.compileJournal()
+        total = time.perf_counter() - started
+    finally:
+        plot_utils.subdivideCubicPath = flattening.function
+    e.serialPort.close()
+    times = {
+        'traversal': total - flattening.seconds - planning.seconds,
+        'flattening': flattening.seconds,
+        'planning': planning.seconds,
+    }
+    return e, journal, times
+
+
+def streamPlot(e, serialPort):
+    '''Stream e's compiled plot to serialPort; return the time taken.'''
+    e.serialPort = serialPort
+    e.createMotion()
+    e.bStopped = False
+    journal = plot_journal.JournalReader(plot_journal.journalPath(e.resume.journal))
+    started = time.perf_counter()
+    e.streamJournal(journal, 0)
+    return time.perf_counter() - started
+
+
+def benchmarkPlot(filename, repeat, useSerial, timeScale):
+    times = {}
+    metrics = {}
+    for i in range(repeat):
+        e, journal, compiled = compilePlot(filename)
+        metrics['records'] = len(journal)
+        journal.close()
+        try:
+            for stage, seconds in compiled.items():
+                times[stage] = min(seconds, times.get(stage, seconds))
+
+            handle, gcode = tempfile.mkstemp(suffix='.gcode')
+            os.close(handle)
+            try:
+                sink = grbl_serial.GcodeFile(gcode)
+                seconds = streamPlot(e, sink)
+                sink.close()
+                metrics['gcodeLines'] = sink.lines
+                times['emission'] = min(seconds, times.get('emission', seconds))
+            finally:
+                os.remove(gcode)
+
+            if useSerial:
+                seconds, simulated, lines = streamToSimulator(e, timeScale)
+                times['streaming'] = min(seconds, times.get('streaming', seconds))
+                metrics['linesPerSecond'] = round(lines / seconds) if seconds else 0
+                metrics['plotSeconds'] = round(simulated, 1)
+        finally:
+            plot_journal.removeJournal(e.resume.journal)
+    return times, metrics
+
+
+def streamToSimulator(e, timeScale):
+    sim = grbl_sim.GrblSimulator(SIM_SETTINGS, timeScale).start()
+    try:
+        port = grbl_serial.testPort(sim.portName)
+        serialPort = grbl_serial.GrblSerial(port, False)
+        serialPort.command('G90\r')
+        sim.lines = 0
+        seconds = streamPlot(e, serialPort)
+        serialPort.close()
+        return seconds, sim.motionTime * 1.0, sim.lines
+    finally:
+        sim.stop()
+
+
+def benchmarkHatch(filename, repeat):
+    best = None
+    for i in range(repeat):
+        h = eggbot_hatch.Eggbot_Hatch()
+        started = time.perf_counter()
+        h.run([filename, '--useCache=false'], output=io.BytesIO())
+        seconds = time.perf_counter() - started
+        best = seconds if best is None else min(best, seconds)
+    return {'hatch': best}
+
+
+def benchmarkStartup(repeat):
+    '''The best time to import each of STARTUP_MODULES in a new interpreter.'''
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([ROOT] + [p for p in [env.get('PYTHONPATH')] if p])
+    times = {}
+    for module in STARTUP_MODULES:
+        for i in range(repeat):
+            output = subprocess.check_output([sys.executable, '-W', 'ignore', '-c',
+                                              IMPORT_SCRIPT % module], cwd=ROOT, env=env)
+            seconds = float(output.decode().split()[-1])
+            times[module] = min(seconds, times.get(module, seconds))
+    return times
+
+
+def gitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def loadHistory(filename):
+    history = []
+    if os.path.exists(filename):
+        with open(filename) as f:
+            for line in f:
+                try:
+                    history.append(json.loads(line))
+                except ValueError:
+                    pass
+    return history
+
+
+def baseline(history, name, stage, scale):
+    '''Median time of the last few comparable runs, or None.'''
+    times = [run['results'][name][stage] for run in history
+             if run.get('scale') == scale and stage in run['results'].get(name, {})]
+    times = sorted(times[-HISTORY_RUNS:])
+    if not times:
+        return None
+    middle = len(times) // 2
+    if len(times) % 2:
+        return times[middle]
+    return (times[middle - 1] + times[middle]) / 2.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the stages of plotting.')
+    parser.add_argument('--quick', action='store_true',
+                        help='use a corpus a tenth of the size')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each stage')
+    parser.add_argument('--no-serial', action='store_false', dest='useSerial',
+                        help='skip streaming to the simulator')
+    parser.add_argument('--time-scale', type=float, default=1000.0, dest='timeScale',
+                        help='speed-up of the simulated machine')
+    parser.add_argument('--no-startup', action='store_false', dest='useStartup',
+                        help='skip timing imports')
+    parser.add_argument('--document', action='append', dest='documents',
+                        help='benchmark only this corpus document (may be repeated)')
+    parser.add_argument('--history', default=os.path.join(BENCHMARKS, 'history.jsonl'),
+                        help='file results are kept in')
+    parser.add_argument('--no-save', action='store_false', dest='save',
+                        help='do not add this run to the history')
+    args = parser.parse_args()
+
+    scale = 0.1 if args.quick else 1.0
+    files = corpus.generate(os.path.join(BENCHMARKS, 'corpus'), scale, args.documents)
+    history = loadHistory(args.history)
+
+    results = {}
+    metrics = {}
+    regressions = []
+
+    def report(name, stage, seconds):
+        change = ''
+        past = baseline(history, name, stage, scale)
+        if past:
+            change = '%+.0f%%' % (100.0 * (seconds - past) / past)
+            if (seconds > past * (1 + REGRESSION)) and (seconds - past > NOISE):
+                change += '  REGRESSION'
+                regressions.append((name, stage))
+        print('%-12s %-12s %9.3f %9s' % (name, stage, seconds, change))
+
+    print('%-12s %-12s %9s %9s' % ('document', 'stage', 'seconds', 'change'))
+    for name, build in corpus.DOCUMENTS:
+        if name not in files:
+            continue
+        times, metrics[name] = benchmarkPlot(files[name], args.repeat, args.useSerial,
+                                             args.timeScale)
+        if name == 'hatch_fills':
+            times.update(benchmarkHatch(files[name], args.repeat))
+        results[name] = times
+        for stage in STAGES:
+            if stage in times:
+                report(name, stage, times[stage])
+        print('%-12s %s' % ('', ', '.join('%s %s' % item for item in sorted(metrics[name].items()))))
+
+    if args.useStartup:
+        results['startup'] = benchmarkStartup(args.repeat)
+        for module in STARTUP_MODULES:
+            report('startup', module, results['startup'][module])
+
+    if args.save:
+        run = {
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': gitCommit(),
+            'python': platform.python_version(),
+            'scale': scale,
+            'results': results,
+            'metrics': metrics,
+        }
+        with open(args.history, 'a') as f:
+            f.write(json.dumps(run, sort_keys=True) + '\n')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
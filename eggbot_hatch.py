@@ -101,7 +101,14 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+import hashlib
 import math
+import multiprocessing
+import os
+import pickle
+import time
+from array import array
+from collections import namedtuple
 
 from inkex.transforms import Transform
 
@@ -153,6 +160,26 @@ EXTREME_NEG = -1.0E70  # Extremely large negative number
 MIN_HATCH_FRACTION = 0.25
 # Minimum hatch length, as a fraction of the hatch spacing.
 
+FLATTEN_CACHE_FILE = 'eggbot_hatch_flatten.cache'
+# Name of the file, in plot_utils.cacheDirectory(), holding the flattened polygons
+# from earlier runs.  Bump FLATTEN_CACHE_VERSION whenever the flattening changes.
+FLATTEN_CACHE_VERSION = 1
+FLATTEN_CACHE_MAX_AGE = 30 * 24 * 3600
+# Entries not used for this many seconds are dropped from the cache file,
+FLATTEN_CACHE_MAX_COORDS = 4000000
+# and beyond this many coordinates in all, the least recently used.
+FLATTEN_CACHE_TOUCH_INTERVAL = 24 * 3600
+# When an entry is used, its time is only brought up to date if it is older than
+# this, so that a run which flattens nothing new need not rewrite the file.
+
+HATCH_HASH_ATTRIB = 'data-hatch-hash'
+# Attribute of each generated hatch group recording a hash of everything the
+# hatches were made from: the element's geometry, style and transform and the
+# hatch settings.  Re-runs leave groups whose hash still matches alone.
+HATCH_FILL_ATTRIB = 'data-hatch-fill'
+# Attribute marking the generated <path> of hatches within a hatch group.
+HATCH_HASH_VERSION = 1
+
 """
 Geometry 101: Determining if two lines intersect
 
@@ -283,7 +310,8 @@ def interstices(self, p1, p2, paths, hatches, b_hold_back_hatches, f_hold_back_s
 
     p1 -- (x,y) coordinate [list]
     p2 -- (x,y) coordinate [list]
-    paths -- Dictionary of all the paths to check for intersections
+    paths -- Dictionary of all the paths to check for intersections; each
+             path is a list of subpaths, stored as flat arrays of x, y pairs
 
     When an intersection of the line L is found with a polygon edge, then
     the fractional distance along the line L is saved along with the
@@ -304,9 +332,9 @@ def interstices(self, p1, p2, paths, hatches, b_hold_back_hatches, f_hold_back_s
 
     The hatch line segments are returned by populating a dictionary.
     The dictionary is keyed off of the lxml.etree node pointer.  Each
-    dictionary value is a list of 4-tuples,
+    dictionary value is a flat array('d') holding four values per segment,
 
-        (x1, y1, x2, y2)
+        x1, y1, x2, y2, x1, y1, x2, y2, ...
 
     where (x1, y1) and (x2, y2) are the (x,y) coordinates of the line
     segment's starting and ending points.
@@ -317,8 +345,9 @@ def interstices(self, p1, p2, paths, hatches, b_hold_back_hatches, f_hold_back_s
     # p3 & p4 is the polygon edge to check
     for path in paths:
         for subpath in paths[path]:
-            p3 = subpath[0]
-            for p4 in subpath[1:]:
+            p3 = (subpath[0], subpath[1])
+            for j in range(2, len(subpath), 2):
+                p4 = (subpath[j], subpath[j + 1])
                 s = intersect(p1, p2, p3, p4)
                 if 0.0 <= s <= 1.0:
                     # Save this intersection point along the hatch line
@@ -455,7 +484,7 @@ def interstices(self, p1, p2, paths, hatches, b_hold_back_hatches, f_hold_back_s
     i = 0
     while i < (len(d_and_a) - 1):
         if d_and_a[i][1] not in hatches:
-            hatches[d_and_a[i][1]] = []
+            hatches[d_and_a[i][1]] = array('d')
 
         x1 = p1[0] + d_and_a[i][0] * (p2[0] - p1[0])
         y1 = p1[1] + d_and_a[i][0] * (p2[1] - p1[1])
@@ -464,7 +493,7 @@ def interstices(self, p1, p2, paths, hatches, b_hold_back_hatches, f_hold_back_s
 
         # These are the hatch ends if we are _not_ holding off from the boundary.
         if not b_hold_back_hatches:
-            hatches[d_and_a[i][1]].append([[x1, y1], [x2, y2]])
+            hatches[d_and_a[i][1]].extend((x1, y1, x2, y2))
         else:
             # User wants us to perform a pseudo inset operation.
             # We will accomplish this by trimming back the ends of the hatches.
@@ -514,8 +543,8 @@ def interstices(self, p1, p2, paths, hatches, b_hold_back_hatches, f_hold_back_s
                     f_length_to_be_removed_from_pt1, x2 - x1, y2 - y1, x1, y1)
                 pt2 = self.RelativeControlPointPosition(
                     f_length_to_be_removed_from_pt2, x1 - x2, y1 - y2, x2, y2)
-                hatches[d_and_a[i][1]].append(
-                    [[pt1[0], pt1[1]], [pt2[0], pt2[1]]])
+                hatches[d_and_a[i][1]].extend(
+                    (pt1[0], pt1[1], pt2[0], pt2[1]))
 
         # Remember the relative start and end of this hatch segment
         last_d_and_a = [d_and_a[i], d_and_a[i + 1]]
@@ -566,6 +595,30 @@ def inverseTransform(tran):
              (tran[1][0] * tran[0][2] - tran[0][0] * tran[1][2]) / D]]
 
 
+def transformSegments(tran, coords):
+    """
+    Apply the transform matrix [tran], stored Inkscape style as
+    [[a, c, e], [b, d, f]], to every (x, y) pair in the flat
+    array('d') [coords] and return the result as a new array('d').
+
+    The whole array is mapped in one pass, with the six matrix
+    entries held in locals, rather than building a Transform
+    object for each point.
+    """
+
+    if tran is None:
+        return coords
+
+    a, c, e = tran[0]
+    b, d, f = tran[1]
+    xs = coords[0::2]
+    ys = coords[1::2]
+    result = array('d', coords)
+    result[0::2] = array('d', [a * x + c * y + e for x, y in zip(xs, ys)])
+    result[1::2] = array('d', [b * x + d * y + f for x, y in zip(xs, ys)])
+    return result
+
+
 def subdivideCubicPath(sp, flat, i=1):
     """
     Break up a bezier curve into smaller curves, each of which
@@ -614,152 +667,191 @@ def distanceSquared(p1, p2):
     return dx * dx + dy * dy
 
 
-class Eggbot_Hatch(inkex.Effect):
-
-    def __init__(self):
+def contentHash(*items):
+    """
+    Return a hex digest of the repr() of the given items.  Only plain
+    values (strings, numbers, tuples, lists, ...) should be passed.
+    """
+    return hashlib.sha1(repr(items).encode('utf-8')).hexdigest()
 
-        inkex.Effect.__init__(self)
 
-        self.xmin, self.ymin = (0.0, 0.0)
-        self.xmax, self.ymax = (0.0, 0.0)
-        self.paths = {}
-        self.grid = []
-        self.hatches = {}
-        self.transforms = {}
+class FlattenCache(object):
+    """
+    Persistent cache of flattened, transformed polygon vertex arrays.
+
+    Flattening an element -- parsing its path data, applying its transform
+    and subdividing its curves -- depends only on the path data, the
+    transform and the tolerance, and not on any of the hatch settings.
+    The results are therefore saved between runs, so that re-running the
+    extension with a different hatch angle or spacing only has to redo the
+    intersections.  Each entry records, to within a day, when it was last
+    used.  Entries of elements outside the current run are kept, so that
+    hatching a selection does not throw away the rest of the document's,
+    up to an age and a total size beyond which the least recently used
+    are dropped.
+    """
 
-        # For handling an SVG viewbox attribute, we will need to know the
-        # values of the document's <svg> width and height attributes as well
-        # as establishing a transform from the viewbox to the display.
-        self.docWidth = float(N_PAGE_WIDTH)
-        self.docHeight = float(N_PAGE_HEIGHT)
-        self.docTransform = [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]]
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = {}       # key: (time last used, subpaths)
+        self.used = set()       # keys used in this run
+        self.now = time.time()
+        self.modified = False
 
-        self.arg_parser.add_argument(
-            "--holdBackSteps", type=float,
-            dest="holdBackSteps", default=3.0,
-            help="How far hatch strokes stay from boundary (steps)")
-        self.arg_parser.add_argument(
-            "--hatchScope", type=float,
-            dest="hatchScope", default=3.0,
-            help="Radius searched for segments to join (units of hatch width)")
-        self.arg_parser.add_argument(
-            "--holdBackHatchFromEdges", dest="holdBackHatchFromEdges",
-            type=inkex.Boolean, default=True,
-            help="Stay away from edges, so no need for inset")
-        self.arg_parser.add_argument(
-            "--reducePenLifts", dest="reducePenLifts",
-            type=inkex.Boolean, default=True,
-            help="Reduce plotting time by joining some hatches")
-        self.arg_parser.add_argument(
-            "--crossHatch", dest="crossHatch",
-            type=inkex.Boolean, default=False,
-            help="Generate a cross hatch pattern")
-        self.arg_parser.add_argument(
-            "--hatchAngle", type=float,
-            dest="hatchAngle", default=90.0,
-            help="Angle of inclination for hatch lines")
-        self.arg_parser.add_argument(
-            "--hatchSpacing", type=float,
-            dest="hatchSpacing", default=10.0,
-            help="Spacing between hatch lines")
-        self.arg_parser.add_argument(
-            "--tolerance", type=float,
-            dest="tolerance", default=20.0,
-            help="Allowed deviation from original paths")
-        self.arg_parser.add_argument("--tab",  # NOTE: value is not used.
-                                     type=str, dest="tab", default="splash",
-                                     help="The active tab when Apply was pressed")
+    @staticmethod
+    def key(path, transform, tolerance):
+        if transform is not None:
+            transform = tuple(tuple(row) for row in transform)
+        return contentHash(FLATTEN_CACHE_VERSION, path, transform, tolerance)
 
-    def getDocProps(self):
+    def load(self):
+        try:
+            with open(self.filename, 'rb') as f:
+                entries = pickle.load(f)
+            if isinstance(entries, dict):
+                # Files from before entries were timestamped are dropped
+                self.entries = dict((key, entry) for key, entry in entries.items()
+                                    if isinstance(entry, tuple) and len(entry) == 2)
+        except Exception:
+            # A missing or damaged cache is simply a cold cache
+            self.entries = {}
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.used.add(key)
+        if entry[0] < self.now - FLATTEN_CACHE_TOUCH_INTERVAL:
+            self.entries[key] = (self.now, entry[1])
+            self.modified = True
+        return entry[1]
+
+    def put(self, key, subpaths):
+        self.entries[key] = (self.now, subpaths)
+        self.used.add(key)
+        self.modified = True
+
+    def prune(self):
         """
-        Get the document's height and width attributes from the <svg> tag.
-        Use a default value in case the property is not present or is
-        expressed in units of percentages.
+        Drop the entries not used for FLATTEN_CACHE_MAX_AGE, and then the
+        least recently used beyond FLATTEN_CACHE_MAX_COORDS coordinates.
+        Those used in this run are always kept.  Returns True if any were
+        dropped.
         """
+        limit = self.now - FLATTEN_CACHE_MAX_AGE
+        coords = 0
+        kept = {}
+        for key, (used, subpaths) in sorted(self.entries.items(),
+                                            key=lambda item: (item[0] in self.used, item[1][0]),
+                                            reverse=True):
+            coords += sum(len(subpath) for subpath in subpaths)
+            if key not in self.used and (used < limit or coords > FLATTEN_CACHE_MAX_COORDS):
+                break
+            kept[key] = (used, subpaths)
+        dropped = len(kept) < len(self.entries)
+        self.entries = kept
+        return dropped
 
-        self.docHeight = plot_utils.getLength(self, 'height', N_PAGE_HEIGHT)
-        self.docWidth = plot_utils.getLength(self, 'width', N_PAGE_WIDTH)
+    def save(self):
+        if not (self.prune() or self.modified):
+            return
+        temp_name = self.filename + '.tmp'
+        try:
+            with open(temp_name, 'wb') as f:
+                pickle.dump(self.entries, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_name, self.filename)
+        except (IOError, OSError):
+            inkex.errormsg('Warning: unable to save the hatch fill cache.')
 
-        if self.docHeight is None or self.docWidth is None:
-            return False
-        else:
-            return True
 
-    def handleViewBox(self):
-        """
-        Set up the document-wide transform in the event that the document has an SVG viewbox
-        """
+class HatchPathBuilder(object):
+    """
+    Accumulate the path data for a node's hatch fill as compact arrays
+    rather than as an ever growing string.  A fill may hold tens of
+    thousands of segments, and repeatedly appending to a Python string
+    copies everything written so far.  Here, each path command is stored
+    as a one byte code in self.commands and its (relative, except for the
+    move-to) coordinates are stored as doubles in self.coords.  The SVG
+    path data is then formatted exactly once, by toPathData(), just before
+    the path is handed to joinFillsWithNode().
+    """
 
-        if self.getDocProps():
-            viewbox = self.document.getroot().get('viewBox')
-            if viewbox:
-                vinfo = viewbox.strip().replace(',', ' ').split(' ')
-                if vinfo[2] != 0 and vinfo[3] != 0:
-                    sx = self.docWidth / float(vinfo[2])
-                    sy = self.docHeight / float(vinfo[3])
-                    self.docTransform = Transform(
-                        'scale({0:f},{1:f})'.format(sx, sy)).matrix
+    MOVETO = 0   # M x,y
+    LINETO = 1   # l dx,dy
+    CURVETO = 2  # c dx1,dy1 dx2,dy2 dx,dy
 
-    def addPathVertices(self, path, node=None, transform=None):
-        """
-        Decompose the path data from an SVG element into individual
-        subpaths, each starting with an absolute move-to (x, y)
-        coordinate followed by one or more absolute line-to (x, y)
-        coordinates.  Each subpath is stored as a list of (x, y)
-        coordinates, with the first entry understood to be a
-        move-to coordinate and the rest line-to coordinates.  A list
-        is then made of all the subpath lists and then stored in the
-        self.paths dictionary using the path's lxml.etree node pointer
-        as the dictionary key.
-        """
+    # Number of coordinates consumed by each command, indexed by command code
+    N_COORDS = (2, 2, 6)
 
-        if not path or len(path) == 0:
-            return
+    def __init__(self):
+        self.commands = array('B')
+        self.coords = array('d')
 
-        # parsePath() may raise an exception.  This is okay
-        sp = inkex.Path(path).to_arrays()
-        if not sp or len(sp) == 0:
-            return
+    def __len__(self):
+        return len(self.commands)
 
-        # Get a cubic super duper path
-        p = CubicSuperPath(sp)
-        if not p or len(p) == 0:
-            return
+    def moveTo(self, x, y):
+        self.commands.append(self.MOVETO)
+        self.coords.append(x)
+        self.coords.append(y)
 
-        # Apply any transformation
+    def lineTo(self, dx, dy):
+        self.commands.append(self.LINETO)
+        self.coords.append(dx)
+        self.coords.append(dy)
 
-        # Now traverse the simplified path
-        subpaths = []
-        subpath_vertices = []
-        for sp in p:
-            # We've started a new subpath
-            # See if there is a prior subpath and whether we should keep it
-            if len(subpath_vertices):
-                if distanceSquared(subpath_vertices[0], subpath_vertices[-1]) < 1:
-                    # Keep the prior subpath: it appears to be a closed path
-                    subpaths.append(subpath_vertices)
-            subpath_vertices = []
-            subdivideCubicPath(sp, float(self.options.tolerance / 100))
-            for csp in sp:
-                # Add this vertex to the list of vertices
-                subpath_vertices.append(csp[1])
+    def curveTo(self, dx1, dy1, dx2, dy2, dx, dy):
+        self.commands.append(self.CURVETO)
+        self.coords.extend((dx1, dy1, dx2, dy2, dx, dy))
 
-        # Handle final subpath
-        if len(subpath_vertices):
-            if distanceSquared(subpath_vertices[0], subpath_vertices[-1]) < 1:
-                # Path appears to be closed so let's keep it
-                subpaths.append(subpath_vertices)
+    def toPathData(self, precision=6):
+        """
+        Format the accumulated commands as SVG path data, writing every
+        coordinate with a fixed number of digits after the decimal point.
+        """
 
-        # Empty path?
-        if len(subpaths) == 0:
-            return
+        f = '%.{0:d}f,%.{0:d}f'.format(precision)
+        formats = ('M ' + f, 'l ' + f, 'c ' + f + ' ' + f + ' ' + f)
+        n_coords = self.N_COORDS
+        coords = self.coords
+        parts = []
+        i = 0
+        for command in self.commands:
+            n = n_coords[command]
+            parts.append(formats[command] % tuple(coords[i:i + n]))
+            i += n
+        return ' '.join(parts)
+
+
+HatchSettings = namedtuple('HatchSettings', ['hatchAngle',
+                                             'hatchSpacing',
+                                             'crossHatch',
+                                             'holdBackHatchFromEdges',
+                                             'holdBackSteps',
+                                             'reducePenLifts',
+                                             'hatchScope'])
+# The subset of the extension's options needed to hatch a single element.
+# The field names match the option names so that HatchFill can read them
+# from self.options, just as the extension itself does.
+
+
+class HatchFill(object):
+    """
+    Hatch fill generation for the polygons of a single graphical element.
 
-        # And add this path to our dictionary of paths
-        self.paths[node] = subpaths
+    Nothing in here refers to the SVG document: the element's polygons
+    arrive as flat vertex arrays and the result is plain path data.  That
+    keeps the work for each element independent of every other element,
+    so that it may be farmed out to a process pool (see hatchElement).
+    """
 
-        # And save the transform for this element in a dictionary keyed
-        # by the element's lxml node pointer
-        self.transforms[node] = transform
+    def __init__(self, options):
+        self.options = options
+        self.xmin, self.ymin = (0.0, 0.0)
+        self.xmax, self.ymax = (0.0, 0.0)
+        self.paths = {}
+        self.grid = []
+        self.pt_last_position_abs = [0, 0]
 
     def getBoundingBox(self):
         """
@@ -770,1059 +862,1270 @@ class Eggbot_Hatch(inkex.Effect):
         self.ymin, self.ymax = EXTREME_POS, EXTREME_NEG
         for path in self.paths:
             for subpath in self.paths[path]:
-                for vertex in subpath:
-                    if vertex[0] < self.xmin:
-                        self.xmin = vertex[0]
-                    if vertex[0] > self.xmax:
-                        self.xmax = vertex[0]
-                    if vertex[1] < self.ymin:
-                        self.ymin = vertex[1]
-                    if vertex[1] > self.ymax:
-                        self.ymax = vertex[1]
+                xs = subpath[0::2]
+                ys = subpath[1::2]
+                self.xmin = min(self.xmin, min(xs))
+                self.xmax = max(self.xmax, max(xs))
+                self.ymin = min(self.ymin, min(ys))
+                self.ymax = max(self.ymax, max(ys))
 
-    def recursivelyTraverseSvg(self, a_node_list, mat_current=None, parent_visibility='visible'):
+    def makeHatchGrid(self, angle, spacing, init=True):
         """
-        Recursively walk the SVG document, building polygon vertex lists
-        for each graphical element we support.
+        Build a grid of hatch lines which encompasses the entire bounding
+        box of the graphical elements we are to hatch.
 
-        Rendered SVG elements:
-            <circle>, <ellipse>, <line>, <path>, <polygon>, <polyline>, <rect>
+        1. Figure out the bounding box for all of the graphical elements
+        2. Pick a rectangle larger than that bounding box so that we can
+           later rotate the rectangle and still have it cover the bounding
+           box of the graphical elements.
+        3. Center the rectangle of 2 on the origin (0, 0).
+        4. Build the hatch line grid in this rectangle.
+        5. Rotate the rectangle by the hatch angle.
+        6. Translate the center of the rotated rectangle, (0, 0), to be
+           the center of the bounding box for the graphical elements.
+        7. We now have a grid of hatch lines which overlay the graphical
+           elements and can now be intersected with those graphical elements.
+        """
 
-        Supported SVG elements:
-            <group>, <use>
+        # If this is the first call, do some one time initializations
+        # When generating cross hatches, we may be called more than once
+        if init:
+            self.getBoundingBox()
+            self.grid = []
 
-        Ignored SVG elements:
-            <defs>, <eggbot>, <metadata>, <namedview>, <pattern>
+        # Determine the width and height of the bounding box containing
+        # all the polygons to be hatched
+        w = self.xmax - self.xmin
+        h = self.ymax - self.ymin
 
-        All other SVG elements trigger an error (including <text>)
+        b_bounding_box_exists = (
+            (w != (EXTREME_NEG - EXTREME_POS)) and (h != (EXTREME_NEG - EXTREME_POS)))
+        ret_value = b_bounding_box_exists
 
-        Once a supported graphical element is found, we call functions to
-        create a hatchfill specific to this element. These hatches and their
-        corresponding transforms are stored in self.hatches and self.transforms
-        These two dictionaries are used when we return to the effect method
-        in joinFillsWithNode()
+        if b_bounding_box_exists:
+            # Nice thing about rectangles is that the diameter of the circle
+            # encompassing them is the length the rectangle's diagonal...
+            r = math.sqrt(w * w + h * h) / 2.0
 
-        """
-        if mat_current is None:
-            mat_current = [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]]
-        for node in a_node_list:
+            # Length of a hatch line will be 2r
+            # Now generate hatch lines within the square
+            # centered at (0, 0) and with side length at least d
 
-            """
-             Initialize dictionary for each new node
-             This allows us to create hatch fills as if each 
-             object to be hatched has been selected individually
+            # While we could generate these lines running back and forth,
+            # that makes for weird behavior later when applying odd/even
+            # rules AND there are nested polygons.  Instead, when we
+            # generate the SVG <path> elements with the hatch line
+            # segments, we can do the back and forth weaving.
 
-            """
-            self.xmin, self.ymin = (0.0, 0.0)
-            self.xmax, self.ymax = (0.0, 0.0)
-            self.paths = {}
-            self.grid = []
+            # Rotation information
+            ca = math.cos(math.radians(90 - angle))
+            sa = math.sin(math.radians(90 - angle))
 
-            # Ignore invisible nodes
-            v = node.get('visibility', parent_visibility)
-            if v == 'inherit':
-                v = parent_visibility
-            if v == 'hidden' or v == 'collapse':
-                pass
+            # Translation information
+            cx = self.xmin + (w / 2)
+            cy = self.ymin + (h / 2)
 
-            # first apply the current matrix transform to this node's transform
-            mat_new = (Transform(mat_current) *
-                       Transform(node.get("transform"))).matrix
+            # Since the spacing may be fractional (e.g., 6.5), we
+            # don't try to use range() or other integer iterator
+            spacing = float(abs(spacing))
+            i = -r
+            while i <= r:
+                # Line starts at (i, -r) and goes to (i, +r)
+                x1 = cx + (i * ca) + (r * sa)  # i * ca - (-r) * sa
+                y1 = cy + (i * sa) - (r * ca)  # i * sa + (-r) * ca
+                x2 = cx + (i * ca) - (r * sa)  # i * ca - (+r) * sa
+                y2 = cy + (i * sa) + (r * ca)  # i * sa + (+r) * ca
+                i += spacing
+                # Remove any potential hatch lines which are entirely
+                # outside of the bounding box
+                if (x1 < self.xmin and x2 < self.xmin) or (x1 > self.xmax and x2 > self.xmax):
+                    continue
+                if (y1 < self.ymin and y2 < self.ymin) or (y1 > self.ymax and y2 > self.ymax):
+                    continue
+                self.grid.append((x1, y1, x2, y2))
 
-            if node.tag in [inkex.addNS('g', 'svg'), 'g']:
-                self.recursivelyTraverseSvg(
-                    node, mat_new, parent_visibility=v)
+        return ret_value
 
-            elif node.tag in [inkex.addNS('use', 'svg'), 'use']:
+    def hatch(self, subpaths, transform):
+        """
+        Compute the hatch fill for a single graphical element.
 
-                # A <use> element refers to another SVG element via an xlink:href="#blah"
-                # attribute.  We will handle the element by doing an XPath search through
-                # the document, looking for the element with the matching id="blah"
-                # attribute.  We then recursively process that element after applying
-                # any necessary (x,y) translation.
-                #
-                # Notes:
-                #  1. We ignore the height and width attributes as they do not apply to
-                #     path-like elements, and
-                #  2. Even if the use element has visibility="hidden", SVG still calls
-                #     for processing the referenced element.  The referenced element is
-                #     hidden only if its visibility is "inherit" or "hidden".
+        subpaths -- The element's polygons (closed subpaths), each one a
+                    flat array('d') of x, y vertex coordinates with ALL
+                    applicable transforms already applied
+        transform -- The element's transform matrix, used to map the
+                     hatch lines back into the element's own coordinates
 
-                refid = node.get(inkex.addNS('href', 'xlink'))
+        Returns a tuple of the SVG path data for the hatch fill and the
+        stroke width scaled for the element, or None when the element
+        yields no hatch lines.
+        """
 
-                # [1:] to ignore leading '#' in reference
-                path = '//*[@id="{0}"]'.format(refid[1:])
-                refnode = node.xpath(path)
-                if refnode:
-                    x = float(node.get('x', '0'))
-                    y = float(node.get('y', '0'))
-                    # Note: the transform has already been applied
-                    if x != 0 or y != 0:
-                        mat_new2 = Transform(
-                            mat_new) * Transform('translate({0:f},{1:f})'.format(x, y))
+        self.paths = {0: subpaths}
+        b_have_grid = self.makeHatchGrid(
+            float(self.options.hatchAngle), float(self.options.hatchSpacing), True)
+        if not b_have_grid:
+            return None
+        if self.options.crossHatch:
+            self.makeHatchGrid(
+                float(self.options.hatchAngle + 90.0), float(self.options.hatchSpacing), False)
+
+        # Now loop over our hatch lines looking for intersections
+        hatches = {}
+        for h in self.grid:
+            interstices(self, (h[0], h[1]), (h[2], h[3]), self.paths, hatches,
+                        self.options.holdBackHatchFromEdges, self.options.holdBackSteps)
+        if 0 not in hatches:
+            return None
+
+        # Target stroke width will be (doc width + doc height) / 2 / 1000
+        # stroke_width_target = ( self.docHeight + self.docWidth ) / 2000
+        # stroke_width_target = 1
+        stroke_width_target = 1
+        # Each hatch line stroke will be within an SVG object which may
+        # be subject to transforms.  So, on an object by object basis,
+        # we need to transform our target width to a width suitable
+        # for that object (so that after the object and its hatches are
+        # transformed, the result has the desired width).
+
+        # To aid in the process, we use a diagonal line segment of length
+        # stroke_width_target.  We then run this segment through an object's
+        # inverse transform and see what the resulting length of the inversely
+        # transformed segment is.  We could, alternatively, look at the
+        # x and y scaling factors in the transform and average them.
+        s = stroke_width_target / math.sqrt(2)
+
+        abs_line_segments = {}  # Absolute line segments
+        n_abs_line_segment_total = 0
+        n_pen_lifts = 0
+        direction = True
+        if transform is not None:
+            transform = inverseTransform(transform)
+        if transform is not None:
+            # Determine the scaled stroke width for a hatch line
+            # We produce a line segment of unit length, transform
+            # its endpoints and then determine the length of the
+            # resulting line segment.  Only the linear part of the
+            # transform matters for the segment (0, 0) - (s, s).
+            dx = (transform[0][0] + transform[0][1]) * s
+            dy = (transform[1][0] + transform[1][1]) * s
+            stroke_width = math.sqrt(dx * dx + dy * dy)
+        else:
+            stroke_width = 1.0
+
+        # The transform also applies to the hatch spacing we use when searching for end connections
+        transformed_hatch_spacing = stroke_width * self.options.hatchSpacing
+
+        # Okay, we're going to put these hatch lines into the same
+        # group as the element they hatch.  That element is down
+        # some chain of SVG elements, some of which may have
+        # transforms attached.  But, our hatch lines have been
+        # computed assuming that those transforms have already
+        # been applied (since we had to apply them so as to know
+        # where this element is on the page relative to other
+        # elements and their transforms).  So, we need to invert
+        # the transforms for this element and then either apply
+        # that inverse transform here and now or set it in a
+        # transform attribute of the <path> element.  Having it
+        # set in the path element seems a bit counterintuitive
+        # after the fact (i.e., what's this transform here for?).
+        # So, we compute the inverse transform and apply it here,
+        # to all of this element's segments at once.
+        segments = transformSegments(transform, hatches[0])
+        n_segments = len(segments) // 4
+
+        path = HatchPathBuilder()  # regardless of whether or not we're reducing pen lifts
+        self.pt_last_position_abs = [0, 0]
+        f_distance_moved_with_pen_up = 0
+        if not self.options.reducePenLifts:
+            for i in range(0, 4 * n_segments, 4):
+                x1, y1, x2, y2 = segments[i:i + 4]
+                # Now generate the path data for the <path>
+                if direction:
+                    # Go this direction
+                    path.moveTo(x1, y1)
+                    path.lineTo(x2 - x1, y2 - y1)
+                else:
+                    # Or go this direction
+                    path.moveTo(x2, y2)
+                    path.lineTo(x1 - x2, y1 - y2)
+
+                direction = not direction
+            return path.toPathData(), stroke_width
+
+        else:
+            for i in range(0, 4 * n_segments, 4):
+                if direction:
+                    pt1 = segments[i:i + 2]
+                    pt2 = segments[i + 2:i + 4]
+                else:
+                    pt1 = segments[i + 2:i + 4]
+                    pt2 = segments[i:i + 2]
+                # Now generate the path data for the <path>
+                # BUT we want to combine as many paths as possible to reduce pen lifts.
+                # In order to combine paths, we need to know all of the path segments.
+                # The solution to this conundrum is to generate all path segments,
+                # but instead of drawing them into the path right away, we put them in
+                # an array where they'll be available for random access
+                # by our anti-pen-lift algorithm
+                # False indicates that segment has not yet been drawn
+                abs_line_segments[n_abs_line_segment_total] = [
+                    pt1, pt2, False]
+                n_abs_line_segment_total += 1
+                direction = not direction
+
+            # Now have a nice juicy buffer full of line segments with absolute coordinates
+            f_proposed_neighborhood_radius_squared = self.ProposeNeighborhoodRadiusSquared(
+                transformed_hatch_spacing)
+            # Just fixed and simple for now - may make function of neighborhood later
+
+            # This is the entire range of segments,
+            for ref_count in range(n_abs_line_segment_total):
+                # Sets ref_count to segment which has an end closest to current pen position.
+                # Doesn't need to select which end is closest, as that will happen below, with n_ref_end_index.
+                # When we have gone thru this whole range, we will be completely done.
+                # We only get here again, after all _connected_ segments have been "drawn".
+                # Test whether this segment has been drawn
+                if not abs_line_segments[ref_count][2]:
+                    # Has not been drawn yet
+
+                    # Before we do any irrevocable changes to path, let's see if we are going to be able to append any segments.
+                    # The below solution is inelegant, but has the virtue of being relatively simple to implement.
+                    # Pre-qualify this segment on the issue of whether it has any connecting segments.
+                    # If it does not, then just add the path for this one segment, and go on to the next.
+                    # If it does have connecting segments, we need to go through the recursive logic.
+                    # Lazily, again, select the desired direction of line ahead of time.
+
+                    b_found_segment_to_add = False  # default assumption
+                    n_ref_end_index_at_closest = 0
+                    f_closest_distance_squared = 123456  # just a random large number
+                    for n_ref_end_index in range(2):
+                        pt_reference = abs_line_segments[ref_count][n_ref_end_index]
+                        pt_reference_other_end = abs_line_segments[ref_count][not n_ref_end_index]
+                        f_reference_direction_radians = math.atan2(
+                            pt_reference_other_end[1] - pt_reference[1], pt_reference_other_end[0] - pt_reference[0])  # from other end to this end
+                        # The following is just a simple copy from the routine in recursivelyAppendNearbySegments procedure
+                        # Look through all possibilities to choose the closest that fulfills all requirements e.g. direction and colinearity
+                        # investigate all segments
+                        for innerCount in range(n_abs_line_segment_total):
+                            if not abs_line_segments[innerCount][2]:
+                                # This segment currently undrawn, so it is a candidate for a path extension
+                                # Need to check both ends of each and every proposed segment so we can find the most appropriate one
+                                # Define pt2 in the reference as the end which we want to extend
+                                for nNewSegmentInitialEndIndex in range(2):
+                                    # First try initial end of test segment (aka pt1) vs final end (aka pt2) of reference segment
+                                    if innerCount != ref_count:  # don't investigate self ends
+                                        # proposed initial pt1 X minus existing final pt1 X
+                                        delta_x = abs_line_segments[innerCount][
+                                            nNewSegmentInitialEndIndex][0] - pt_reference[0]
+                                        # proposed initial pt1 Y minus existing final pt1 Y
+                                        delta_y = abs_line_segments[innerCount][
+                                            nNewSegmentInitialEndIndex][1] - pt_reference[1]
+                                        if (delta_x * delta_x + delta_y * delta_y) < f_proposed_neighborhood_radius_squared:
+                                            f_this_distance_squared = delta_x * delta_x + delta_y * delta_y
+                                            pt_new_segment_this_end = abs_line_segments[
+                                                innerCount][nNewSegmentInitialEndIndex]
+                                            pt_new_segment_other_end = abs_line_segments[
+                                                innerCount][not nNewSegmentInitialEndIndex]
+                                            f_new_segment_direction_radians = math.atan2(
+                                                pt_new_segment_this_end[1] - pt_new_segment_other_end[1], pt_new_segment_this_end[0] - pt_new_segment_other_end[0])  # from other end to this end
+                                            # If this end would cause an alternating direction,
+                                            # then exclude it
+                                            if not self.WouldBeAnAlternatingDirection(f_reference_direction_radians, f_new_segment_direction_radians):
+                                                pass
+                                            elif f_this_distance_squared < f_closest_distance_squared:
+                                                # One other thing could rule out choosing this segment end:
+                                                # Want to screen and remove two segments that, while close enough,
+                                                # should be disqualified because they are colinear.  The reason for this is that
+                                                # if they are colinear, they arose from the same global grid line, which means
+                                                # that the gap between them arises from intersections with the boundary.
+                                                # The idea here is that, all things being more-or-less equal,
+                                                # we would like to give preference to connecting to a segment
+                                                # which is the reverse of our current direction.  This makes for better
+                                                # bezier curve join.
+                                                # The criterion for being colinear is that the reference segment angle is effectively
+                                                # the same as the line connecting the reference segment to the end of the new segment.
+                                                f_joiner_direction_radians = math.atan2(
+                                                    pt_new_segment_this_end[1] - pt_reference[1], pt_new_segment_this_end[0] - pt_reference[0])
+                                                if not self.AreCoLinear(f_reference_direction_radians, f_joiner_direction_radians):
+                                                    # not colinear
+                                                    f_closest_distance_squared = f_this_distance_squared
+                                                    b_found_segment_to_add = True
+                                                    n_ref_end_index_at_closest = n_ref_end_index
+
+                    # At last we've looked at all the candidate segment ends, as related to all the reference ends
+                    if not b_found_segment_to_add:
+                        # This segment is solitary.
+                        # Must start a new line, not joined to any previous paths
+                        # end minus start, in original direction
+                        delta_x = abs_line_segments[ref_count][1][0] - \
+                            abs_line_segments[ref_count][0][0]
+                        # end minus start, in original direction
+                        delta_y = abs_line_segments[ref_count][1][1] - \
+                            abs_line_segments[ref_count][0][1]
+                        path.moveTo(abs_line_segments[ref_count][0][0],
+                                    abs_line_segments[ref_count][0][1])
+                        path.lineTo(delta_x, delta_y)  # delta is from initial point
+                        f_distance_moved_with_pen_up += math.hypot(
+                            abs_line_segments[ref_count][0][0] -
+                            self.pt_last_position_abs[0],
+                            abs_line_segments[ref_count][0][1] - self.pt_last_position_abs[1])
+                        self.pt_last_position_abs[0] = abs_line_segments[ref_count][0][0] + delta_x
+                        self.pt_last_position_abs[1] = abs_line_segments[ref_count][0][1] + delta_y
+                        # True flags that this line segment has been
+                        abs_line_segments[ref_count][2] = True
+                        # added to the path to be drawn, so should
+                        # no longer be a candidate for any kind of move.
+                        n_pen_lifts += 1
                     else:
-                        mat_new2 = mat_new
-                    v = node.get('visibility', v)
-                    self.recursivelyTraverseSvg(
-                        refnode, mat_new2, parent_visibility=v)
+                        # Found segment to add, and we must get to it in absolute terms
+                        delta_x = (abs_line_segments[ref_count][n_ref_end_index_at_closest][0] -
+                                   abs_line_segments[ref_count][not n_ref_end_index_at_closest][0])
+                        # final point (which was closer to the closest continuation segment) minus initial point = delta_x
+
+                        delta_y = (abs_line_segments[ref_count][n_ref_end_index_at_closest][1] -
+                                   abs_line_segments[ref_count][not n_ref_end_index_at_closest][1])
+                        # final point (which was closer to the closest continuation segment) minus initial point = delta_y
+
+                        path.moveTo(abs_line_segments[ref_count][not n_ref_end_index_at_closest][0],
+                                    abs_line_segments[ref_count][not n_ref_end_index_at_closest][1])
+                        f_distance_moved_with_pen_up += math.hypot(
+                            abs_line_segments[ref_count][not n_ref_end_index_at_closest][0] -
+                            self.pt_last_position_abs[0],
+                            abs_line_segments[ref_count][not n_ref_end_index_at_closest][1] - self.pt_last_position_abs[1])
+                        self.pt_last_position_abs[0] = abs_line_segments[ref_count][not n_ref_end_index_at_closest][0]
+                        self.pt_last_position_abs[1] = abs_line_segments[ref_count][not n_ref_end_index_at_closest][1]
+                        # Note that this does not complete the line, as the completion (the delta_x, delta_y part) is being held in abeyance
+
+                        # We are coming up on a problem:
+                        # If we add a curve to the end of the line, we have made the curve extend beyond the end of the line,
+                        # and thus beyond the boundaries we should be respecting.
+                        # The solution is to hold in abeyance the actual plotting of the line,
+                        # holding it available for shrinking if a curve is to be added.
+                        # That is
+                        relative_held_line_pos = {0: delta_x, 1: delta_y}
+                        # delta is from initial point
+                        # Will be printed after we know if it must be modified
+                        # to keep the ending join within bounds
+                        self.pt_last_position_abs[0] += delta_x
+                        self.pt_last_position_abs[1] += delta_y
+
+                        # True flags that this line segment has been
+                        abs_line_segments[ref_count][2] = True
+                        # added to the path to be drawn, so should
+                        # no longer be a candidate for any kind of move.
+                        n_pen_lifts += 1
+                        # Now comes the speedup logic:
+                        # We've just drawn a segment starting at an absolute, not relative, position.
+                        # It was drawn from pt1 to pt2.
+                        # Look for an as-yet-not-drawn segment which has a beginning or ending
+                        # point "near" the end point of this absolute draw, and leave the pen down
+                        # while moving to and then drawing this found line.
+                        # Do this recursively, marking each segment True to show that
+                        # it has been "drawn" already.
+                        # pt2 is the reference point, ie. the point from which the next segment will start
+                        self.recursivelyAppendNearbySegments(transformed_hatch_spacing,
+                                                             0,
+                                                             ref_count,
+                                                             n_ref_end_index_at_closest,
+                                                             n_abs_line_segment_total,
+                                                             abs_line_segments,
+                                                             path,
+                                                             relative_held_line_pos)
+
+            return path.toPathData(), stroke_width
 
-            elif node.tag == inkex.addNS('path', 'svg'):
+    def recursivelyAppendNearbySegments(self,
+                                        transformed_hatch_spacing,
+                                        n_recursion_count,
+                                        n_ref_segment_count,
+                                        n_ref_end_index,
+                                        n_abs_line_segment_total,
+                                        abs_line_segments,
+                                        path,
+                                        relative_held_line_pos):
 
-                path_data = node.get('d')
-                if path_data:
-                    self.addPathVertices(path_data, node, mat_new)
-                    # We now have a path we want to apply a (cross)hatch to
-                    # Apply appropriate functions
-                    b_have_grid = self.makeHatchGrid(
-                        float(self.options.hatchAngle), float(self.options.hatchSpacing), True)
-                    if b_have_grid:
-                        if self.options.crossHatch:
-                            self.makeHatchGrid(
-                                float(self.options.hatchAngle + 90.0), float(self.options.hatchSpacing), False)
-                        # Now loop over our hatch lines looking for intersections
-                        for h in self.grid:
-                            interstices(self, (h[0], h[1]), (h[2], h[3]), self.paths, self.hatches,
-                                        self.options.holdBackHatchFromEdges, self.options.holdBackSteps)
+        f_proposed_neighborhood_radius_squared = self.ProposeNeighborhoodRadiusSquared(
+            transformed_hatch_spacing)
 
-            elif node.tag in [inkex.addNS('rect', 'svg'), 'rect']:
+        # Look through all possibilities to choose the closest
+        b_found_segment_to_add = False  # default assumption
+        n_new_segment_end1_index_at_closest = 0
+        n_outer_count_at_closest = -1
+        f_closest_distance_squared = 123456789.0  # just a random large number
 
-                # Manually transform
-                #
-                #    <rect x="X" y="Y" width="W" height="H"/>
-                #
-                # into
-                #
-                #    <path d="MX,Y lW,0 l0,H l-W,0 z"/>
-                #
-                # I.e., explicitly draw three sides of the rectangle and the
-                # fourth side implicitly
+        pt_reference = abs_line_segments[n_ref_segment_count][n_ref_end_index]
+        pt_reference_other_end = abs_line_segments[n_ref_segment_count][not n_ref_end_index]
+        f_reference_delta_x = pt_reference_other_end[0] - pt_reference[0]
+        f_reference_delta_y = pt_reference_other_end[1] - pt_reference[1]
+        f_reference_direction_radians = math.atan2(
+            f_reference_delta_y, f_reference_delta_x)  # from other end to this end
 
-                # Create a path with the outline of the rectangle
-                x = float(node.get('x'))
-                y = float(node.get('y'))
+        for outerCount in range(n_abs_line_segment_total):  # investigate all segments
+            if not abs_line_segments[outerCount][2]:
+                # This segment currently undrawn, so it is a candidate for a path extension
 
-                w = float(node.get('width', '0'))
-                h = float(node.get('height', '0'))
-                a = [['M', [x, y]],
-                     ['l', [w, 0]],
-                     ['l', [0, h]],
-                     ['l', [-w, 0]],
-                     ['Z', []],
-                     ]
-                self.addPathVertices(str(inkex.Path(a)), node, mat_new)
-                # We now have a path we want to apply a (cross)hatch to
-                # Apply appropriate functions
-                b_have_grid = self.makeHatchGrid(
-                    float(self.options.hatchAngle), float(self.options.hatchSpacing), True)
-                if b_have_grid:
-                    if self.options.crossHatch:
-                        self.makeHatchGrid(
-                            float(self.options.hatchAngle + 90.0), float(self.options.hatchSpacing), False)
-                        # Now loop over our hatch lines looking for intersections
-                    for h in self.grid:
-                        interstices(self, (h[0], h[1]), (h[2], h[3]), self.paths, self.hatches,
-                                    self.options.holdBackHatchFromEdges, self.options.holdBackSteps)
+                # Need to check both ends of each and every proposed segment until we find one in the neighborhood
+                # Defines pt2 in the reference as the end which we want to extend
 
-            elif node.tag in [inkex.addNS('line', 'svg'), 'line']:
+                for n_new_segment_end1_index in range(2):
+                    # First try initial end of test segment (aka pt1) vs final end (aka pt2) of reference segment
+                    if outerCount != n_ref_segment_count:  # don't investigate self ends
+                        # proposed initial pt1 X minus existing final pt1 X
+                        delta_x = abs_line_segments[outerCount][n_new_segment_end1_index][0] - \
+                            pt_reference[0]
+                        # proposed initial pt1 Y minus existing final pt1 Y
+                        delta_y = abs_line_segments[outerCount][n_new_segment_end1_index][1] - \
+                            pt_reference[1]
+                        if (delta_x * delta_x + delta_y * delta_y) < f_proposed_neighborhood_radius_squared:
+                            f_this_distance_squared = delta_x * delta_x + delta_y * delta_y
+                            pt_new_segment_this_end = abs_line_segments[outerCount][n_new_segment_end1_index]
+                            pt_new_segment_other_end = abs_line_segments[
+                                outerCount][not n_new_segment_end1_index]
+                            f_new_segment_Dx = pt_new_segment_this_end[0] - \
+                                pt_new_segment_other_end[0]
+                            f_new_segment_Dy = pt_new_segment_this_end[1] - \
+                                pt_new_segment_other_end[1]
+                            f_new_segment_direction_radians = math.atan2(
+                                f_new_segment_Dy, f_new_segment_Dx)  # from other end to this end
+                            if not self.WouldBeAnAlternatingDirection(f_reference_direction_radians, f_new_segment_direction_radians):
+                                # If this end would cause an alternating direction,
+                                # then exclude it regardless of how close it is
+                                pass
 
-                # Convert
-                #
-                #   <line x1="X1" y1="Y1" x2="X2" y2="Y2/>
-                #
-                # to
-                #
-                #   <path d="MX1,Y1 LX2,Y2"/>
+                            elif f_this_distance_squared < f_closest_distance_squared:
+                                # One other thing could rule out choosing this segment end:
+                                # Want to screen and remove two segments that, while close enough,
+                                # should be disqualified because they are colinear.  The reason for this is that
+                                # if they are colinear, they arose from the same global grid line, which means
+                                # that the gap between them arises from intersections with the boundary.
+                                # The idea here is that, all things being more-or-less equal,
+                                # we would like to give preference to connecting to a segment
+                                # which is the reverse of our current direction.  This makes for better
+                                # bezier curve join.
+                                # The criterion for being colinear is that the reference segment angle is effectively
+                                # the same as the line connecting the reference segment to the end of the new segment.
+
+                                f_joiner_direction_radians = math.atan2(
+                                    pt_new_segment_this_end[1] - pt_reference[1], pt_new_segment_this_end[0] - pt_reference[0])
+                                if not self.AreCoLinear(f_reference_direction_radians, f_joiner_direction_radians):
+                                    # not colinear
+                                    f_closest_distance_squared = f_this_distance_squared
+                                    b_found_segment_to_add = True
+                                    n_new_segment_end1_index_at_closest = n_new_segment_end1_index
+                                    n_outer_count_at_closest = outerCount
+                                    delta_x_at_closest = delta_x
+                                    delta_y_at_closest = delta_y
+
+        # At last we've looked at all the candidate segment ends
+        n_recursion_count += 1
+        if not b_found_segment_to_add or n_recursion_count >= RECURSION_LIMIT:
+            path.lineTo(relative_held_line_pos[0],
+                        relative_held_line_pos[1])  # close out this segment
+            self.pt_last_position_abs[0] += relative_held_line_pos[0]
+            self.pt_last_position_abs[1] += relative_held_line_pos[1]
+            return  # No undrawn segments were suitable for appending,
+            # or there were so many that we worry about python recursion limit
+        else:
+            n_new_segment_end1_index = n_new_segment_end1_index_at_closest
+            n_new_segment_end2_index = not n_new_segment_end1_index
+            # n_new_segment_end1_index is 0 for connecting to pt1,
+            # and is 1 for connecting to pt2
+            # count is the index of the segment to be appended.
+            count = n_outer_count_at_closest
+            # delta from final end of incoming segment to initial end of outgoing segment
+            delta_x = delta_x_at_closest
+            delta_y = delta_y_at_closest
+
+            # First, move pen to initial end (may be either its pt1 or its pt2) of new segment
+
+            # Insert a bezier curve for this transition element
+            # To accomplish this, we need information on the incoming and outgoing segments.
+            # Specifically, we need to know the lengths and angles of the segments in
+            # order to decide on control points.
+            f_in_Dx = abs_line_segments[n_ref_segment_count][n_ref_end_index][0] - \
+                abs_line_segments[n_ref_segment_count][not n_ref_end_index][0]
+            f_in_Dy = abs_line_segments[n_ref_segment_count][n_ref_end_index][1] - \
+                abs_line_segments[n_ref_segment_count][not n_ref_end_index][1]
+            # The outgoing deltas are based on the reverse direction of the segment, i.e. the segment pointing back to the joiner bezier curve
+            # index is [count][start point = 0, final point = 1][0=x, 1=y]
+            f_out_Dx = abs_line_segments[count][n_new_segment_end1_index][0] - \
+                abs_line_segments[count][n_new_segment_end2_index][0]
+            f_out_Dy = abs_line_segments[count][n_new_segment_end1_index][1] - \
+                abs_line_segments[count][n_new_segment_end2_index][1]
+
+            length_of_incoming = math.hypot(f_in_Dx, f_in_Dy)
+            length_of_outgoing = math.hypot(f_out_Dx, f_out_Dy)
+
+            # We are going to trim-up the ends of the incoming and outgoing segments,
+            # in order to get a curve which reliably does not extend beyond the boundary.
+            # Crude readings from inkscape on bezier curve overshoot, using control points extended hatch-spacing distance parallel to segment:
+            # when end points are in line, overshoot 12/16 in direction of segment
+            #          when at 45 degrees, overshoot 12/16 in direction of segment
+            #          when at 60 degrees, overshoot 12/16 in direction of segment
+            # Conclusion, at any angle, remove 0.75 * hatch spacing from the length of both lines,
+            # where 0.75 is, by no coincidence, BEZIER_OVERSHOOT_MULTIPLIER
+
+            # If hatches are getting quite short, we can use a smaller Bezier loop at
+            # the end to squeeze into smaller spaces.  We'll use a normal nice smooth
+            # curve for non-short hatches
+            f_desired_shorten_for_smoothest_join = transformed_hatch_spacing * \
+                BEZIER_OVERSHOOT_MULTIPLIER  # This is what we really want to use for smooth curves
+            # Separately check incoming vs outgoing lengths to see if bezier distances must be reduced,
+            # then choose greatest reduction to apply to both - lest we go off-course
+            # Finally, clip reduction to be no less than 1.0
+            f_control_point_divider_incoming = 2.0 * \
+                f_desired_shorten_for_smoothest_join / length_of_incoming
+            f_control_point_divider_outgoing = 2.0 * \
+                f_desired_shorten_for_smoothest_join / length_of_outgoing
+            if f_control_point_divider_incoming > f_control_point_divider_outgoing:
+                f_largest_desired_control_point_divider = f_control_point_divider_incoming
+            else:
+                f_largest_desired_control_point_divider = f_control_point_divider_outgoing
+            if f_largest_desired_control_point_divider < 1.0:
+                f_control_point_divider = 1.0
+            else:
+                f_control_point_divider = f_largest_desired_control_point_divider
+            f_desired_shorten = f_desired_shorten_for_smoothest_join / f_control_point_divider
+
+            pt_delta_to_subtract_from_incoming_end = self.RelativeControlPointPosition(
+                f_desired_shorten, f_in_Dx, f_in_Dy, 0, 0)
+            # Note that this will be subtracted from the _point held in abeyance_.
+            relative_held_line_pos[0] -= pt_delta_to_subtract_from_incoming_end[0]
+            relative_held_line_pos[1] -= pt_delta_to_subtract_from_incoming_end[1]
+
+            pt_delta_to_add_to_outgoing_start = self.RelativeControlPointPosition(
+                f_desired_shorten, f_out_Dx, f_out_Dy, 0, 0)
+
+            # We know that when we tack on a curve, we must chop some off the end of the incoming segment,
+            # and also chop some off the start of the outgoing segment.
+            # Now, we know we want the control points to be on a projection of each segment,
+            # in order that there be no abrupt change of plotting angle.  The question is, how
+            # far beyond the endpoint should we place the control point.
+            pt_relative_control_point_in = self.RelativeControlPointPosition(
+                transformed_hatch_spacing / f_control_point_divider,
+                f_in_Dx,
+                f_in_Dy,
+                0,
+                0)
+            pt_relative_control_point_out = self.RelativeControlPointPosition(
+                transformed_hatch_spacing / f_control_point_divider,
+                f_out_Dx,
+                f_out_Dy,
+                delta_x,
+                delta_y)
+
+            path.lineTo(relative_held_line_pos[0],
+                        relative_held_line_pos[1])  # close out this segment, which has been modified
+            self.pt_last_position_abs[0] += relative_held_line_pos[0]
+            self.pt_last_position_abs[1] += relative_held_line_pos[1]
+            # add bezier cubic curve
+            path.curveTo(pt_relative_control_point_in[0],
+                         pt_relative_control_point_in[1],
+                         pt_relative_control_point_out[0],
+                         pt_relative_control_point_out[1],
+                         delta_x,
+                         delta_y)
+            self.pt_last_position_abs[0] += delta_x
+            self.pt_last_position_abs[1] += delta_y
+            # Next, move pen in appropriate direction to draw the new segment, given that
+            # we have just moved to the initial end of the new segment.
+            # This needs special treatment, as we just did some length changing.
+            delta_x = abs_line_segments[count][n_new_segment_end2_index][0] - \
+                abs_line_segments[count][n_new_segment_end1_index][0] + \
+                pt_delta_to_add_to_outgoing_start[0]
+            delta_y = abs_line_segments[count][n_new_segment_end2_index][1] - \
+                abs_line_segments[count][n_new_segment_end1_index][1] + \
+                pt_delta_to_add_to_outgoing_start[1]
+            relative_held_line_pos[0] = delta_x  # delta is from initial point
+            # Will be printed after we know if it must be modified
+            relative_held_line_pos[1] = delta_y
+
+            # Mark this segment as drawn
+            abs_line_segments[count][2] = True
+
+            self.recursivelyAppendNearbySegments(transformed_hatch_spacing,
+                                                 n_recursion_count,
+                                                 count,
+                                                 n_new_segment_end2_index,
+                                                 n_abs_line_segment_total,
+                                                 abs_line_segments,
+                                                 path,
+                                                 relative_held_line_pos)
+
+    def ProposeNeighborhoodRadiusSquared(self, transformed_hatch_spacing):
+        return transformed_hatch_spacing * transformed_hatch_spacing * self.options.hatchScope * self.options.hatchScope
+        # The multiplier of x generates a radius of x^0.5 times the hatch spacing.
+
+    @staticmethod
+    def RelativeControlPointPosition(distance, f_delta_x, f_delta_y, delta_x, delta_y):
+
+        # returns the point, relative to 0, 0 offset by delta_x, delta_y,
+        # which extends a distance of "distance" at a slope defined by f_delta_x and f_delta_y
+        pt_return = [0, 0]
+
+        if f_delta_x == 0:
+            pt_return[0] = delta_x
+            pt_return[1] = math.copysign(distance, f_delta_y) + delta_y
+        elif f_delta_y == 0:
+            pt_return[0] = math.copysign(distance, f_delta_x) + delta_x
+            pt_return[1] = delta_y
+        else:
+            f_slope = math.atan2(f_delta_y, f_delta_x)
+            pt_return[0] = distance * math.cos(f_slope) + delta_x
+            pt_return[1] = distance * math.sin(f_slope) + delta_y
+
+        return pt_return
+
+    @staticmethod
+    def WouldBeAnAlternatingDirection(f_reference_direction_radians, f_new_segment_direction_radians):
+        # atan2 returns values in the range -pi to +pi, so we must evaluate difference values
+        # in the range of -2*pi to +2*pi
+        # f_dir_diff_rad:  Direction difference, radians
+        f_dir_diff_rad = f_reference_direction_radians - f_new_segment_direction_radians
+        if f_dir_diff_rad < 0:
+            f_dir_diff_rad += 2 * math.pi
+        # Without having changed the vector direction of the difference, we have
+        # now reduced the range to 0 to 2*pi
+        f_dir_diff_rad -= math.pi  # flip opposite direction to coincide with same direction
+        # Of course they may not be _exactly_ pi different due to osmosis, so allow a tolerance
+        b_ret_val = abs(
+            f_dir_diff_rad) < RADIAN_TOLERANCE_FOR_ALTERNATING_DIRECTION
+
+        return b_ret_val
+
+    @staticmethod
+    def AreCoLinear(f_direction_1_radians, f_direction_2_radians):
+        # allow slight difference in angles, for floating-point indeterminacy
+        f_abs_delta_radians = abs(
+            f_direction_1_radians - f_direction_2_radians)
+        if f_abs_delta_radians < RADIAN_TOLERANCE_FOR_COLINEAR:
+            return True
+        elif abs(f_abs_delta_radians - math.pi) < RADIAN_TOLERANCE_FOR_COLINEAR:
+            return True
+        else:
+            return False
+
+
+def hatchElement(job):
+    """
+    Compute the hatch fill for one element; the unit of work handed to
+    the process pool by Eggbot_Hatch.effect().  The job is a tuple of
+    (settings, subpaths, transform), all of which pickle cheaply.
+    """
+
+    settings, subpaths, transform = job
+    return HatchFill(settings).hatch(subpaths, transform)
+
+
+class Eggbot_Hatch(inkex.Effect):
+
+    def __init__(self):
+
+        inkex.Effect.__init__(self)
+
+        self.paths = {}
+        self.transforms = {}
+        self.hashes = {}
+        self.settings = None
+        self.flattenCache = None
+
+        # For handling an SVG viewbox attribute, we will need to know the
+        # values of the document's <svg> width and height attributes as well
+        # as establishing a transform from the viewbox to the display.
+        self.docWidth = float(N_PAGE_WIDTH)
+        self.docHeight = float(N_PAGE_HEIGHT)
+        self.docTransform = [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]]
+
+        self.arg_parser.add_argument(
+            "--holdBackSteps", type=float,
+            dest="holdBackSteps", default=3.0,
+            help="How far hatch strokes stay from boundary (steps)")
+        self.arg_parser.add_argument(
+            "--hatchScope", type=float,
+            dest="hatchScope", default=3.0,
+            help="Radius searched for segments to join (units of hatch width)")
+        self.arg_parser.add_argument(
+            "--holdBackHatchFromEdges", dest="holdBackHatchFromEdges",
+            type=inkex.Boolean, default=True,
+            help="Stay away from edges, so no need for inset")
+        self.arg_parser.add_argument(
+            "--reducePenLifts", dest="reducePenLifts",
+            type=inkex.Boolean, default=True,
+            help="Reduce plotting time by joining some hatches")
+        self.arg_parser.add_argument(
+            "--crossHatch", dest="crossHatch",
+            type=inkex.Boolean, default=False,
+            help="Generate a cross hatch pattern")
+        self.arg_parser.add_argument(
+            "--hatchAngle", type=float,
+            dest="hatchAngle", default=90.0,
+            help="Angle of inclination for hatch lines")
+        self.arg_parser.add_argument(
+            "--hatchSpacing", type=float,
+            dest="hatchSpacing", default=10.0,
+            help="Spacing between hatch lines")
+        self.arg_parser.add_argument(
+            "--tolerance", type=float,
+            dest="tolerance", default=20.0,
+            help="Allowed deviation from original paths")
+        self.arg_parser.add_argument(
+            "--useCache", dest="useCache",
+            type=inkex.Boolean, default=True,
+            help="Reuse flattened shapes from previous runs")
+        self.arg_parser.add_argument(
+            "--jobs", type=int,
+            dest="jobs", default=1,
+            help="Number of processes used to hatch elements (0: one per CPU)")
+        self.arg_parser.add_argument("--tab",  # NOTE: value is not used.
+                                     type=str, dest="tab", default="splash",
+                                     help="The active tab when Apply was pressed")
+
+    def getDocProps(self):
+        """
+        Get the document's height and width attributes from the <svg> tag.
+        Use a default value in case the property is not present or is
+        expressed in units of percentages.
+        """
+
+        self.docHeight = plot_utils.getLength(self, 'height', N_PAGE_HEIGHT)
+        self.docWidth = plot_utils.getLength(self, 'width', N_PAGE_WIDTH)
+
+        if self.docHeight is None or self.docWidth is None:
+            return False
+        else:
+            return True
+
+    def handleViewBox(self):
+        """
+        Set up the document-wide transform in the event that the document has an SVG viewbox
+        """
 
-                x1 = float(node.get('x1'))
-                y1 = float(node.get('y1'))
-                x2 = float(node.get('x2'))
-                y2 = float(node.get('y2'))
+        if self.getDocProps():
+            viewbox = self.document.getroot().get('viewBox')
+            if viewbox:
+                vinfo = viewbox.strip().replace(',', ' ').split(' ')
+                if vinfo[2] != 0 and vinfo[3] != 0:
+                    sx = self.docWidth / float(vinfo[2])
+                    sy = self.docHeight / float(vinfo[3])
+                    self.docTransform = Transform(
+                        'scale({0:f},{1:f})'.format(sx, sy)).matrix
 
-                a = [['M', [x1, y1]],
-                     ['L', [x2, y2]],
-                     ]
-                self.addPathVertices(str(inkex.Path(a)), node, mat_new)
-                # We now have a path we want to apply a (cross)hatch to
-                # Apply appropriate functions
-                b_have_grid = self.makeHatchGrid(
-                    float(self.options.hatchAngle), float(self.options.hatchSpacing), True)
-                if b_have_grid:
-                    if self.options.crossHatch:
-                        self.makeHatchGrid(
-                            float(self.options.hatchAngle + 90.0), float(self.options.hatchSpacing), False)
-                        # Now loop over our hatch lines looking for intersections
-                    for h in self.grid:
-                        interstices(self, (h[0], h[1]), (h[2], h[3]), self.paths, self.hatches,
-                                    self.options.holdBackHatchFromEdges, self.options.holdBackSteps)
+    def addPathVertices(self, path, node=None, transform=None):
+        """
+        Decompose the path data from an SVG element into individual
+        subpaths, each starting with an absolute move-to (x, y)
+        coordinate followed by one or more absolute line-to (x, y)
+        coordinates.  Each subpath is stored as a flat array('d') of
+        x, y coordinates, with the first pair understood to be a
+        move-to coordinate and the rest line-to coordinates.  A list
+        is then made of all the subpath lists and then stored in the
+        self.paths dictionary using the path's lxml.etree node pointer
+        as the dictionary key.
 
-            elif node.tag in [inkex.addNS('polyline', 'svg'), 'polyline']:
+        Flattened results are looked up in, and saved to, self.flattenCache.
 
-                # Convert
-                #
-                #  <polyline points="x1,y1 x2,y2 x3,y3 [...]"/>
-                #
-                # to
-                #
-                #   <path d="Mx1,y1 Lx2,y2 Lx3,y3 [...]"/>
-                #
-                # Note: we ignore polylines with no points
+        Elements already sitting in a hatch group made from the very same
+        path, transform, style and hatch settings are skipped outright.
+        The others are noted in self.hashes, even if they no longer have
+        anything to hatch, so that their old hatches can be cleared away.
+        """
 
-                pl = node.get('points', '').strip()
-                if pl == '':
-                    continue
-                pa = pl.split()
-                if not pa:
-                    continue
-                pathLength = len(pa)
-                if (pathLength < 4):  # Minimum of x1,y1 x2,y2 required.
-                    continue
+        if transform is not None:
+            transform = [list(row) for row in transform]
+        hatch_hash = contentHash(HATCH_HASH_VERSION, path, transform,
+                                 self.options.tolerance, tuple(self.settings),
+                                 node.get('style'), node.get('transform'))
+        group = node.getparent()
+        if group is not None and group.get(HATCH_HASH_ATTRIB) == hatch_hash \
+                and self.hatchFills(group):
+            return
+        self.hashes[node] = hatch_hash
 
-                d = "M " + pa[0] + " " + pa[1]
-                i = 2
-                while (i < (pathLength - 1)):
-                    d += " L " + pa[i] + " " + pa[i + 1]
-                    i += 2
+        if not path or len(path) == 0:
+            return
 
-                if d:
-                    self.addPathVertices(d, node, mat_new)
+        if self.flattenCache is not None:
+            cache_key = FlattenCache.key(path, transform, self.options.tolerance)
+            subpaths = self.flattenCache.get(cache_key)
+            if subpaths is None:
+                subpaths = self.flattenPath(path, transform)
+                self.flattenCache.put(cache_key, subpaths)
+        else:
+            subpaths = self.flattenPath(path, transform)
 
-                    # We now have a path we want to apply a (cross)hatch to
-                    # Apply appropriate functions
-                    b_have_grid = self.makeHatchGrid(
-                        float(self.options.hatchAngle), float(self.options.hatchSpacing), True)
-                    if b_have_grid:
-                        if self.options.crossHatch:
-                            self.makeHatchGrid(
-                                float(self.options.hatchAngle + 90.0), float(self.options.hatchSpacing), False)
-                            # Now loop over our hatch lines looking for intersections
-                        for h in self.grid:
-                            interstices(self, (h[0], h[1]), (h[2], h[3]), self.paths, self.hatches,
-                                        self.options.holdBackHatchFromEdges, self.options.holdBackSteps)
+        # Empty path?
+        if not subpaths:
+            return
 
-            elif node.tag in [inkex.addNS('polygon', 'svg'), 'polygon']:
-                # Convert
-                #
-                #  <polygon points="x1,y1 x2,y2 x3,y3 [...]"/>
-                #
-                # to
-                #
-                #   <path d="Mx1,y1 Lx2,y2 Lx3,y3 [...] Z"/>
-                #
-                # Note: we ignore polygons with no points
+        # And add this path to our dictionary of paths
+        self.paths[node] = subpaths
 
-                pl = node.get('points', '').strip()
+        # And save the transform for this element in a dictionary keyed
+        # by the element's lxml node pointer
+        self.transforms[node] = transform
 
-                pa = pl.split()
-                d = "".join(["M " + pa[i] if i == 0 else " L " + pa[i]
-                            for i in range(0, len(pa))])
-                d += " Z"
-                self.addPathVertices(d, node, mat_new)
-                # We now have a path we want to apply a (cross)hatch to
-                # Apply appropriate functions
-                b_have_grid = self.makeHatchGrid(
-                    float(self.options.hatchAngle), float(self.options.hatchSpacing), True)
-                if b_have_grid:
-                    if self.options.crossHatch:
-                        self.makeHatchGrid(
-                            float(self.options.hatchAngle + 90.0), float(self.options.hatchSpacing), False)
-                        # Now loop over our hatch lines looking for intersections
-                    for h in self.grid:
-                        interstices(self, (h[0], h[1]), (h[2], h[3]), self.paths, self.hatches,
-                                    self.options.holdBackHatchFromEdges, self.options.holdBackSteps)
+    def flattenPath(self, path, transform):
+        """
+        Parse, transform and flatten the path data, returning the list of
+        its closed subpaths as flat vertex arrays (see addPathVertices).
+        """
 
-            elif node.tag in [inkex.addNS('ellipse', 'svg'), 'ellipse',
-                              inkex.addNS('circle', 'svg'), 'circle']:
+        # parsePath() may raise an exception.  This is okay
+        path = inkex.Path(path)
 
-                # Convert circles and ellipses to a path with two 180 degree arcs.
-                # In general (an ellipse), we convert
-                #
-                #   <ellipse rx="RX" ry="RY" cx="X" cy="Y"/>
-                #
-                # to
-                #
-                #   <path d="MX1,CY A RX,RY 0 1 0 X2,CY A RX,RY 0 1 0 X1,CY"/>
-                #
-                # where
-                #
-                #   X1 = CX - RX
-                #   X2 = CX + RX
-                #
-                # Note: ellipses or circles with a radius attribute of value 0 are ignored
+        # Apply any transformation, so that the vertices of every
+        # element are in the same (document) coordinate system
+        if transform is not None:
+            path = path.transform(Transform(transform))
 
-                if node.tag in [inkex.addNS('ellipse', 'svg'), 'ellipse']:
-                    rx = float(node.get('rx', '0'))
-                    ry = float(node.get('ry', '0'))
-                else:
-                    rx = float(node.get('r', '0'))
-                    ry = rx
+        sp = path.to_arrays()
+        if not sp or len(sp) == 0:
+            return []
 
-                cx = float(node.get('cx', '0'))
-                cy = float(node.get('cy', '0'))
-                x1 = cx - rx
-                x2 = cx + rx
+        # Get a cubic super duper path
+        p = CubicSuperPath(sp)
+        if not p or len(p) == 0:
+            return []
 
-                d = 'M {x1:f},{cy:f} ' \
-                    'A {rx:f},{ry:f} ' \
-                    '0 1 0 {x2:f},{cy:f} ' \
-                    'A {rx:f},{ry:f} ' \
-                    '0 1 0 {x1:f},{cy:f}'.format(x1=x1,
-                                                 x2=x2,
-                                                 rx=rx,
-                                                 ry=ry,
-                                                 cy=cy)
-                self.addPathVertices(d, node, mat_new)
-                # We now have a path we want to apply a (cross)hatch to
-                # Apply appropriate functions
-                b_have_grid = self.makeHatchGrid(
-                    float(self.options.hatchAngle), float(self.options.hatchSpacing), True)
-                if b_have_grid:
-                    if self.options.crossHatch:
-                        self.makeHatchGrid(
-                            float(self.options.hatchAngle + 90.0), float(self.options.hatchSpacing), False)
-                    # Now loop over our hatch lines looking for intersections
-                    for h in self.grid:
-                        interstices(self, (h[0], h[1]), (h[2], h[3]), self.paths, self.hatches,
-                                    self.options.holdBackHatchFromEdges, self.options.holdBackSteps)
+        # Now traverse the simplified path
+        subpaths = []
+        subpath_vertices = array('d')
+        for sp in p:
+            # We've started a new subpath
+            # See if there is a prior subpath and whether we should keep it
+            if len(subpath_vertices):
+                if distanceSquared(subpath_vertices[0:2], subpath_vertices[-2:]) < 1:
+                    # Keep the prior subpath: it appears to be a closed path
+                    subpaths.append(subpath_vertices)
+            subpath_vertices = array('d')
+            subdivideCubicPath(sp, float(self.options.tolerance / 100))
+            for csp in sp:
+                # Add this vertex to the list of vertices
+                subpath_vertices.extend(csp[1])
 
-            elif node.tag in [inkex.addNS('pattern', 'svg'), 'pattern']:
-                pass
-            elif node.tag in [inkex.addNS('metadata', 'svg'), 'metadata']:
-                pass
-            elif node.tag in [inkex.addNS('defs', 'svg'), 'defs']:
-                pass
-            elif node.tag in [inkex.addNS('namedview', 'sodipodi'), 'namedview']:
-                pass
-            elif node.tag in [inkex.addNS('eggbot', 'svg'), 'eggbot']:
-                pass
-            elif node.tag in [inkex.addNS('WCB', 'svg'), 'WCB']:
-                pass
-            elif node.tag in [inkex.addNS('text', 'svg'), 'text']:
-                inkex.errormsg(
-                    'Warning: unable to draw text, please convert it to a path first.')
-                pass
-            elif not isinstance(node.tag, basestring):
-                pass
-            else:
-                inkex.errormsg(
-                    'Warning: unable to hatch object <{0}>, please convert it to a path first.'.format(node.tag))
-                pass
+        # Handle final subpath
+        if len(subpath_vertices):
+            if distanceSquared(subpath_vertices[0:2], subpath_vertices[-2:]) < 1:
+                # Path appears to be closed so let's keep it
+                subpaths.append(subpath_vertices)
 
-    def joinFillsWithNode(self, node, stroke_width, path):
-        """
-        Generate a SVG <path> element containing the path data "path".
-        Then put this new <path> element into a <group> with the supplied
-        node.  This means making a new <group> element and moving node
-        under it with the new <path> as a sibling element.
+        return subpaths
+
+    def recursivelyTraverseSvg(self, a_node_list, mat_current=None, parent_visibility='visible'):
         """
+        Recursively walk the SVG document, building polygon vertex lists
+        for each graphical element we support.
 
-        if not path or len(path) == 0:
-            return
+        Rendered SVG elements:
+            <circle>, <ellipse>, <line>, <path>, <polygon>, <polyline>, <rect>
 
-        # Make a new SVG <group> element whose parent is the parent of node
-        parent = node.getparent()
-        if parent is None:
-            parent = self.document.getroot()
-        g = etree.SubElement(parent, inkex.addNS('g', 'svg'))
-        # Move node to be a child of this new <g> element
-        g.append(node)
+        Supported SVG elements:
+            <group>, <use>
 
-        # Now make a <path> element which contains the hatches & is a child
-        # of the new <g> element
-        stroke_color = '#000000'  # default assumption
-        stroke_width = '1.0'  # default value
+        Ignored SVG elements:
+            <defs>, <eggbot>, <metadata>, <namedview>, <pattern>
 
-        try:
-            style = node.get('style')
-            if style is not None:
-                declarations = style.split(';')
-                for i, declaration in enumerate(declarations):
-                    parts = declaration.split(':', 2)
-                    if len(parts) == 2:
-                        (prop, val) = parts
-                        prop = prop.strip().lower()
-                        if prop == 'stroke-width':
-                            stroke_width = val.strip()
-                        elif prop == 'stroke':
-                            val = val.strip()
-                            stroke_color = val
-        finally:
-            style = {'stroke': '{0}'.format(
-                stroke_color), 'fill': 'none', 'stroke-width': '{0}'.format(stroke_width)}
-            line_attribs = {'style': str(inkex.Style(style)), 'd': path}
-            tran = node.get('transform')
-            if tran is not None and tran != '':
-                line_attribs['transform'] = tran
-            etree.SubElement(g, inkex.addNS('path', 'svg'), line_attribs)
+        All other SVG elements trigger an error (including <text>)
 
-    # returns True if succeeds in making grid, else False
-    def makeHatchGrid(self, angle, spacing, init=True):
-        """
-        Build a grid of hatch lines which encompasses the entire bounding
-        box of the graphical elements we are to hatch.
+        Once a supported graphical element is found, its flattened polygons
+        and its transform are stored in self.paths and self.transforms,
+        keyed by the element's lxml node pointer.  The effect method then
+        hatches each element independently and hands the result to
+        joinFillsWithNode()
 
-        1. Figure out the bounding box for all of the graphical elements
-        2. Pick a rectangle larger than that bounding box so that we can
-           later rotate the rectangle and still have it cover the bounding
-           box of the graphical elements.
-        3. Center the rectangle of 2 on the origin (0, 0).
-        4. Build the hatch line grid in this rectangle.
-        5. Rotate the rectangle by the hatch angle.
-        6. Translate the center of the rotated rectangle, (0, 0), to be
-           the center of the bounding box for the graphical elements.
-        7. We now have a grid of hatch lines which overlay the graphical
-           elements and can now be intersected with those graphical elements.
         """
+        if mat_current is None:
+            mat_current = [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]]
+        for node in a_node_list:
 
-        # If this is the first call, do some one time initializations
-        # When generating cross hatches, we may be called more than once
-        if init:
-            self.getBoundingBox()
-            self.grid = []
+            # Ignore invisible nodes
+            v = node.get('visibility', parent_visibility)
+            if v == 'inherit':
+                v = parent_visibility
+            if v == 'hidden' or v == 'collapse':
+                pass
 
-        # Determine the width and height of the bounding box containing
-        # all the polygons to be hatched
-        w = self.xmax - self.xmin
-        h = self.ymax - self.ymin
+            # first apply the current matrix transform to this node's transform
+            mat_new = (Transform(mat_current) *
+                       Transform(node.get("transform"))).matrix
 
-        b_bounding_box_exists = (
-            (w != (EXTREME_NEG - EXTREME_POS)) and (h != (EXTREME_NEG - EXTREME_POS)))
-        ret_value = b_bounding_box_exists
+            if node.tag in [inkex.addNS('g', 'svg'), 'g']:
+                self.recursivelyTraverseSvg(
+                    node, mat_new, parent_visibility=v)
 
-        if b_bounding_box_exists:
-            # Nice thing about rectangles is that the diameter of the circle
-            # encompassing them is the length the rectangle's diagonal...
-            r = math.sqrt(w * w + h * h) / 2.0
+            elif node.tag in [inkex.addNS('use', 'svg'), 'use']:
 
-            # Length of a hatch line will be 2r
-            # Now generate hatch lines within the square
-            # centered at (0, 0) and with side length at least d
+                # A <use> element refers to another SVG element via an xlink:href="#blah"
+                # attribute.  We will handle the element by doing an XPath search through
+                # the document, looking for the element with the matching id="blah"
+                # attribute.  We then recursively process that element after applying
+                # any necessary (x,y) translation.
+                #
+                # Notes:
+                #  1. We ignore the height and width attributes as they do not apply to
+                #     path-like elements, and
+                #  2. Even if the use element has visibility="hidden", SVG still calls
+                #     for processing the referenced element.  The referenced element is
+                #     hidden only if its visibility is "inherit" or "hidden".
 
-            # While we could generate these lines running back and forth,
-            # that makes for weird behavior later when applying odd/even
-            # rules AND there are nested polygons.  Instead, when we
-            # generate the SVG <path> elements with the hatch line
-            # segments, we can do the back and forth weaving.
+                refid = node.get(inkex.addNS('href', 'xlink'))
 
-            # Rotation information
-            ca = math.cos(math.radians(90 - angle))
-            sa = math.sin(math.radians(90 - angle))
+                # [1:] to ignore leading '#' in reference
+                path = '//*[@id="{0}"]'.format(refid[1:])
+                refnode = node.xpath(path)
+                if refnode:
+                    x = float(node.get('x', '0'))
+                    y = float(node.get('y', '0'))
+                    # Note: the transform has already been applied
+                    if x != 0 or y != 0:
+                        mat_new2 = (Transform(
+                            mat_new) * Transform('translate({0:f},{1:f})'.format(x, y))).matrix
+                    else:
+                        mat_new2 = mat_new
+                    v = node.get('visibility', v)
+                    self.recursivelyTraverseSvg(
+                        refnode, mat_new2, parent_visibility=v)
 
-            # Translation information
-            cx = self.xmin + (w / 2)
-            cy = self.ymin + (h / 2)
+            elif node.tag == inkex.addNS('path', 'svg'):
 
-            # Since the spacing may be fractional (e.g., 6.5), we
-            # don't try to use range() or other integer iterator
-            spacing = float(abs(spacing))
-            i = -r
-            while i <= r:
-                # Line starts at (i, -r) and goes to (i, +r)
-                x1 = cx + (i * ca) + (r * sa)  # i * ca - (-r) * sa
-                y1 = cy + (i * sa) - (r * ca)  # i * sa + (-r) * ca
-                x2 = cx + (i * ca) - (r * sa)  # i * ca - (+r) * sa
-                y2 = cy + (i * sa) + (r * ca)  # i * sa + (+r) * ca
-                i += spacing
-                # Remove any potential hatch lines which are entirely
-                # outside of the bounding box
-                if (x1 < self.xmin and x2 < self.xmin) or (x1 > self.xmax and x2 > self.xmax):
-                    continue
-                if (y1 < self.ymin and y2 < self.ymin) or (y1 > self.ymax and y2 > self.ymax):
+                # Hatches we generated on an earlier run are not to be filled
+                if node.get(HATCH_FILL_ATTRIB) is not None:
                     continue
-                self.grid.append((x1, y1, x2, y2))
 
-        return ret_value
+                path_data = node.get('d')
+                if path_data:
+                    self.addPathVertices(path_data, node, mat_new)
 
-    def effect(self):
+            elif node.tag in [inkex.addNS('rect', 'svg'), 'rect']:
 
-        global ref_count
-        global pt_last_position_abs
-        # Viewbox handling
-        self.handleViewBox()
+                # Manually transform
+                #
+                #    <rect x="X" y="Y" width="W" height="H"/>
+                #
+                # into
+                #
+                #    <path d="MX,Y lW,0 l0,H l-W,0 z"/>
+                #
+                # I.e., explicitly draw three sides of the rectangle and the
+                # fourth side implicitly
 
-        if self.options.hatchSpacing == 0:
-            self.options.hatchSpacing = 0.1  # Hardcode minimum value
+                # Create a path with the outline of the rectangle
+                x = float(node.get('x'))
+                y = float(node.get('y'))
 
-        ref_count = 0
-        pt_last_position_abs = [0, 0]
+                w = float(node.get('width', '0'))
+                h = float(node.get('height', '0'))
+                a = [['M', [x, y]],
+                     ['l', [w, 0]],
+                     ['l', [0, h]],
+                     ['l', [-w, 0]],
+                     ['Z', []],
+                     ]
+                self.addPathVertices(str(inkex.Path(a)), node, mat_new)
 
-        # Build a list of the vertices for the document's graphical elements
-        if self.options.ids:
-            # Traverse the selected objects
-            for id_ in self.options.ids:
-                self.recursivelyTraverseSvg(
-                    [self.svg.selected[id_]], self.docTransform)
-        else:
-            # Traverse the entire document
-            self.recursivelyTraverseSvg(
-                self.document.getroot(), self.docTransform)
+            elif node.tag in [inkex.addNS('line', 'svg'), 'line']:
 
-        # After recursively traversing the svg, we will have a dictionary of transforms and hatches
-        # Target stroke width will be (doc width + doc height) / 2 / 1000
-        # stroke_width_target = ( self.docHeight + self.docWidth ) / 2000
-        # stroke_width_target = 1
-        stroke_width_target = 1
-        # Each hatch line stroke will be within an SVG object which may
-        # be subject to transforms.  So, on an object by object basis,
-        # we need to transform our target width to a width suitable
-        # for that object (so that after the object and its hatches are
-        # transformed, the result has the desired width).
+                # Convert
+                #
+                #   <line x1="X1" y1="Y1" x2="X2" y2="Y2/>
+                #
+                # to
+                #
+                #   <path d="MX1,Y1 LX2,Y2"/>
 
-        # To aid in the process, we use a diagonal line segment of length
-        # stroke_width_target.  We then run this segment through an object's
-        # inverse transform and see what the resulting length of the inversely
-        # transformed segment is.  We could, alternatively, look at the
-        # x and y scaling factors in the transform and average them.
-        s = stroke_width_target / math.sqrt(2)
+                x1 = float(node.get('x1'))
+                y1 = float(node.get('y1'))
+                x2 = float(node.get('x2'))
+                y2 = float(node.get('y2'))
 
-        # Now, dump the hatch fills sorted by which document element
-        # they correspond to.  This is made easy by the fact that we
-        # saved the information and used each element's lxml.etree node
-        # pointer as the dictionary key under which to save the hatch
-        # fills for that node.
+                a = [['M', [x1, y1]],
+                     ['L', [x2, y2]],
+                     ]
+                self.addPathVertices(str(inkex.Path(a)), node, mat_new)
 
-        abs_line_segments = {}  # Absolute line segments
-        n_abs_line_segment_total = 0
-        n_pen_lifts = 0
-        # To implement
-        for key in self.hatches:
-            direction = True
-            if key in self.transforms:
-                transform = inverseTransform(self.transforms[key])
-                # Determine the scaled stroke width for a hatch line
-                # We produce a line segment of unit length, transform
-                # its endpoints and then determine the length of the
-                # resulting line segment.
-                pt1 = [0, 0]
-                pt2 = [s, s]
-                Transform(transform).apply_to_point(pt1)
-                Transform(transform).apply_to_point(pt2)
-                dx = pt2[0] - pt1[0]
-                dy = pt2[1] - pt1[1]
-                stroke_width = math.sqrt(dx * dx + dy * dy)
-            else:
-                transform = None
-                stroke_width = 1.0
-
-            # The transform also applies to the hatch spacing we use when searching for end connections
-            transformed_hatch_spacing = stroke_width * self.options.hatchSpacing
-
-            path = ''  # regardless of whether or not we're reducing pen lifts
-            pt_last_position_abs = [0, 0]
-            pt_last_position_abs[0] = 0
-            pt_last_position_abs[1] = 0
-            f_distance_moved_with_pen_up = 0
-            if not self.options.reducePenLifts:
-                for segment in self.hatches[key]:
-                    if len(segment) < 2:
-                        continue
-                    pt1 = segment[0]
-                    pt2 = segment[1]
-                    # Okay, we're going to put these hatch lines into the same
-                    # group as the element they hatch.  That element is down
-                    # some chain of SVG elements, some of which may have
-                    # transforms attached.  But, our hatch lines have been
-                    # computed assuming that those transforms have already
-                    # been applied (since we had to apply them so as to know
-                    # where this element is on the page relative to other
-                    # elements and their transforms).  So, we need to invert
-                    # the transforms for this element and then either apply
-                    # that inverse transform here and now or set it in a
-                    # transform attribute of the <path> element.  Having it
-                    # set in the path element seems a bit counterintuitive
-                    # after the fact (i.e., what's this transform here for?).
-                    # So, we compute the inverse transform and apply it here.
-                    if transform is not None:
-                        Transform(transform).apply_to_point(pt1)
-                        Transform(transform).apply_to_point(pt2)
-                    # Now generate the path data for the <path>
-                    if direction:
-                        # Go this direction
-                        path += ('M {0:f},{1:f} l {2:f},{3:f} '.format(
-                            pt1[0], pt1[1], pt2[0] - pt1[0], pt2[1] - pt1[1]))
-                    else:
-                        # Or go this direction
-                        path += ('M {0:f},{1:f} l {2:f},{3:f} '.format(
-                            pt2[0], pt2[1], pt1[0] - pt2[0], pt1[1] - pt2[1]))
+            elif node.tag in [inkex.addNS('polyline', 'svg'), 'polyline']:
 
-                    direction = not direction
-                self.joinFillsWithNode(key, stroke_width, path[:-1])
+                # Convert
+                #
+                #  <polyline points="x1,y1 x2,y2 x3,y3 [...]"/>
+                #
+                # to
+                #
+                #   <path d="Mx1,y1 Lx2,y2 Lx3,y3 [...]"/>
+                #
+                # Note: we ignore polylines with no points
 
-            else:
-                for segment in self.hatches[key]:
-                    # Copied from original, no idea why this is needed [sbm]
-                    if len(segment) < 2:
-                        continue
-                    if direction:
-                        pt1 = segment[0]
-                        pt2 = segment[1]
-                    else:
-                        pt1 = segment[1]
-                        pt2 = segment[0]
-                    # Okay, we're going to put these hatch lines into the same
-                    # group as the element they hatch.  That element is down
-                    # some chain of SVG elements, some of which may have
-                    # transforms attached.  But, our hatch lines have been
-                    # computed assuming that those transforms have already
-                    # been applied (since we had to apply them so as to know
-                    # where this element is on the page relative to other
-                    # elements and their transforms).  So, we need to invert
-                    # the transforms for this element and then either apply
-                    # that inverse transform here and now or set it in a
-                    # transform attribute of the <path> element.  Having it
-                    # set in the path element seems a bit counterintuitive
-                    # after the fact (i.e., what's this transform here for?).
-                    # So, we compute the inverse transform and apply it here.
-                    if transform is not None:
-                        Transform(transform).apply_to_point(pt1)
-                        Transform(transform).apply_to_point(pt2)
-
-                    # Now generate the path data for the <path>
-                    # BUT we want to combine as many paths as possible to reduce pen lifts.
-                    # In order to combine paths, we need to know all of the path segments.
-                    # The solution to this conundrum is to generate all path segments,
-                    # but instead of drawing them into the path right away, we put them in
-                    # an array where they'll be available for random access
-                    # by our anti-pen-lift algorithm
-                    # False indicates that segment has not yet been drawn
-                    abs_line_segments[n_abs_line_segment_total] = [
-                        pt1, pt2, False]
-                    n_abs_line_segment_total += 1
-                    direction = not direction
-
-                # Now have a nice juicy buffer full of line segments with absolute coordinates
-                f_proposed_neighborhood_radius_squared = self.ProposeNeighborhoodRadiusSquared(
-                    transformed_hatch_spacing)
-                # Just fixed and simple for now - may make function of neighborhood later
-
-                # This is the entire range of segments,
-                for ref_count in range(n_abs_line_segment_total):
-                    # Sets global ref_count to segment which has an end closest to current pen position.
-                    # Doesn't need to select which end is closest, as that will happen below, with n_ref_end_index.
-                    # When we have gone thru this whole range, we will be completely done.
-                    # We only get here again, after all _connected_ segments have been "drawn".
-                    # Test whether this segment has been drawn
-                    if not abs_line_segments[ref_count][2]:
-                        # Has not been drawn yet
-
-                        # Before we do any irrevocable changes to path, let's see if we are going to be able to append any segments.
-                        # The below solution is inelegant, but has the virtue of being relatively simple to implement.
-                        # Pre-qualify this segment on the issue of whether it has any connecting segments.
-                        # If it does not, then just add the path for this one segment, and go on to the next.
-                        # If it does have connecting segments, we need to go through the recursive logic.
-                        # Lazily, again, select the desired direction of line ahead of time.
-
-                        b_found_segment_to_add = False  # default assumption
-                        n_ref_end_index_at_closest = 0
-                        f_closest_distance_squared = 123456  # just a random large number
-                        for n_ref_end_index in range(2):
-                            pt_reference = abs_line_segments[ref_count][n_ref_end_index]
-                            pt_reference_other_end = abs_line_segments[ref_count][not n_ref_end_index]
-                            f_reference_direction_radians = math.atan2(
-                                pt_reference_other_end[1] - pt_reference[1], pt_reference_other_end[0] - pt_reference[0])  # from other end to this end
-                            # The following is just a simple copy from the routine in recursivelyAppendNearbySegments procedure
-                            # Look through all possibilities to choose the closest that fulfills all requirements e.g. direction and colinearity
-                            # investigate all segments
-                            for innerCount in range(n_abs_line_segment_total):
-                                if not abs_line_segments[innerCount][2]:
-                                    # This segment currently undrawn, so it is a candidate for a path extension
-                                    # Need to check both ends of each and every proposed segment so we can find the most appropriate one
-                                    # Define pt2 in the reference as the end which we want to extend
-                                    for nNewSegmentInitialEndIndex in range(2):
-                                        # First try initial end of test segment (aka pt1) vs final end (aka pt2) of reference segment
-                                        if innerCount != ref_count:  # don't investigate self ends
-                                            # proposed initial pt1 X minus existing final pt1 X
-                                            delta_x = abs_line_segments[innerCount][
-                                                nNewSegmentInitialEndIndex][0] - pt_reference[0]
-                                            # proposed initial pt1 Y minus existing final pt1 Y
-                                            delta_y = abs_line_segments[innerCount][
-                                                nNewSegmentInitialEndIndex][1] - pt_reference[1]
-                                            if (delta_x * delta_x + delta_y * delta_y) < f_proposed_neighborhood_radius_squared:
-                                                f_this_distance_squared = delta_x * delta_x + delta_y * delta_y
-                                                pt_new_segment_this_end = abs_line_segments[
-                                                    innerCount][nNewSegmentInitialEndIndex]
-                                                pt_new_segment_other_end = abs_line_segments[
-                                                    innerCount][not nNewSegmentInitialEndIndex]
-                                                f_new_segment_direction_radians = math.atan2(
-                                                    pt_new_segment_this_end[1] - pt_new_segment_other_end[1], pt_new_segment_this_end[0] - pt_new_segment_other_end[0])  # from other end to this end
-                                                # If this end would cause an alternating direction,
-                                                # then exclude it
-                                                if not self.WouldBeAnAlternatingDirection(f_reference_direction_radians, f_new_segment_direction_radians):
-                                                    pass
-                                                elif f_this_distance_squared < f_closest_distance_squared:
-                                                    # One other thing could rule out choosing this segment end:
-                                                    # Want to screen and remove two segments that, while close enough,
-                                                    # should be disqualified because they are colinear.  The reason for this is that
-                                                    # if they are colinear, they arose from the same global grid line, which means
-                                                    # that the gap between them arises from intersections with the boundary.
-                                                    # The idea here is that, all things being more-or-less equal,
-                                                    # we would like to give preference to connecting to a segment
-                                                    # which is the reverse of our current direction.  This makes for better
-                                                    # bezier curve join.
-                                                    # The criterion for being colinear is that the reference segment angle is effectively
-                                                    # the same as the line connecting the reference segment to the end of the new segment.
-                                                    f_joiner_direction_radians = math.atan2(
-                                                        pt_new_segment_this_end[1] - pt_reference[1], pt_new_segment_this_end[0] - pt_reference[0])
-                                                    if not self.AreCoLinear(f_reference_direction_radians, f_joiner_direction_radians):
-                                                        # not colinear
-                                                        f_closest_distance_squared = f_this_distance_squared
-                                                        b_found_segment_to_add = True
-                                                        n_ref_end_index_at_closest = n_ref_end_index
-
-                        # At last we've looked at all the candidate segment ends, as related to all the reference ends
-                        if not b_found_segment_to_add:
-                            # This segment is solitary.
-                            # Must start a new line, not joined to any previous paths
-                            # end minus start, in original direction
-                            delta_x = abs_line_segments[ref_count][1][0] - \
-                                abs_line_segments[ref_count][0][0]
-                            # end minus start, in original direction
-                            delta_y = abs_line_segments[ref_count][1][1] - \
-                                abs_line_segments[ref_count][0][1]
-                            path += ('M {0:f},{1:f} l {2:f},{3:f} '.format(abs_line_segments[ref_count][0][0],
-                                                                           abs_line_segments[ref_count][0][1],
-                                                                           delta_x,
-                                                                           delta_y))  # delta is from initial point
-                            f_distance_moved_with_pen_up += math.hypot(
-                                abs_line_segments[ref_count][0][0] -
-                                pt_last_position_abs[0],
-                                abs_line_segments[ref_count][0][1] - pt_last_position_abs[1])
-                            pt_last_position_abs[0] = abs_line_segments[ref_count][0][0] + delta_x
-                            pt_last_position_abs[1] = abs_line_segments[ref_count][0][1] + delta_y
-                            # True flags that this line segment has been
-                            abs_line_segments[ref_count][2] = True
-                            # added to the path to be drawn, so should
-                            # no longer be a candidate for any kind of move.
-                            n_pen_lifts += 1
-                        else:
-                            # Found segment to add, and we must get to it in absolute terms
-                            delta_x = (abs_line_segments[ref_count][n_ref_end_index_at_closest][0] -
-                                       abs_line_segments[ref_count][not n_ref_end_index_at_closest][0])
-                            # final point (which was closer to the closest continuation segment) minus initial point = delta_x
-
-                            delta_y = (abs_line_segments[ref_count][n_ref_end_index_at_closest][1] -
-                                       abs_line_segments[ref_count][not n_ref_end_index_at_closest][1])
-                            # final point (which was closer to the closest continuation segment) minus initial point = delta_y
-
-                            path += ('M {0:f},{1:f} l '.format(abs_line_segments[ref_count][not n_ref_end_index_at_closest][0],
-                                                               abs_line_segments[ref_count][not n_ref_end_index_at_closest][1]))
-                            f_distance_moved_with_pen_up += math.hypot(
-                                abs_line_segments[ref_count][not n_ref_end_index_at_closest][0] -
-                                pt_last_position_abs[0],
-                                abs_line_segments[ref_count][not n_ref_end_index_at_closest][1] - pt_last_position_abs[1])
-                            pt_last_position_abs[0] = abs_line_segments[ref_count][not n_ref_end_index_at_closest][0]
-                            pt_last_position_abs[1] = abs_line_segments[ref_count][not n_ref_end_index_at_closest][1]
-                            # Note that this does not complete the line, as the completion (the delta_x, delta_y part) is being held in abeyance
-
-                            # We are coming up on a problem:
-                            # If we add a curve to the end of the line, we have made the curve extend beyond the end of the line,
-                            # and thus beyond the boundaries we should be respecting.
-                            # The solution is to hold in abeyance the actual plotting of the line,
-                            # holding it available for shrinking if a curve is to be added.
-                            # That is
-                            relative_held_line_pos = {0: delta_x, 1: delta_y}
-                            # delta is from initial point
-                            # Will be printed after we know if it must be modified
-                            # to keep the ending join within bounds
-                            pt_last_position_abs[0] += delta_x
-                            pt_last_position_abs[1] += delta_y
-
-                            # True flags that this line segment has been
-                            abs_line_segments[ref_count][2] = True
-                            # added to the path to be drawn, so should
-                            # no longer be a candidate for any kind of move.
-                            n_pen_lifts += 1
-                            # Now comes the speedup logic:
-                            # We've just drawn a segment starting at an absolute, not relative, position.
-                            # It was drawn from pt1 to pt2.
-                            # Look for an as-yet-not-drawn segment which has a beginning or ending
-                            # point "near" the end point of this absolute draw, and leave the pen down
-                            # while moving to and then drawing this found line.
-                            # Do this recursively, marking each segment True to show that
-                            # it has been "drawn" already.
-                            # pt2 is the reference point, ie. the point from which the next segment will start
-                            path = self.recursivelyAppendNearbySegments(transformed_hatch_spacing,
-                                                                        0,
-                                                                        ref_count,
-                                                                        n_ref_end_index_at_closest,
-                                                                        n_abs_line_segment_total,
-                                                                        abs_line_segments,
-                                                                        path,
-                                                                        relative_held_line_pos)
-
-                self.joinFillsWithNode(key, stroke_width, path[:-1])
+                pl = node.get('points', '').strip()
+                if pl == '':
+                    continue
+                pa = pl.split()
+                if not pa:
+                    continue
+                pathLength = len(pa)
+                if (pathLength < 4):  # Minimum of x1,y1 x2,y2 required.
+                    continue
 
-    def recursivelyAppendNearbySegments(self,
-                                        transformed_hatch_spacing,
-                                        n_recursion_count,
-                                        n_ref_segment_count,
-                                        n_ref_end_index,
-                                        n_abs_line_segment_total,
-                                        abs_line_segments,
-                                        cumulative_path,
-                                        relative_held_line_pos):
+                d = "M " + pa[0] + " " + pa[1]
+                i = 2
+                while (i < (pathLength - 1)):
+                    d += " L " + pa[i] + " " + pa[i + 1]
+                    i += 2
 
-        global pt_last_position_abs
-        f_proposed_neighborhood_radius_squared = self.ProposeNeighborhoodRadiusSquared(
-            transformed_hatch_spacing)
+                if d:
+                    self.addPathVertices(d, node, mat_new)
 
-        # Look through all possibilities to choose the closest
-        b_found_segment_to_add = False  # default assumption
-        n_new_segment_end1_index_at_closest = 0
-        n_outer_count_at_closest = -1
-        f_closest_distance_squared = 123456789.0  # just a random large number
+            elif node.tag in [inkex.addNS('polygon', 'svg'), 'polygon']:
+                # Convert
+                #
+                #  <polygon points="x1,y1 x2,y2 x3,y3 [...]"/>
+                #
+                # to
+                #
+                #   <path d="Mx1,y1 Lx2,y2 Lx3,y3 [...] Z"/>
+                #
+                # Note: we ignore polygons with no points
 
-        pt_reference = abs_line_segments[n_ref_segment_count][n_ref_end_index]
-        pt_reference_other_end = abs_line_segments[n_ref_segment_count][not n_ref_end_index]
-        f_reference_delta_x = pt_reference_other_end[0] - pt_reference[0]
-        f_reference_delta_y = pt_reference_other_end[1] - pt_reference[1]
-        f_reference_direction_radians = math.atan2(
-            f_reference_delta_y, f_reference_delta_x)  # from other end to this end
+                pl = node.get('points', '').strip()
 
-        for outerCount in range(n_abs_line_segment_total):  # investigate all segments
-            if not abs_line_segments[outerCount][2]:
-                # This segment currently undrawn, so it is a candidate for a path extension
+                pa = pl.split()
+                d = "".join(["M " + pa[i] if i == 0 else " L " + pa[i]
+                            for i in range(0, len(pa))])
+                d += " Z"
+                self.addPathVertices(d, node, mat_new)
 
-                # Need to check both ends of each and every proposed segment until we find one in the neighborhood
-                # Defines pt2 in the reference as the end which we want to extend
+            elif node.tag in [inkex.addNS('ellipse', 'svg'), 'ellipse',
+                              inkex.addNS('circle', 'svg'), 'circle']:
 
-                for n_new_segment_end1_index in range(2):
-                    # First try initial end of test segment (aka pt1) vs final end (aka pt2) of reference segment
-                    if outerCount != n_ref_segment_count:  # don't investigate self ends
-                        # proposed initial pt1 X minus existing final pt1 X
-                        delta_x = abs_line_segments[outerCount][n_new_segment_end1_index][0] - \
-                            pt_reference[0]
-                        # proposed initial pt1 Y minus existing final pt1 Y
-                        delta_y = abs_line_segments[outerCount][n_new_segment_end1_index][1] - \
-                            pt_reference[1]
-                        if (delta_x * delta_x + delta_y * delta_y) < f_proposed_neighborhood_radius_squared:
-                            f_this_distance_squared = delta_x * delta_x + delta_y * delta_y
-                            pt_new_segment_this_end = abs_line_segments[outerCount][n_new_segment_end1_index]
-                            pt_new_segment_other_end = abs_line_segments[
-                                outerCount][not n_new_segment_end1_index]
-                            f_new_segment_Dx = pt_new_segment_this_end[0] - \
-                                pt_new_segment_other_end[0]
-                            f_new_segment_Dy = pt_new_segment_this_end[1] - \
-                                pt_new_segment_other_end[1]
-                            f_new_segment_direction_radians = math.atan2(
-                                f_new_segment_Dy, f_new_segment_Dx)  # from other end to this end
-                            if not self.WouldBeAnAlternatingDirection(f_reference_direction_radians, f_new_segment_direction_radians):
-                                # If this end would cause an alternating direction,
-                                # then exclude it regardless of how close it is
-                                pass
+                # Convert circles and ellipses to a path with two 180 degree arcs.
+                # In general (an ellipse), we convert
+                #
+                #   <ellipse rx="RX" ry="RY" cx="X" cy="Y"/>
+                #
+                # to
+                #
+                #   <path d="MX1,CY A RX,RY 0 1 0 X2,CY A RX,RY 0 1 0 X1,CY"/>
+                #
+                # where
+                #
+                #   X1 = CX - RX
+                #   X2 = CX + RX
+                #
+                # Note: ellipses or circles with a radius attribute of value 0 are ignored
 
-                            elif f_this_distance_squared < f_closest_distance_squared:
-                                # One other thing could rule out choosing this segment end:
-                                # Want to screen and remove two segments that, while close enough,
-                                # should be disqualified because they are colinear.  The reason for this is that
-                                # if they are colinear, they arose from the same global grid line, which means
-                                # that the gap between them arises from intersections with the boundary.
-                                # The idea here is that, all things being more-or-less equal,
-                                # we would like to give preference to connecting to a segment
-                                # which is the reverse of our current direction.  This makes for better
-                                # bezier curve join.
-                                # The criterion for being colinear is that the reference segment angle is effectively
-                                # the same as the line connecting the reference segment to the end of the new segment.
+                if node.tag in [inkex.addNS('ellipse', 'svg'), 'ellipse']:
+                    rx = float(node.get('rx', '0'))
+                    ry = float(node.get('ry', '0'))
+                else:
+                    rx = float(node.get('r', '0'))
+                    ry = rx
 
-                                f_joiner_direction_radians = math.atan2(
-                                    pt_new_segment_this_end[1] - pt_reference[1], pt_new_segment_this_end[0] - pt_reference[0])
-                                if not self.AreCoLinear(f_reference_direction_radians, f_joiner_direction_radians):
-                                    # not colinear
-                                    f_closest_distance_squared = f_this_distance_squared
-                                    b_found_segment_to_add = True
-                                    n_new_segment_end1_index_at_closest = n_new_segment_end1_index
-                                    n_outer_count_at_closest = outerCount
-                                    delta_x_at_closest = delta_x
-                                    delta_y_at_closest = delta_y
+                cx = float(node.get('cx', '0'))
+                cy = float(node.get('cy', '0'))
+                x1 = cx - rx
+                x2 = cx + rx
 
-        # At last we've looked at all the candidate segment ends
-        n_recursion_count += 1
-        if not b_found_segment_to_add or n_recursion_count >= RECURSION_LIMIT:
-            cumulative_path += '{0:f},{1:f} '.format(relative_held_line_pos[0],
-                                                     relative_held_line_pos[1])  # close out this segment
-            pt_last_position_abs[0] += relative_held_line_pos[0]
-            pt_last_position_abs[1] += relative_held_line_pos[1]
-            return cumulative_path  # No undrawn segments were suitable for appending,
-            # or there were so many that we worry about python recursion limit
-        else:
-            n_new_segment_end1_index = n_new_segment_end1_index_at_closest
-            n_new_segment_end2_index = not n_new_segment_end1_index
-            # n_new_segment_end1_index is 0 for connecting to pt1,
-            # and is 1 for connecting to pt2
-            # count is the index of the segment to be appended.
-            count = n_outer_count_at_closest
-            # delta from final end of incoming segment to initial end of outgoing segment
-            delta_x = delta_x_at_closest
-            delta_y = delta_y_at_closest
+                d = 'M {x1:f},{cy:f} ' \
+                    'A {rx:f},{ry:f} ' \
+                    '0 1 0 {x2:f},{cy:f} ' \
+                    'A {rx:f},{ry:f} ' \
+                    '0 1 0 {x1:f},{cy:f}'.format(x1=x1,
+                                                 x2=x2,
+                                                 rx=rx,
+                                                 ry=ry,
+                                                 cy=cy)
+                self.addPathVertices(d, node, mat_new)
 
-            # First, move pen to initial end (may be either its pt1 or its pt2) of new segment
+            elif node.tag in [inkex.addNS('pattern', 'svg'), 'pattern']:
+                pass
+            elif node.tag in [inkex.addNS('metadata', 'svg'), 'metadata']:
+                pass
+            elif node.tag in [inkex.addNS('defs', 'svg'), 'defs']:
+                pass
+            elif node.tag in [inkex.addNS('namedview', 'sodipodi'), 'namedview']:
+                pass
+            elif node.tag in [inkex.addNS('eggbot', 'svg'), 'eggbot']:
+                pass
+            elif node.tag in [inkex.addNS('WCB', 'svg'), 'WCB']:
+                pass
+            elif node.tag in [inkex.addNS('text', 'svg'), 'text']:
+                inkex.errormsg(
+                    'Warning: unable to draw text, please convert it to a path first.')
+                pass
+            elif not isinstance(node.tag, basestring):
+                pass
+            else:
+                inkex.errormsg(
+                    'Warning: unable to hatch object <{0}>, please convert it to a path first.'.format(node.tag))
+                pass
 
-            # Insert a bezier curve for this transition element
-            # To accomplish this, we need information on the incoming and outgoing segments.
-            # Specifically, we need to know the lengths and angles of the segments in
-            # order to decide on control points.
-            f_in_Dx = abs_line_segments[n_ref_segment_count][n_ref_end_index][0] - \
-                abs_line_segments[n_ref_segment_count][not n_ref_end_index][0]
-            f_in_Dy = abs_line_segments[n_ref_segment_count][n_ref_end_index][1] - \
-                abs_line_segments[n_ref_segment_count][not n_ref_end_index][1]
-            # The outgoing deltas are based on the reverse direction of the segment, i.e. the segment pointing back to the joiner bezier curve
-            # index is [count][start point = 0, final point = 1][0=x, 1=y]
-            f_out_Dx = abs_line_segments[count][n_new_segment_end1_index][0] - \
-                abs_line_segments[count][n_new_segment_end2_index][0]
-            f_out_Dy = abs_line_segments[count][n_new_segment_end1_index][1] - \
-                abs_line_segments[count][n_new_segment_end2_index][1]
+    @staticmethod
+    def hatchFills(group):
+        """
+        Return the list of generated hatch <path> elements in a hatch group.
+        """
+        return [child for child in group
+                if child.get(HATCH_FILL_ATTRIB) is not None]
 
-            length_of_incoming = math.hypot(f_in_Dx, f_in_Dy)
-            length_of_outgoing = math.hypot(f_out_Dx, f_out_Dy)
+    def joinFillsWithNode(self, node, stroke_width, path, hatch_hash=None):
+        """
+        Generate a SVG <path> element containing the path data "path".
+        Then put this new <path> element into a <group> with the supplied
+        node.  This means making a new <group> element and moving node
+        under it with the new <path> as a sibling element.
 
-            # We are going to trim-up the ends of the incoming and outgoing segments,
-            # in order to get a curve which reliably does not extend beyond the boundary.
-            # Crude readings from inkscape on bezier curve overshoot, using control points extended hatch-spacing distance parallel to segment:
-            # when end points are in line, overshoot 12/16 in direction of segment
-            #          when at 45 degrees, overshoot 12/16 in direction of segment
-            #          when at 60 degrees, overshoot 12/16 in direction of segment
-            # Conclusion, at any angle, remove 0.75 * hatch spacing from the length of both lines,
-            # where 0.75 is, by no coincidence, BEZIER_OVERSHOOT_MULTIPLIER
+        If node is already in a hatch group from an earlier run, its old
+        hatches are replaced and the group is reused.  The group records
+        hatch_hash so that the next run can tell whether node changed.
+        With no path, the old hatch group is removed altogether.
+        """
 
-            # If hatches are getting quite short, we can use a smaller Bezier loop at
-            # the end to squeeze into smaller spaces.  We'll use a normal nice smooth
-            # curve for non-short hatches
-            f_desired_shorten_for_smoothest_join = transformed_hatch_spacing * \
-                BEZIER_OVERSHOOT_MULTIPLIER  # This is what we really want to use for smooth curves
-            # Separately check incoming vs outgoing lengths to see if bezier distances must be reduced,
-            # then choose greatest reduction to apply to both - lest we go off-course
-            # Finally, clip reduction to be no less than 1.0
-            f_control_point_divider_incoming = 2.0 * \
-                f_desired_shorten_for_smoothest_join / length_of_incoming
-            f_control_point_divider_outgoing = 2.0 * \
-                f_desired_shorten_for_smoothest_join / length_of_outgoing
-            if f_control_point_divider_incoming > f_control_point_divider_outgoing:
-                f_largest_desired_control_point_divider = f_control_point_divider_incoming
-            else:
-                f_largest_desired_control_point_divider = f_control_point_divider_outgoing
-            if f_largest_desired_control_point_divider < 1.0:
-                f_control_point_divider = 1.0
-            else:
-                f_control_point_divider = f_largest_desired_control_point_divider
-            f_desired_shorten = f_desired_shorten_for_smoothest_join / f_control_point_divider
+        parent = node.getparent()
+        if parent is not None and parent.get(HATCH_HASH_ATTRIB) is not None:
+            # Re-hatching: drop the old hatches but keep the group
+            g = parent
+            for fill in self.hatchFills(g):
+                g.remove(fill)
+            if not path or len(path) == 0:
+                self.removeHatchGroup(g, node)
+                return
+        else:
+            if not path or len(path) == 0:
+                return
 
-            pt_delta_to_subtract_from_incoming_end = self.RelativeControlPointPosition(
-                f_desired_shorten, f_in_Dx, f_in_Dy, 0, 0)
-            # Note that this will be subtracted from the _point held in abeyance_.
-            relative_held_line_pos[0] -= pt_delta_to_subtract_from_incoming_end[0]
-            relative_held_line_pos[1] -= pt_delta_to_subtract_from_incoming_end[1]
+            # Make a new SVG <group> element whose parent is the parent of node
+            if parent is None:
+                parent = self.document.getroot()
+            g = etree.SubElement(parent, inkex.addNS('g', 'svg'))
+            # Move node to be a child of this new <g> element
+            g.append(node)
 
-            pt_delta_to_add_to_outgoing_start = self.RelativeControlPointPosition(
-                f_desired_shorten, f_out_Dx, f_out_Dy, 0, 0)
+        if hatch_hash is not None:
+            g.set(HATCH_HASH_ATTRIB, hatch_hash)
 
-            # We know that when we tack on a curve, we must chop some off the end of the incoming segment,
-            # and also chop some off the start of the outgoing segment.
-            # Now, we know we want the control points to be on a projection of each segment,
-            # in order that there be no abrupt change of plotting angle.  The question is, how
-            # far beyond the endpoint should we place the control point.
-            pt_relative_control_point_in = self.RelativeControlPointPosition(
-                transformed_hatch_spacing / f_control_point_divider,
-                f_in_Dx,
-                f_in_Dy,
-                0,
-                0)
-            pt_relative_control_point_out = self.RelativeControlPointPosition(
-                transformed_hatch_spacing / f_control_point_divider,
-                f_out_Dx,
-                f_out_Dy,
-                delta_x,
-                delta_y)
+        # Now make a <path> element which contains the hatches & is a child
+        # of the new <g> element
+        stroke_color = '#000000'  # default assumption
+        stroke_width = '1.0'  # default value
 
-            cumulative_path += '{0:f},{1:f} '.format(relative_held_line_pos[0],
-                                                     relative_held_line_pos[1])  # close out this segment, which has been modified
-            pt_last_position_abs[0] += relative_held_line_pos[0]
-            pt_last_position_abs[1] += relative_held_line_pos[1]
-            # add bezier cubic curve
-            cumulative_path += ('c {0:f},{1:f} {2:f},{3:f} {4:f},{5:f} l '.format(pt_relative_control_point_in[0],
-                                                                                  pt_relative_control_point_in[1],
-                                                                                  pt_relative_control_point_out[0],
-                                                                                  pt_relative_control_point_out[1],
-                                                                                  delta_x,
-                                                                                  delta_y))
-            pt_last_position_abs[0] += delta_x
-            pt_last_position_abs[1] += delta_y
-            # Next, move pen in appropriate direction to draw the new segment, given that
-            # we have just moved to the initial end of the new segment.
-            # This needs special treatment, as we just did some length changing.
-            delta_x = abs_line_segments[count][n_new_segment_end2_index][0] - \
-                abs_line_segments[count][n_new_segment_end1_index][0] + \
-                pt_delta_to_add_to_outgoing_start[0]
-            delta_y = abs_line_segments[count][n_new_segment_end2_index][1] - \
-                abs_line_segments[count][n_new_segment_end1_index][1] + \
-                pt_delta_to_add_to_outgoing_start[1]
-            relative_held_line_pos[0] = delta_x  # delta is from initial point
-            # Will be printed after we know if it must be modified
-            relative_held_line_pos[1] = delta_y
+        try:
+            style = node.get('style')
+            if style is not None:
+                declarations = style.split(';')
+                for i, declaration in enumerate(declarations):
+                    parts = declaration.split(':', 2)
+                    if len(parts) == 2:
+                        (prop, val) = parts
+                        prop = prop.strip().lower()
+                        if prop == 'stroke-width':
+                            stroke_width = val.strip()
+                        elif prop == 'stroke':
+                            val = val.strip()
+                            stroke_color = val
+        finally:
+            style = {'stroke': '{0}'.format(
+                stroke_color), 'fill': 'none', 'stroke-width': '{0}'.format(stroke_width)}
+            line_attribs = {'style': str(inkex.Style(style)), 'd': path,
+                            HATCH_FILL_ATTRIB: 'true'}
+            tran = node.get('transform')
+            if tran is not None and tran != '':
+                line_attribs['transform'] = tran
+            etree.SubElement(g, inkex.addNS('path', 'svg'), line_attribs)
 
-            # Mark this segment as drawn
-            abs_line_segments[count][2] = True
+    def removeHatchGroup(self, group, node):
+        """
+        Put node back in the place of its hatch group, now emptied of
+        hatches, and remove the group.  A group that has since been given
+        a transform or other elements is kept, no longer marked as a
+        hatch group.
+        """
+        if group.get('transform') is None and len(group) == 1:
+            group.addprevious(node)
+            group.getparent().remove(group)
+        else:
+            del group.attrib[HATCH_HASH_ATTRIB]
 
-            cumulative_path = self.recursivelyAppendNearbySegments(transformed_hatch_spacing,
-                                                                   n_recursion_count,
-                                                                   count,
-                                                                   n_new_segment_end2_index,
-                                                                   n_abs_line_segment_total,
-                                                                   abs_line_segments,
-                                                                   cumulative_path,
-                                                                   relative_held_line_pos)
-            return cumulative_path
+    def runHatchJobs(self, jobs):
+        """
+        Hatch each element described in the list of jobs, returning the
+        results in the same order.  With --jobs other than 1, the work is
+        spread over a pool of processes; 0 means one process per CPU.
+        """
 
-    def ProposeNeighborhoodRadiusSquared(self, transformed_hatch_spacing):
-        return transformed_hatch_spacing * transformed_hatch_spacing * self.options.hatchScope * self.options.hatchScope
-        # The multiplier of x generates a radius of x^0.5 times the hatch spacing.
+        n_processes = self.options.jobs
+        if n_processes <= 0:
+            n_processes = multiprocessing.cpu_count()
+        n_processes = min(n_processes, len(jobs))
 
-    @staticmethod
-    def RelativeControlPointPosition(distance, f_delta_x, f_delta_y, delta_x, delta_y):
+        if n_processes <= 1:
+            return [hatchElement(job) for job in jobs]
 
-        # returns the point, relative to 0, 0 offset by delta_x, delta_y,
-        # which extends a distance of "distance" at a slope defined by f_delta_x and f_delta_y
-        pt_return = [0, 0]
+        pool = multiprocessing.Pool(n_processes)
+        try:
+            # pool.map() returns its results in the order of the jobs
+            return pool.map(hatchElement, jobs,
+                            max(1, len(jobs) // (4 * n_processes)))
+        finally:
+            pool.close()
+            pool.join()
 
-        if f_delta_x == 0:
-            pt_return[0] = delta_x
-            pt_return[1] = math.copysign(distance, f_delta_y) + delta_y
-        elif f_delta_y == 0:
-            pt_return[0] = math.copysign(distance, f_delta_x) + delta_x
-            pt_return[1] = delta_y
-        else:
-            f_slope = math.atan2(f_delta_y, f_delta_x)
-            pt_return[0] = distance * math.cos(f_slope) + delta_x
-            pt_return[1] = distance * math.sin(f_slope) + delta_y
+    def effect(self):
 
-        return pt_return
+        # Viewbox handling
+        self.handleViewBox()
 
-    @staticmethod
-    def WouldBeAnAlternatingDirection(f_reference_direction_radians, f_new_segment_direction_radians):
-        # atan2 returns values in the range -pi to +pi, so we must evaluate difference values
-        # in the range of -2*pi to +2*pi
-        # f_dir_diff_rad:  Direction difference, radians
-        f_dir_diff_rad = f_reference_direction_radians - f_new_segment_direction_radians
-        if f_dir_diff_rad < 0:
-            f_dir_diff_rad += 2 * math.pi
-        # Without having changed the vector direction of the difference, we have
-        # now reduced the range to 0 to 2*pi
-        f_dir_diff_rad -= math.pi  # flip opposite direction to coincide with same direction
-        # Of course they may not be _exactly_ pi different due to osmosis, so allow a tolerance
-        b_ret_val = abs(
-            f_dir_diff_rad) < RADIAN_TOLERANCE_FOR_ALTERNATING_DIRECTION
+        if self.options.hatchSpacing == 0:
+            self.options.hatchSpacing = 0.1  # Hardcode minimum value
 
-        return b_ret_val
+        self.settings = HatchSettings(self.options.hatchAngle,
+                                      self.options.hatchSpacing,
+                                      self.options.crossHatch,
+                                      self.options.holdBackHatchFromEdges,
+                                      self.options.holdBackSteps,
+                                      self.options.reducePenLifts,
+                                      self.options.hatchScope)
 
-    @staticmethod
-    def AreCoLinear(f_direction_1_radians, f_direction_2_radians):
-        # allow slight difference in angles, for floating-point indeterminacy
-        f_abs_delta_radians = abs(
-            f_direction_1_radians - f_direction_2_radians)
-        if f_abs_delta_radians < RADIAN_TOLERANCE_FOR_COLINEAR:
-            return True
-        elif abs(f_abs_delta_radians - math.pi) < RADIAN_TOLERANCE_FOR_COLINEAR:
-            return True
+        if self.options.useCache:
+            self.flattenCache = FlattenCache(os.path.join(
+                plot_utils.cacheDirectory(), FLATTEN_CACHE_FILE))
+            self.flattenCache.load()
+
+        # Build a list of the vertices for the document's graphical elements
+        if self.options.ids:
+            # Traverse the selected objects
+            for id_ in self.options.ids:
+                self.recursivelyTraverseSvg(
+                    [self.svg.selected[id_]], self.docTransform)
         else:
-            return False
+            # Traverse the entire document
+            self.recursivelyTraverseSvg(
+                self.document.getroot(), self.docTransform)
+
+        if self.flattenCache is not None:
+            self.flattenCache.save()
+
+        # After recursively traversing the svg, we will have a dictionary of
+        # polygons and a dictionary of transforms, both keyed by the element's
+        # lxml node pointer.  Each element is hatched as if it had been
+        # selected on its own, so the elements may be hatched in any order or
+        # in parallel.  Only the vertex arrays and transform matrices go to
+        # the workers; the lxml nodes stay here.  Elements unchanged since
+        # the last run never made it into self.paths.
+        nodes = list(self.paths)
+        jobs = [(self.settings, self.paths[node], self.transforms[node])
+                for node in nodes]
+
+        # Now, dump the hatch fills in document order, grouping each with
+        # the element it fills.
+        for node, result in zip(nodes, self.runHatchJobs(jobs)):
+            path, stroke_width = result if result is not None else (None, None)
+            self.joinFillsWithNode(node, stroke_width, path, self.hashes[node])
+
+        # Elements that changed and have nothing left to hatch lose the
+        # hatch groups of their last run.
+        for node in self.hashes:
+            if node not in self.paths:
+                self.joinFillsWithNode(node, None, None)
 
 
 if __name__ == '__main__':
@@ -24,17 +24,15 @@
 import fourxidraw_compat  # To bridge Python 2/3, Inkscape 0.*/1.*
 import fourxidraw_conf  # Some settings can be changed here.
 import plot_utils   # https://github.com/evil-mad/plotink  Requires version 0.4
+import plot_journal
+import plot_layers
+import plot_resume
 from grbl_motion import GrblMotion
-from grbl_serial import GrblSerial
 import grbl_serial
 import time
-import string
-import serial
 import gettext
 from array import *
 from math import sqrt
-import simplepath
-from simpletransform import *
 import inkex
 import sys
 sys.path.append('lib')
@@ -48,6 +46,66 @@ except:
     # We have Python 3
 
 IDENTITY_TRANSFORM = [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]]
+EMPTY_BOUNDING_BOX = {'minX': 1e6, 'minY': 1e6, 'maxX': -1e6, 'maxY': -1e6}
+
+XLINK_HREF = inkex.addNS('href', 'xlink')
+SVG_ELLIPSE = inkex.addNS('ellipse', 'svg')
+
+# How recursivelyTraverseSvg handles each element: the name of the method
+# for it, or None if there is nothing in it to plot.  Containers are
+# traversed whether or not the layer they are in is to be plotted; the
+# rest only if it is.  Other elements are warned about.
+CONTAINER_ELEMENTS = {
+    'g': 'traverseGroup',
+    'use': 'traverseUse',
+}
+SHAPE_ELEMENTS = {
+    'path': 'traversePath',
+    'rect': 'traverseRect',
+    'line': 'traverseLine',
+    'polyline': 'traversePolyline',
+    'polygon': 'traversePolygon',
+    'circle': 'traverseEllipse',
+    'ellipse': 'traverseEllipse',
+    'text': 'warnText',
+    'flowRoot': 'warnText',
+    'image': 'warnImage',
+    'metadata': None,
+    'defs': None,
+    ('namedview', 'sodipodi'): None,
+    'WCB': None,
+    'eggbot': None,
+    'title': None,
+    'desc': None,
+    'pattern': None,
+    'radialGradient': None,     # Similar to pattern
+    'linearGradient': None,
+    # This is a reference to an external style sheet and not the value
+    # of a style attribute to be inherited by child elements
+    'style': None,
+    'cursor': None,
+    # Gamma curves, color temp, etc. are not relevant to single color output
+    'color-profile': None,
+}
+
+
+def elementTags(elements):
+    '''
+    Key a table of elements by their tags, as lxml gives them: qualified
+    by their namespace (SVG, unless one is given) and also bare.
+    '''
+    tags = {}
+    for name, handler in elements.items():
+        namespace = 'svg'
+        if isinstance(name, tuple):
+            name, namespace = name
+        tags[inkex.addNS(name, namespace)] = handler
+        tags[name] = handler
+    return tags
+
+
+CONTAINER_TAGS = elementTags(CONTAINER_ELEMENTS)
+SHAPE_TAGS = elementTags(SHAPE_ELEMENTS)
 
 
 class FourxiDrawClass(inkex.Effect):
@@ -117,6 +175,11 @@ class FourxiDrawClass(inkex.Effect):
                                dest="penUpSpeed", default=fourxidraw_conf.PenUpSpeed,
                                help="Rapid speed (mm/min) while pen is up")
 
+        self.compat_add_option("--keepFeedOverride",
+                               action="store", type="inkbool",
+                               dest="keepFeedOverride", default=fourxidraw_conf.keepFeedOverride,
+                               help="Reapply the feed override from the last plot")
+
         self.compat_add_option("--penLiftRate",
                                action="store", type="int",
                                dest="penLiftRate", default=fourxidraw_conf.penLiftRate,
@@ -155,6 +218,26 @@ class FourxiDrawClass(inkex.Effect):
                                dest="logSerial", default=fourxidraw_conf.logSerial,
                                help="Log serial communication")
 
+        self.compat_add_option("--keepConnection",
+                               action="store", type="inkbool",
+                               dest="keepConnection", default=fourxidraw_conf.keepConnection,
+                               help="Keep the connection to GRBL open between runs")
+
+        self.compat_add_option("--profile",
+                               action="store", type="inkbool",
+                               dest="profile", default=fourxidraw_conf.profile,
+                               help="Report where the time taken by a plot goes")
+
+        self.compat_add_option("--profileFile",
+                               action="store", type="string",
+                               dest="profileFile", default=fourxidraw_conf.profileFile,
+                               help="File to write the profile to, as JSON")
+
+        self.compat_add_option("--outlineFile",
+                               action="store", type="string",
+                               dest="outlineFile", default=fourxidraw_conf.outlineFile,
+                               help="File to write G-code tracing the plot's extents to, when preflighting")
+
         self.compat_add_option("--smoothness",
                                action="store", type="float",
                                dest="smoothness", default=fourxidraw_conf.smoothness,
@@ -190,6 +273,11 @@ class FourxiDrawClass(inkex.Effect):
                                dest="layerNumber", default=fourxidraw_conf.DefaultLayer,
                                help="Selected layer for multilayer plotting")
 
+        self.compat_add_option("--batchLayers",
+                               action="store", type="inkbool",
+                               dest="batchLayers", default=fourxidraw_conf.batchLayers,
+                               help="Plot every numbered layer in turn, pausing to change pens")
+
         self.compat_add_option("--fileOutput",
                                action="store", type="inkbool",
                                dest="fileOutput", default=fourxidraw_conf.fileOutput,
@@ -200,7 +288,13 @@ class FourxiDrawClass(inkex.Effect):
                                           dest="boundingBox",
                                           help="Trace bounding box")
 
-        self.bb = {'minX': 1e6, 'minY': 1e6, 'maxX': -1e6, 'maxY': -1e6}
+        self.layerIndex = None
+        self.containerHandlers = self.elementHandlers(CONTAINER_TAGS)
+        self.shapeHandlers = self.elementHandlers(SHAPE_TAGS)
+        self.layerBatch = None  # Layer numbers to plot in turn, in a batch
+        self.bb = dict(EMPTY_BOUNDING_BOX)
+        self.layerBB = {}       # Layer name: its bounding box
+        self.layerBBOrder = []
 
         self.serialPort = None
         # Initial state of pen is neither up nor down, but _unknown_.
@@ -229,27 +323,16 @@ class FourxiDrawClass(inkex.Effect):
         self.penUpDistance = 0.0
         self.penDownDistance = 0.0
 
-        # Values read from file:
-        self.svgLayer_Old = int(0)
-        self.svgNodeCount_Old = int(0)
-        self.svgDataRead_Old = False
-        self.svgLastPath_Old = int(0)
-        self.svgLastPathNC_Old = int(0)
-        self.svgLastKnownPosX_Old = float(0.0)
-        self.svgLastKnownPosY_Old = float(0.0)
-        self.svgPausedPosX_Old = float(0.0)
-        self.svgPausedPosY_Old = float(0.0)
-
-        # New values to write to file:
-        self.svgLayer = int(0)
-        self.svgNodeCount = int(0)
-        self.svgDataRead = False
-        self.svgLastPath = int(0)
-        self.svgLastPathNC = int(0)
-        self.svgLastKnownPosX = float(0.0)
-        self.svgLastKnownPosY = float(0.0)
-        self.svgPausedPosX = float(0.0)
-        self.svgPausedPosY = float(0.0)
+        # Resume data read from the file, and the new values to write to it
+        # (see plot_resume); the feed override is kept from job to job.
+        self.resumeOld = plot_resume.ResumeData()
+        self.resume = plot_resume.ResumeData()
+        self.wcbNode = None     # The <WCB> element it is kept in
+
+        # Set while the document is being compiled into a plot journal
+        self.compiling = False
+        # Times the stages of the plot, if asked to
+        self.profiler = None
 
         self.PrintInLayersMode = False
 
@@ -277,6 +360,13 @@ class FourxiDrawClass(inkex.Effect):
         self.warnings = {}
         self.warnOutOfBounds = False
 
+        # Paths clamped to the machine's travel, to report at the end:
+        # (layer name, path) -> [points clamped, furthest moved, x, y]
+        self.clipped = {}
+        self.clippedOrder = []
+        self.currentPath = None
+        self.sCurrentLayerName = '(Not Set)'
+
     def logDebug(self, msg):
         if not self.doLogDebug:
             return
@@ -303,6 +393,9 @@ class FourxiDrawClass(inkex.Effect):
         self.options.manualType = self.options.manualType.strip("\"")
         self.options.resumeType = self.options.resumeType.strip("\"")
 
+        if self.options.profile:
+            self.startProfile()
+
         if (self.options.mode == "Help"):
             skipSerial = True
         if (self.options.mode == "options"):
@@ -314,21 +407,26 @@ class FourxiDrawClass(inkex.Effect):
                 skipSerial = True
             elif (self.options.manualType == "strip-data"):
                 skipSerial = True
-                for node in self.svg.xpath('//svg:WCB', namespaces=inkex.NSS):
-                    self.svg.remove(node)
-                for node in self.svg.xpath('//svg:eggbot', namespaces=inkex.NSS):
-                    self.svg.remove(node)
+                plot_resume.stripElements(self.svg)
                 inkex.errormsg(gettext.gettext(
                     "I've removed all 4xiDraw data from this SVG file. Have a great day!"))
                 return
+            elif (self.options.manualType == "preflight"):
+                self.preflight()
+                return
 
         if skipSerial == False:
+            if self.options.keepConnection:
+                import grbl_daemon
+                grbl_daemon.ensureDaemon(self.options.logSerial)
             self.serialPort = grbl_serial.openPort(self.options.logSerial)
             if self.serialPort is None:
                 inkex.errormsg(gettext.gettext(
                     "Failed to connect to 4xiDraw. :("))
                 sys.exit
             else:
+                if self.profiler is not None:
+                    self.profiler.instrumentSerial(self.serialPort)
                 self.createMotion()
 
             if self.options.mode == "plot":
@@ -336,10 +434,10 @@ class FourxiDrawClass(inkex.Effect):
                 useOldResumeData = False
                 self.PrintInLayersMode = False
                 self.plotCurrentLayer = True
-                self.svgNodeCount = 0
-                self.svgLastPath = 0
+                self.resume.nodeCount = 0
+                self.resume.lastPath = 0
                 # indicate (to resume routine) that we are plotting all layers.
-                self.svgLayer = 12345
+                self.resume.layer = 12345
                 if self.serialPort is not None:
                     self.plotDocument()
                 if self.options.boundingBox:
@@ -354,10 +452,18 @@ class FourxiDrawClass(inkex.Effect):
 
             elif self.options.mode == "resume":
                 useOldResumeData = False
-                self.resumePlotSetup()
-                if self.resumeMode:
-                    fX = self.svgPausedPosX_Old + fourxidraw_conf.StartPosX
-                    fY = self.svgPausedPosY_Old + fourxidraw_conf.StartPosY
+                # Resume from the plot journal if there is one; otherwise
+                # traverse the document again, skipping finished paths.
+                journal = None
+                if self.options.resumeType == "ResumeNow":
+                    journal = self.openResumeJournal()
+                if journal is None:
+                    self.resumePlotSetup()
+                if journal is not None:
+                    self.resumeFromJournal(journal)
+                elif self.resumeMode:
+                    fX = self.resumeOld.pausedPosX + fourxidraw_conf.StartPosX
+                    fY = self.resumeOld.pausedPosY + fourxidraw_conf.StartPosY
                     self.resumeMode = False
                     self.plotSegment(fX, fY)
 
@@ -372,12 +478,10 @@ class FourxiDrawClass(inkex.Effect):
                     self.plotSegment(fX, fY)
 
                     # New values to write to file:
-                    self.svgNodeCount = self.svgNodeCount_Old
-                    self.svgLastPath = self.svgLastPath_Old
-                    self.svgLastPathNC = self.svgLastPathNC_Old
-                    self.svgPausedPosX = self.svgPausedPosX_Old
-                    self.svgPausedPosY = self.svgPausedPosY_Old
-                    self.svgLayer = self.svgLayer_Old
+                    self.resume = self.resumeOld.copy(
+                        lastKnownPosX=self.resume.lastKnownPosX,
+                        lastKnownPosY=self.resume.lastKnownPosY,
+                        feedOverride=self.resume.feedOverride)
                 else:
                     inkex.errormsg(gettext.gettext(
                         "There does not seem to be any in-progress plot to resume."))
@@ -387,124 +491,106 @@ class FourxiDrawClass(inkex.Effect):
                 self.PrintInLayersMode = True
                 self.plotCurrentLayer = False
                 self.LayersFoundToPlot = False
-                self.svgLastPath = 0
-                self.svgNodeCount = 0
-                self.svgLayer = self.options.layerNumber
-                self.plotDocument()
+                self.resume.lastPath = 0
+                self.resume.nodeCount = 0
+                self.resume.layer = self.options.layerNumber
+                if self.options.batchLayers:
+                    self.layerBatch = self.getLayerIndex().numbers()
+                    if not self.layerBatch:
+                        inkex.errormsg(gettext.gettext(
+                            'There are no numbered layers to plot.'))
+                    else:
+                        # The layer being plotted, until the first pen change
+                        self.resume.layer = self.layerBatch[0]
+                if self.layerBatch != []:
+                    self.plotDocument()
 
             elif self.options.mode == "setup":
                 self.setupCommand()
 
             elif self.options.mode == "manual":
                 useOldResumeData = False
-                self.svgNodeCount = self.svgNodeCount_Old
-                self.svgLastPath = self.svgLastPath_Old
-                self.svgLastPathNC = self.svgLastPathNC_Old
-                self.svgPausedPosX = self.svgPausedPosX_Old
-                self.svgPausedPosY = self.svgPausedPosY_Old
-                self.svgLayer = self.svgLayer_Old
+                self.resume = self.resumeOld.copy(
+                    lastKnownPosX=self.resume.lastKnownPosX,
+                    lastKnownPosY=self.resume.lastKnownPosY,
+                    feedOverride=self.resume.feedOverride)
                 self.manualCommand()
 
         # Do not make any changes to data saved from SVG file.
         if (useOldResumeData):
-            self.svgNodeCount = self.svgNodeCount_Old
-            self.svgLastPath = self.svgLastPath_Old
-            self.svgLastPathNC = self.svgLastPathNC_Old
-            self.svgPausedPosX = self.svgPausedPosX_Old
-            self.svgPausedPosY = self.svgPausedPosY_Old
-            self.svgLayer = self.svgLayer_Old
-            self.svgLastKnownPosX = self.svgLastKnownPosX_Old
-            self.svgLastKnownPosY = self.svgLastKnownPosY_Old
-
-        self.svgDataRead = False
-        self.UpdateSVGWCBData(self.svg)
+            self.resume = self.resumeOld.copy(feedOverride=self.resume.feedOverride)
+
+        self.UpdateSVGWCBData()
         # self.motion.doTimedPause(10) # Pause a moment for underway commands to finish...
         if self.serialPort is not None:
             self.serialPort.close()
+        if self.profiler is not None:
+            self.reportProfile()
+
+    def startProfile(self):
+        '''Time the stages of the plot, for reportProfile().'''
+        import plot_profile
+        self.profiler = plot_profile.Profiler()
+        for name in ('recursivelyTraverseSvg', 'plotPath', 'PlanTrajectory', 'streamJournal'):
+            self.profiler.instrument(self, name, plot_profile.CPU)
+        self.profiler.instrument(self, 'penPause', plot_profile.MOTION, 'pen dwell')
+        self.profiler.instrument(plot_utils, 'subdivideCubicPath', plot_profile.CPU)
+
+    def reportProfile(self):
+        self.profiler.finish()
+        for line in self.profiler.summary():
+            inkex.errormsg(line)
+        try:
+            filename = self.profiler.write(self.options.profileFile or None)
+            inkex.errormsg(gettext.gettext('Profile written to %s') % filename)
+        except (IOError, OSError):
+            inkex.errormsg(gettext.gettext('Could not write the profile.'))
 
     def resumePlotSetup(self):
         self.LayerFound = False
-        if (self.svgLayer_Old < 101) and (self.svgLayer_Old >= 0):
-            self.options.layerNumber = self.svgLayer_Old
+        if (self.resumeOld.layer < 101) and (self.resumeOld.layer >= 0):
+            self.options.layerNumber = self.resumeOld.layer
             self.PrintInLayersMode = True
             self.plotCurrentLayer = False
             self.LayerFound = True
-        elif (self.svgLayer_Old == 12345):  # Plot all layers
+        elif (self.resumeOld.layer == 12345):  # Plot all layers
             self.PrintInLayersMode = False
             self.plotCurrentLayer = True
             self.LayerFound = True
         if (self.LayerFound):
-            if (self.svgNodeCount_Old > 0):
-                self.nodeTarget = self.svgNodeCount_Old
-                self.svgLayer = self.svgLayer_Old
+            if (self.resumeOld.nodeCount > 0) or (self.resumeOld.journalPos > 0):
+                self.nodeTarget = self.resumeOld.nodeCount
+                self.resume.layer = self.resumeOld.layer
                 if self.options.resumeType == "ResumeNow":
                     self.resumeMode = True
                 self.penUp()
                 self.EnableMotors()
                 self.fSpeed = self.PenDownSpeed
 
-                self.fCurrX = self.svgLastKnownPosX_Old + fourxidraw_conf.StartPosX
-                self.fCurrY = self.svgLastKnownPosY_Old + fourxidraw_conf.StartPosY
+                self.fCurrX = self.resumeOld.lastKnownPosX + fourxidraw_conf.StartPosX
+                self.fCurrY = self.resumeOld.lastKnownPosY + fourxidraw_conf.StartPosY
 
     def CheckSVGforWCBData(self):
-        self.svgDataRead = False
-        self.recursiveWCBDataScan(self.svg)
-        if self.options.fileOutput:
-            if (not self.svgDataRead):  # if there is no WCB data, add some:
-                WCBlayer = fourxidraw_compat.compatEtreeSubElement(
-                    self.svg, 'WCB')
-                WCBlayer.set('layer', str(0))
-                # node paused at, if saved in paused state
-                WCBlayer.set('node', str(0))
-                # Last path number that has been fully painted
-                WCBlayer.set('lastpath', str(0))
-                # Node count as of finishing last path.
-                WCBlayer.set('lastpathnc', str(0))
-                # Last known position of carriage
-                WCBlayer.set('lastknownposx', str(0))
-                WCBlayer.set('lastknownposy', str(0))
-                # The position of the carriage when "pause" was pressed.
-                WCBlayer.set('pausedposx', str(0))
-                WCBlayer.set('pausedposy', str(0))
-
-    def recursiveWCBDataScan(self, aNodeList):
-        if (not self.svgDataRead):
-            for node in aNodeList:
-                if node.tag == 'svg':
-                    self.recursiveWCBDataScan(node)
-                elif node.tag == inkex.addNS('WCB', 'svg') or node.tag == 'WCB':
-                    try:
-                        self.svgLayer_Old = int(node.get('layer'))
-                        self.svgNodeCount_Old = int(node.get('node'))
-                        self.svgLastPath_Old = int(node.get('lastpath'))
-                        self.svgLastPathNC_Old = int(node.get('lastpathnc'))
-                        self.svgLastKnownPosX_Old = float(
-                            node.get('lastknownposx'))
-                        self.svgLastKnownPosY_Old = float(
-                            node.get('lastknownposy'))
-                        self.svgPausedPosX_Old = float(node.get('pausedposx'))
-                        self.svgPausedPosY_Old = float(node.get('pausedposy'))
-                        self.svgDataRead = True
-                    except:
-                        pass
-
-    def UpdateSVGWCBData(self, aNodeList):
-        if self.options.fileOutput:
-            if (not self.svgDataRead):
-                for node in aNodeList:
-                    if node.tag == 'svg':
-                        self.UpdateSVGWCBData(node)
-                    elif node.tag == inkex.addNS('WCB', 'svg') or node.tag == 'WCB':
-                        node.set('layer', str(self.svgLayer))
-                        node.set('node', str(self.svgNodeCount))
-                        node.set('lastpath', str(self.svgLastPath))
-                        node.set('lastpathnc', str(self.svgLastPathNC))
-                        node.set('lastknownposx', str((self.svgLastKnownPosX)))
-                        node.set('lastknownposy', str((self.svgLastKnownPosY)))
-                        node.set('pausedposx', str((self.svgPausedPosX)))
-                        node.set('pausedposy', str((self.svgPausedPosY)))
-
-                        self.svgDataRead = True
+        '''
+        Read the resume data from the <WCB> element among the root's
+        children; if there is none, and the file is to be written back,
+        add one.
+        '''
+        self.wcbNode = plot_resume.findElement(self.svg)
+        if self.wcbNode is not None:
+            try:
+                self.resumeOld = plot_resume.ResumeData.fromElement(self.wcbNode)
+                self.resume.feedOverride = self.resumeOld.feedOverride
+            except ValueError:
+                pass    # Unreadable; it is written over at the end
+        elif self.options.fileOutput:
+            # Namespaced, as inkex 1.x finds no element class for a bare 'WCB'
+            self.wcbNode = fourxidraw_compat.compatEtreeSubElement(self.svg, plot_resume.WCB_TAG)
+            self.resumeOld.writeTo(self.wcbNode)
+
+    def UpdateSVGWCBData(self):
+        if self.options.fileOutput and (self.wcbNode is not None):
+            self.resume.writeTo(self.wcbNode)
 
     def setupCommand(self):
         """Execute commands from the "setup" mode"""
@@ -519,6 +605,68 @@ class FourxiDrawClass(inkex.Effect):
             time.sleep(1)
             self.penDown()
 
+    def preflight(self):
+        '''
+        Report the extents of the plot, per layer and overall, without the
+        4xiDraw: the document is traversed as for a plot, with each path
+        only widening the bounding boxes.  If outlineFile is set, a G-code
+        program that traces the overall box, pen up, is written to it.
+        '''
+        if not self.setDocTransform():
+            return
+        self.LayersFoundToPlot = False
+        self.PrintInLayersMode = False
+        self.plotCurrentLayer = True
+        self.sCurrentLayerName = '(Not Set)'
+        self.createMotion()     # With no serial port, it sends nothing
+        self.EnableMotors()
+        self.options.boundingBox = True
+        self.traverseDocument()
+        self.options.boundingBox = False
+
+        if not self.layerBBOrder:
+            inkex.errormsg(gettext.gettext('Nothing in this document would be plotted.'))
+            return
+        inkex.errormsg(gettext.gettext('Plot extents, in inches:'))
+        for name in self.layerBBOrder:
+            self.reportBoundingBox(gettext.gettext('Layer "%s"') % name, self.layerBB[name])
+        self.reportBoundingBox(gettext.gettext('Overall'), self.bb)
+        if self.warnOutOfBounds:
+            inkex.errormsg(gettext.gettext(
+                'These are clipped to the range of motion of the 4xiDraw:'))
+            self.reportClipped()
+
+        if self.options.outlineFile:
+            self.writeOutline(self.options.outlineFile)
+
+    def reportBoundingBox(self, label, bb):
+        inkex.errormsg('  %s: x %1.3f to %1.3f, y %1.3f to %1.3f (%1.3f x %1.3f)' % (
+            label, bb['minX'], bb['maxX'], bb['minY'], bb['maxY'],
+            bb['maxX'] - bb['minX'], bb['maxY'] - bb['minY']))
+
+    def writeOutline(self, filename):
+        '''Write a G-code program tracing the bounding box, pen up, then returning home.'''
+        try:
+            self.serialPort = grbl_serial.GcodeFile(filename)
+        except (IOError, OSError):
+            inkex.errormsg(gettext.gettext('Could not write the outline to %s.') % filename)
+            self.serialPort = None
+            return
+        self.createMotion()
+        self.compiling = True   # Written, not sent: no waiting on the pen
+        try:
+            self.serialPort.command('G90\r')
+            self.penUp()
+            for x, y in ((self.bb['minX'], self.bb['minY']), (self.bb['minX'], self.bb['maxY']),
+                         (self.bb['maxX'], self.bb['maxY']), (self.bb['maxX'], self.bb['minY']),
+                         (self.bb['minX'], self.bb['minY']), self.ptFirst):
+                self.plotSegment(x, y)
+        finally:
+            self.compiling = False
+            self.serialPort.close()
+            self.serialPort = None
+        inkex.errormsg(gettext.gettext('Outline written to %s') % filename)
+
     def manualCommand(self):
         """Execute commands in the "manual" mode/tab"""
 
@@ -560,8 +708,8 @@ class FourxiDrawClass(inkex.Effect):
             self.fSpeed = self.PenDownSpeed
 
             self.EnableMotors()
-            self.fCurrX = self.svgLastKnownPosX_Old + fourxidraw_conf.StartPosX
-            self.fCurrY = self.svgLastKnownPosY_Old + fourxidraw_conf.StartPosY
+            self.fCurrX = self.resumeOld.lastKnownPosX + fourxidraw_conf.StartPosX
+            self.fCurrY = self.resumeOld.lastKnownPosY + fourxidraw_conf.StartPosY
             self.ignoreLimits = True
             # Note: Walking motors is STRICTLY RELATIVE TO INITIAL POSITION.
             fX = self.fCurrX + nDeltaX
@@ -575,6 +723,43 @@ class FourxiDrawClass(inkex.Effect):
         if self.serialPort is None:
             return
 
+        if not self.setDocTransform():
+            return
+
+        self.penUp()
+        self.EnableMotors()
+        self.sCurrentLayerName = '(Not Set)'
+
+        import grbl_control
+        control = grbl_control.ControlChannel(self.motion)
+        control.start()
+        self.restoreFeedOverride()
+        try:
+            # wrap everything in a try so we can for sure close the serial port
+            journal = self.compileJournal()
+            if journal is None:
+                # The journal could not be written; plot straight from the document,
+                # with status reports to show GRBL held at any pen change
+                self.serialPort.startStatusPolling()
+                try:
+                    self.traverseDocument()
+                    self.penUp()   # Always end with pen-up
+                finally:
+                    self.serialPort.stopStatusPolling()
+            else:
+                self.streamJournal(journal, 0)
+            self.finishPlot()
+
+        finally:
+            # We may have had an exception and lost the serial port...
+            control.stop()
+            self.resume.feedOverride = self.motion.currentFeedOverride()
+
+    def setDocTransform(self):
+        '''
+        Work out the transform from document units to inches.  Returns
+        False, having said why, if the document's size is unusable.
+        '''
         if (not self.getDocProps()):
             # Cannot handle the document's dimensions!!!
             inkex.errormsg(gettext.gettext(
@@ -585,7 +770,7 @@ class FourxiDrawClass(inkex.Effect):
                 'the "A4 landscape" template.\n\n' +
                 'Document dimensions may also be set in Inkscape,\n' +
                 'using File > Document Properties.'))
-            return
+            return False
 
         # Viewbox handling
         # Also ignores the preserveAspectRatio attribute
@@ -607,57 +792,276 @@ class FourxiDrawClass(inkex.Effect):
             Offset1 = 0.0 
         self.docTransform = fourxidraw_compat.compatParseTransform(
             'scale(%.15f,%.15f) translate(%.15f,%.15f)' % (sx, sy, Offset0, Offset1))
+        return True
+
+    def finishPlot(self):
+        '''Return home, and clear the resume data if the plot was completed.'''
+
+        # return to home after end of normal plot
+        if ((not self.bStopped) and (self.ptFirst)):
+            self.xBoundsMin = fourxidraw_conf.StartPosX
+            self.yBoundsMin = fourxidraw_conf.StartPosY
+            fX = self.ptFirst[0]
+            fY = self.ptFirst[1]
+            self.nodeCount = self.nodeTarget
+            self.plotSegment(fX, fY)
 
-        self.penUp()
-        self.EnableMotors()
-        self.sCurrentLayerName = '(Not Set)'
+        if (not self.bStopped):
+            if (self.options.mode == "plot") or (self.options.mode == "layers") or (self.options.mode == "resume"):
+                self.resume.layer = 0
+                self.resume.nodeCount = 0
+                self.resume.lastPath = 0
+                self.resume.lastPathNC = 0
+                self.resume.lastKnownPosX = 0
+                self.resume.lastKnownPosY = 0
+                self.resume.pausedPosX = 0
+                self.resume.pausedPosY = 0
+                plot_journal.removeJournal(self.resume.journal)
+                self.resume.journal = ''
+                self.resume.journalPos = 0
+                # Clear saved position data from the SVG file,
+                # IF we have completed a normal plot from the plot, layer, or resume mode.
+        if (self.warnOutOfBounds):
+            inkex.errormsg(gettext.gettext(
+                'Warning: 4xiDraw movement was limited by its physical range of motion. If everything looks right, your document may have an error with its units or scaling. Contact technical support for help!'))
+            self.reportClipped()
+
+        if (self.options.reportTime):
+            elapsed_time = time.time() - self.start_time
+            m, s = divmod(elapsed_time, 60)
+            h, m = divmod(m, 60)
+            inkex.errormsg("Elapsed time: %d:%02d:%02d" %
+                           (h, m, s) + " (Hours, minutes, seconds)")
+            downDist = self.penDownDistance / (self.stepsPerInch * sqrt(2))
+            totDist = downDist + self.penUpDistance / \
+                (self.stepsPerInch * sqrt(2))
+            inkex.errormsg(
+                "Length of path drawn: %1.3f inches." % downDist)
+            inkex.errormsg("Total distance moved: %1.3f inches." % totDist)
+
+    def noteClipped(self, points, excess, x, y):
+        '''
+        Record that points of the path being plotted were clamped to the
+        machine's travel, the furthest by excess inches, from (x, y).
+        '''
+        self.warnOutOfBounds = True
+        if self.currentPath is None:
+            label = None
+        else:
+            label = self.currentPath.get('id') or ('#%d' % self.pathcount)
+        key = (self.sCurrentLayerName, label)
+        clip = self.clipped.get(key)
+        if clip is None:
+            self.clipped[key] = [points, excess, x, y]
+            self.clippedOrder.append(key)
+            return
+        clip[0] += points
+        if excess > clip[1]:
+            clip[1:] = [excess, x, y]
+
+    def reportClipped(self):
+        '''Say which layers and paths were clamped to the travel, and where.'''
+        layers = []
+        for layer, label in self.clippedOrder:
+            if layer not in layers:
+                layers.append(layer)
+        for layer in layers:
+            keys = [key for key in self.clippedOrder if key[0] == layer]
+            inkex.errormsg(gettext.gettext(
+                'Layer "%s": %d path(s) clipped, by up to %1.3f inches.') % (
+                    layer, len(keys), max(self.clipped[key][1] for key in keys)))
+            for key in keys[:fourxidraw_conf.ClipReportPaths]:
+                points, excess, x, y = self.clipped[key]
+                if key[1] is None:
+                    inkex.errormsg(gettext.gettext(
+                        '  Moves between paths: clipped by up to %1.3f inches, at (%1.3f, %1.3f).') % (
+                            excess, x, y))
+                else:
+                    inkex.errormsg(gettext.gettext(
+                        '  Path %s: %d point(s) clipped, by up to %1.3f inches, at (%1.3f, %1.3f).') % (
+                            key[1], points, excess, x, y))
+            if len(keys) > fourxidraw_conf.ClipReportPaths:
+                inkex.errormsg(gettext.gettext('  ...and %d more.') % (
+                    len(keys) - fourxidraw_conf.ClipReportPaths))
+
+    def compileJournal(self):
+        '''
+        Traverse the document, recording the plot in a new plot journal
+        instead of sending it to GRBL.  Return a JournalReader for the
+        journal, or None if it could not be written.
+        '''
+        plot_journal.pruneJournals()
+        journalId = plot_journal.newJournalId()
+        try:
+            writer = plot_journal.JournalWriter(
+                plot_journal.journalPath(journalId))
+        except (IOError, OSError):
+            return None
 
         try:
-            # wrap everything in a try so we can for sure close the serial port
-            self.recursivelyTraverseSvg(self.svg)
+            self.recordPlot(writer)
+        except:
+            writer.close(False)
+            plot_journal.removeJournal(journalId)
+            raise
+        writer.close()
+
+        # The journal of an earlier, unfinished plot is of no further use
+        if self.resumeOld.journal != journalId:
+            plot_journal.removeJournal(self.resumeOld.journal)
+        self.resume.journal = journalId
+        self.resume.journalPos = 0
+        return plot_journal.JournalReader(writer.filename)
+
+    def recordPlot(self, writer):
+        '''Traverse the document, recording the plot with a JournalWriter.'''
+        motion = self.motion
+        bPenIsUp = self.bPenIsUp
+        # The traversal moves these on to the end of the document; until
+        # the first checkpoint is streamed they must say where it starts.
+        resumed = (self.resume.lastPath, self.resume.lastPathNC, self.resume.layer)
+        self.motion = writer
+        self.compiling = True
+        try:
+            self.traverseDocument()
             self.penUp()   # Always end with pen-up
+        finally:
+            self.motion = motion
+            self.bPenIsUp = bPenIsUp
+            self.resume.lastPath, self.resume.lastPathNC, self.resume.layer = resumed
+            self.compiling = False
 
-            # return to home after end of normal plot
-            if ((not self.bStopped) and (self.ptFirst)):
-                self.xBoundsMin = fourxidraw_conf.StartPosX
-                self.yBoundsMin = fourxidraw_conf.StartPosY
-                fX = self.ptFirst[0]
-                fY = self.ptFirst[1]
-                self.nodeCount = self.nodeTarget
-                self.plotSegment(fX, fY)
-
-            if (not self.bStopped):
-                if (self.options.mode == "plot") or (self.options.mode == "layers") or (self.options.mode == "resume"):
-                    self.svgLayer = 0
-                    self.svgNodeCount = 0
-                    self.svgLastPath = 0
-                    self.svgLastPathNC = 0
-                    self.svgLastKnownPosX = 0
-                    self.svgLastKnownPosY = 0
-                    self.svgPausedPosX = 0
-                    self.svgPausedPosY = 0
-                    # Clear saved position data from the SVG file,
-                    # IF we have completed a normal plot from the plot, layer, or resume mode.
-            if (self.warnOutOfBounds):
-                inkex.errormsg(gettext.gettext(
-                    'Warning: 4xiDraw movement was limited by its physical range of motion. If everything looks right, your document may have an error with its units or scaling. Contact technical support for help!'))
-
-            if (self.options.reportTime):
-                elapsed_time = time.time() - self.start_time
-                m, s = divmod(elapsed_time, 60)
-                h, m = divmod(m, 60)
-                inkex.errormsg("Elapsed time: %d:%02d:%02d" %
-                               (h, m, s) + " (Hours, minutes, seconds)")
-                downDist = self.penDownDistance / (self.stepsPerInch * sqrt(2))
-                totDist = downDist + self.penUpDistance / \
-                    (self.stepsPerInch * sqrt(2))
-                inkex.errormsg(
-                    "Length of path drawn: %1.3f inches." % downDist)
-                inkex.errormsg("Total distance moved: %1.3f inches." % totDist)
+    def streamJournal(self, journal, start):
+        '''
+        Send a plot journal to GRBL, from record [start] onwards.  Each move
+        is tagged with its record number, and at each checkpoint the resume
+        data is brought up to date with the last move GRBL has executed,
+        so that a stopped plot can later be resumed from the journal
+        exactly where the pen stopped.
+        '''
+        self.serialPort.clearTracking()
+        self.serialPort.startStatusPolling()
+        try:
+            for index, op, flags, count, x, y in journal.records(start):
+                if self.motion.IsPausePressed():
+                    self.bStopped = True
+                if self.bStopped:
+                    break
+                if op == plot_journal.MOVE:
+                    self.motion.doAbsoluteMove(x, y, index)
+                elif op == plot_journal.PEN_UP:
+                    self.motion.sendPenUp(
+                        count, self.options.penUpSpeed if self.options.applySpeed else None)
+                    self.penPause(count)
+                    self.bPenIsUp = True
+                elif op == plot_journal.PEN_DOWN:
+                    self.motion.sendPenDown(
+                        count, self.options.penDownSpeed if self.options.applySpeed else None)
+                    self.penPause(count)
+                    self.bPenIsUp = False
+                elif op == plot_journal.CHECKPOINT:
+                    self.resume.lastPath = count
+                    self.resume.lastPathNC = self.nodeCount
+                    self.updateResumePosition()
+                elif op == plot_journal.PEN_CHANGE:
+                    self.resume.layer = count
+                    self.pauseForPenChange(count)
+        finally:
+            self.serialPort.stopStatusPolling()
+            if self.bStopped:
+                self.stopPlot()
+            journal.close()
+
+    def stopPlot(self):
+        '''
+        Bring a stopped plot to rest: once the feed hold has taken effect,
+        note the last move executed, flush the rest of GRBL's planner and
+        lift the pen.
+        '''
+        self.serialPort.waitForHold()
+        self.updateResumePosition()
+        self.serialPort.reset()
+        self.motion.pauseRequested = False
+        self.bPenIsUp = None   # Unknown after the reset
+        self.penUp()
+        self.resume.pausedPosX = self.resume.lastKnownPosX
+        self.resume.pausedPosY = self.resume.lastKnownPosY
+        inkex.errormsg(gettext.gettext(
+            'Plot paused. Press Apply in the Resume tab to carry on from where the pen stopped.'))
+
+    def updateResumePosition(self):
+        '''Record the last move GRBL has executed as the place to resume from.'''
+        executed = self.serialPort.executedMove()
+        if executed is not None:
+            tag, target = executed
+            self.resume.journalPos = tag + 1
+            self.resume.lastKnownPosX = target[0] / 25.4 - fourxidraw_conf.StartPosX
+            self.resume.lastKnownPosY = target[1] / 25.4 - fourxidraw_conf.StartPosY
+
+    def openResumeJournal(self):
+        '''
+        Return a JournalReader positioned for resuming the paused plot, or
+        None if the WCB data names no journal or it can no longer be used.
+        '''
+        if (not self.resumeOld.journal) or (self.resumeOld.journalPos <= 0):
+            return None
+        try:
+            journal = plot_journal.JournalReader(
+                plot_journal.journalPath(self.resumeOld.journal))
+        except (IOError, OSError, plot_journal.JournalError):
+            return None
+        if self.resumeOld.journalPos > len(journal):
+            journal.close()
+            return None
+        return journal
+
+    def resumeFromJournal(self, journal):
+        '''
+        Resume a paused plot from its journal: go to where the last
+        executed record left the pen, put the pen back as it was, and
+        carry on streaming from the next record.
+        '''
+        # Every record holds the position after it, and whether the pen
+        # is down when it is reached.
+        pos = self.resumeOld.journalPos
+        op, flags, count, x, y = journal.record(pos - 1)
+        if pos < len(journal):
+            flags = journal.record(pos)[1]
+        self.resume.layer = self.resumeOld.layer
+        self.resume.journal = self.resumeOld.journal
+        self.resume.journalPos = pos
+        self.resume.lastPath = self.resumeOld.lastPath
+        self.resume.lastPathNC = self.resumeOld.lastPathNC
+
+        self.penUp()
+        self.EnableMotors()
+        self.fSpeed = self.PenDownSpeed
+        self.motion.doAbsoluteMove(x, y)
+        if flags & plot_journal.FLAG_PEN_DOWN:
+            self.penDown()
 
+        import grbl_control
+        control = grbl_control.ControlChannel(self.motion)
+        control.start()
+        self.restoreFeedOverride()
+        try:
+            self.streamJournal(journal, pos)
+            self.finishPlot()
         finally:
-            # We may have had an exception and lost the serial port...
-            pass
+            control.stop()
+            self.resume.feedOverride = self.motion.currentFeedOverride()
+
+    def restoreFeedOverride(self):
+        '''
+        Reapply the feed override chosen during the last plot, as saved in
+        the WCB data.  Feed overrides are new in GRBL 1.1, so they are only
+        sent once a status report shows that is what we are talking to.
+        '''
+        if (not self.options.keepFeedOverride) or (self.resume.feedOverride == 100):
+            return
+        status = self.serialPort.pollStatus()
+        if (status is not None) and status['v11']:
+            self.motion.setFeedOverride(self.resume.feedOverride)
 
     def compose_parent_transforms(self, node, mat):  # Inkscape 1.0+ only
         # This is adapted from Inkscape's simpletransform.py's composeParents()
@@ -673,6 +1077,86 @@ class FourxiDrawClass(inkex.Effect):
 
         return mat
 
+    def getLayerIndex(self):
+        '''The document's layer index, made the first time it is needed.'''
+        if self.layerIndex is None:
+            self.layerIndex = plot_layers.LayerIndex(self.svg)
+        return self.layerIndex
+
+    def traverseDocument(self):
+        '''
+        Traverse the document to plot it.  In layers mode, only the layers
+        with the number being plotted are visited, found in the layer index.
+        '''
+        if not self.PrintInLayersMode:
+            self.recursivelyTraverseSvg(self.svg)
+            return
+        if self.layerBatch is None:
+            self.traverseLayers(self.resume.layer)
+            return
+        # A batch: each numbered layer in turn, with a pen change between
+        for i, number in enumerate(self.layerBatch):
+            if self.bStopped:
+                return
+            if i > 0:
+                self.parkForPenChange(number)
+            self.resume.layer = number
+            self.traverseLayers(number)
+
+    def traverseLayers(self, number):
+        '''Traverse the layers with that number, as found in the layer index.'''
+        for layer in self.getLayerIndex().numbered(number):
+            visibility = 'visible'
+            for ancestor in reversed(list(layer.node.iterancestors())):
+                visibility = self.nodeVisibility(ancestor, visibility)
+            self.recursivelyTraverseSvg([layer.node], parent_visibility=visibility)
+
+    def parkForPenChange(self, layerNumber):
+        '''Lift the pen and go home, to pause there for the pen for the next layer.'''
+        self.penUp()
+        self.plotSegment(self.ptFirst[0], self.ptFirst[1])
+        if self.compiling:
+            self.motion.pauseForPenChange(layerNumber)
+        else:
+            self.pauseForPenChange(layerNumber)
+
+    def pauseForPenChange(self, layerNumber):
+        '''Pause the plot for a pen change, until the 4xiDraw is resumed.'''
+        inkex.errormsg(gettext.gettext(
+            'When the 4xiDraw stops, put in the pen for layer %d, then resume it ' +
+            'with "python grbl_control.py resume".') % layerNumber)
+        self.motion.pauseForPenChange(layerNumber)
+
+    def nodeVisibility(self, node, parent_visibility):
+        v = None
+        style = node.get("style")
+        if style is not None:
+            kvs = {k.strip(): v.strip()
+                   for k, v in [x.split(":", 1) for x in style.split(";")]}
+            if "display" in kvs and kvs["display"] == "none":
+                v = "hidden"
+        if v is None:
+            v = node.get("visibility", parent_visibility)
+        if v == "inherit":
+            v = parent_visibility
+        return v
+
+    def elementHandlers(self, tags):
+        return dict((tag, name and getattr(self, name)) for tag, name in tags.items())
+
+    def nodeTransform(self, node, matCurrent):
+        '''
+        The transform to inches of a node's coordinates: its own transform and
+        its parents', the document's, and then matCurrent.
+        '''
+        matNew = self.compose_parent_transforms(node, IDENTITY_TRANSFORM)
+        matNew = fourxidraw_compat.compatComposeTransform(self.docTransform, matNew)
+        return fourxidraw_compat.compatComposeTransform(matCurrent, matNew)
+
+    def shapeMatrix(self, node, matCurrent):
+        '''nodeTransform, as a plain ((a, c, e), (b, d, f)) matrix.'''
+        return fourxidraw_compat.compatTransformMatrix(self.nodeTransform(node, matCurrent))
+
     def recursivelyTraverseSvg(self, aNodeList,
                                matCurrent=IDENTITY_TRANSFORM,
                                parent_visibility='visible'):
@@ -682,489 +1166,214 @@ class FourxiDrawClass(inkex.Effect):
         that should be applied to each path.
 
         This function handles path, group, line, rect, polyline, polygon,
-        circle, ellipse and use (clone) elements.  Notable elements not
+        circle, ellipse and use (clone) elements, through the handlers in
+        CONTAINER_ELEMENTS and SHAPE_ELEMENTS.  Notable elements not
         handled include text.  Unhandled elements should be converted to
         paths in Inkscape.
         """
-        # if not self.plotCurrentLayer:
-        #     return        # saves us a lot of time ...
 
         for node in aNodeList:
-            v = None
-            style = node.get("style")
-            if style is not None:
-                kvs = {k.strip(): v.strip()
-                       for k, v in [x.split(":", 1) for x in style.split(";")]}
-                if "display" in kvs and kvs["display"] == "none":
-                    v = "hidden"
-            if v is None:
-                v = node.get("visibility", parent_visibility)
-            if v == "inherit":
-                v = parent_visibility
+            v = self.nodeVisibility(node, parent_visibility)
             if v == "hidden" or v == "collapse":
                 continue
 
-            # first apply the current matrix transform to this node's transform
-            matNew = self.compose_parent_transforms(node, IDENTITY_TRANSFORM)
-            matNew = fourxidraw_compat.compatComposeTransform(self.docTransform, matNew)
+            handler = self.containerHandlers.get(node.tag)
+            if handler is None:
+                # Skip subsequent tag checks unless we are plotting this layer.
+                if not self.plotCurrentLayer:
+                    continue
+                handler = self.shapeHandlers.get(node.tag, self.warnUnhandled)
+                if handler is None:
+                    continue
+            handler(node, matCurrent, v)
+
+    def traverseGroup(self, node, matCurrent, v):
+        if plot_layers.isLayer(node):
+            layer = self.getLayerIndex().layer(node)
+            self.sCurrentLayerName = layer.name
+            self.DoWePlotLayer(layer)
+            if not self.options.boundingBox:
+                self.penUp()
+        self.recursivelyTraverseSvg(node, parent_visibility=v)
+
+    def traverseUse(self, node, matCurrent, v):
+        # A <use> element refers to another SVG element via an xlink:href="#blah"
+        # attribute.  We will handle the element by doing an XPath search through
+        # the document, looking for the element with the matching id="blah"
+        # attribute.  We then recursively process that element after applying
+        # any necessary (x,y) translation.
+        #
+        # Notes:
+        #  1. We ignore the height and width attributes as they do not apply to
+        #     path-like elements, and
+        #  2. Even if the use element has visibility="hidden", SVG still calls
+        #     for processing the referenced element.  The referenced element is
+        #     hidden only if its visibility is "inherit" or "hidden".
+        #  3. We may be able to unlink clones using the code in pathmodifier.py
+
+        refid = node.get(XLINK_HREF)
+        if not refid:
+            return
+        # [1:] to ignore leading '#' in reference
+        refnode = node.xpath('//*[@id="%s"]' % refid[1:])
+        if not refnode:
+            return
+        matNew = self.nodeTransform(node, matCurrent)
+        x = float(node.get('x', '0'))
+        y = float(node.get('y', '0'))
+        # Note: the transform has already been applied
+        if (x != 0) or (y != 0):
             matNew = fourxidraw_compat.compatComposeTransform(
-                matCurrent, matNew)
-
-            if node.tag == inkex.addNS('g', 'svg') or node.tag == 'g':
-
-                if (node.get(inkex.addNS('groupmode', 'inkscape')) == 'layer'):
-                    self.sCurrentLayerName = node.get(
-                        inkex.addNS('label', 'inkscape'))
-                    self.DoWePlotLayer(self.sCurrentLayerName)
-                    if not self.options.boundingBox:
-                        self.penUp()
-                self.recursivelyTraverseSvg(node, parent_visibility=v)
-
-            elif node.tag == inkex.addNS('use', 'svg') or node.tag == 'use':
-
-                # A <use> element refers to another SVG element via an xlink:href="#blah"
-                # attribute.  We will handle the element by doing an XPath search through
-                # the document, looking for the element with the matching id="blah"
-                # attribute.  We then recursively process that element after applying
-                # any necessary (x,y) translation.
-                #
-                # Notes:
-                #  1. We ignore the height and width attributes as they do not apply to
-                #     path-like elements, and
-                #  2. Even if the use element has visibility="hidden", SVG still calls
-                #     for processing the referenced element.  The referenced element is
-                #     hidden only if its visibility is "inherit" or "hidden".
-                #  3. We may be able to unlink clones using the code in pathmodifier.py
-
-                refid = node.get(inkex.addNS('href', 'xlink'))
-                if refid:
-                    # [1:] to ignore leading '#' in reference
-                    path = '//*[@id="%s"]' % refid[1:]
-                    refnode = node.xpath(path)
-                    if refnode:
-                        x = float(node.get('x', '0'))
-                        y = float(node.get('y', '0'))
-                        # Note: the transform has already been applied
-                        if (x != 0) or (y != 0):
-                            matNew2 = fourxidraw_compat.compatComposeTransform(
-                                matNew, fourxidraw_compat.compatParseTransform('translate(%.15f,%.15f)' % (x, y)))
-                        else:
-                            matNew2 = matNew
-                        v = node.get('visibility', v)
-                        self.recursivelyTraverseSvg(
-                            refnode, matNew2, parent_visibility=v)
-                    else:
-                        pass
-                else:
-                    pass
-            # Skip subsequent tag checks unless we are plotting this layer.
-            elif self.plotCurrentLayer:
-                if node.tag == inkex.addNS('path', 'svg'):
-
-                    # if we're in resume mode AND self.pathcount < self.svgLastPath,
-                    #    then skip over this path.
-                    # if we're in resume mode and self.pathcount = self.svgLastPath,
-                    #    then start here, and set self.nodeCount equal to self.svgLastPathNC
-
-                    doWePlotThisPath = False
-                    if (self.resumeMode):
-                        if (self.pathcount < self.svgLastPath_Old):
-                            # This path was *completely plotted* already; skip.
-                            self.pathcount += 1
-                        elif (self.pathcount == self.svgLastPath_Old):
-                            # this path is the first *not completely* plotted path:
-                            self.nodeCount = self.svgLastPathNC_Old  # Nodecount after last completed path
-                            doWePlotThisPath = True
-                    else:
-                        doWePlotThisPath = True
-                    if (doWePlotThisPath):
-                        self.pathcount += 1
-                        self.plotPath(node, matNew)
-
-                elif node.tag == inkex.addNS('rect', 'svg') or node.tag == 'rect':
-
-                    # Manually transform
-                    #    <rect x="X" y="Y" width="W" height="H"/>
-                    # into
-                    #    <path d="MX,Y lW,0 l0,H l-W,0 z"/>
-                    # I.e., explicitly draw three sides of the rectangle and the
-                    # fourth side implicitly
-
-                    # if we're in resume mode AND self.pathcount < self.svgLastPath,
-                    #    then skip over this path.
-                    # if we're in resume mode and self.pathcount = self.svgLastPath,
-                    #    then start here, and set
-                    # self.nodeCount equal to self.svgLastPathNC
-
-                    doWePlotThisPath = False
-                    if (self.resumeMode):
-                        if (self.pathcount < self.svgLastPath_Old):
-                            # This path was *completely plotted* already; skip.
-                            self.pathcount += 1
-                        elif (self.pathcount == self.svgLastPath_Old):
-                            # this path is the first *not completely* plotted path:
-                            self.nodeCount = self.svgLastPathNC_Old  # Nodecount after last completed path
-                            doWePlotThisPath = True
-                    else:
-                        doWePlotThisPath = True
-                    if (doWePlotThisPath):
-                        self.pathcount += 1
-                        # Create a path with the outline of the rectangle
-                        newpath = fourxidraw_compat.compatEtreeElement(
-                            inkex.addNS('path', 'svg'))
-                        x = float(node.get('x'))
-                        y = float(node.get('y'))
-                        w = float(node.get('width'))
-                        h = float(node.get('height'))
-                        s = node.get('style')
-                        if s:
-                            newpath.set('style', s)
-                        t = node.get('transform')
-                        if t:
-                            newpath.set('transform', t)
-                        a = []
-                        fourxidraw_compat.compatAppendCommand(a, 'M ', [x, y])
-                        fourxidraw_compat.compatAppendCommand(a, ' l ', [w, 0])
-                        fourxidraw_compat.compatAppendCommand(a, ' l ', [0, h])
-                        fourxidraw_compat.compatAppendCommand(
-                            a, ' l ', [-w, 0])
-                        fourxidraw_compat.compatAppendCommand(a, ' Z', [])
-                        newpath.set('d', fourxidraw_compat.compatFormatPath(a))
-                        self.plotPath(newpath, matNew)
-
-                elif node.tag == inkex.addNS('line', 'svg') or node.tag == 'line':
-
-                    # Convert
-                    #
-                    #   <line x1="X1" y1="Y1" x2="X2" y2="Y2/>
-                    #
-                    # to
-                    #
-                    #   <path d="MX1,Y1 LX2,Y2"/>
-
-                    # if we're in resume mode AND self.pathcount < self.svgLastPath,
-                    #    then skip over this path.
-                    # if we're in resume mode and self.pathcount = self.svgLastPath,
-                    #    then start here, and set
-                    # self.nodeCount equal to self.svgLastPathNC
-
-                    doWePlotThisPath = False
-                    if (self.resumeMode):
-                        if (self.pathcount < self.svgLastPath_Old):
-                            # This path was *completely plotted* already; skip.
-                            self.pathcount += 1
-                        elif (self.pathcount == self.svgLastPath_Old):
-                            # this path is the first *not completely* plotted path:
-                            self.nodeCount = self.svgLastPathNC_Old  # Nodecount after last completed path
-                            doWePlotThisPath = True
-                    else:
-                        doWePlotThisPath = True
-                    if (doWePlotThisPath):
-                        self.pathcount += 1
-                        # Create a path to contain the line
-                        newpath = fourxidraw_compat.compatEtreeElement(
-                            inkex.addNS('path', 'svg'))
-                        x1 = float(node.get('x1'))
-                        y1 = float(node.get('y1'))
-                        x2 = float(node.get('x2'))
-                        y2 = float(node.get('y2'))
-                        s = node.get('style')
-                        if s:
-                            newpath.set('style', s)
-                        t = node.get('transform')
-                        if t:
-                            newpath.set('transform', t)
-                        a = []
-                        fourxidraw_compat.compatAppendCommand(
-                            a, 'M ', [x1, y1])
-                        fourxidraw_compat.compatAppendCommand(
-                            a, ' L ', [x2, y2])
-                        newpath.set('d', fourxidraw_compat.compatFormatPath(a))
-                        self.plotPath(newpath, matNew)
-
-                elif node.tag == inkex.addNS('polyline', 'svg') or node.tag == 'polyline':
-
-                    # Convert
-                    #  <polyline points="x1,y1 x2,y2 x3,y3 [...]"/>
-                    # to
-                    #   <path d="Mx1,y1 Lx2,y2 Lx3,y3 [...]"/>
-                    # Note: we ignore polylines with no points
-
-                    pl = node.get('points', '').strip()
-                    if pl == '':
-                        pass
-
-                    # if we're in resume mode AND self.pathcount < self.svgLastPath, then skip over this path.
-                    # if we're in resume mode and self.pathcount = self.svgLastPath, then start here, and set
-                    # self.nodeCount equal to self.svgLastPathNC
-
-                    doWePlotThisPath = False
-                    if (self.resumeMode):
-                        if (self.pathcount < self.svgLastPath_Old):
-                            # This path was *completely plotted* already; skip.
-                            self.pathcount += 1
-                        elif (self.pathcount == self.svgLastPath_Old):
-                            # this path is the first *not completely* plotted path:
-                            self.nodeCount = self.svgLastPathNC_Old  # Nodecount after last completed path
-                            doWePlotThisPath = True
-                    else:
-                        doWePlotThisPath = True
-                    if (doWePlotThisPath):
-                        self.pathcount += 1
-
-                        pa = pl.split()
-                        if not len(pa):
-                            pass
-                        d = "M {:.11f}".format(pa[0])
-                        for i in range(1, len(pa)):
-                            d += " L {:.11f} ".format(pa[i])
-                        newpath = fourxidraw_compat.compatEtreeElement(
-                            inkex.addNS('path', 'svg'))
-                        newpath.set('d', d)
-                        s = node.get('style')
-                        if s:
-                            newpath.set('style', s)
-                        t = node.get('transform')
-                        if t:
-                            newpath.set('transform', t)
-                        self.plotPath(newpath, matNew)
-
-                elif node.tag == inkex.addNS('polygon', 'svg') or node.tag == 'polygon':
-
-                    # Convert
-                    #  <polygon points="x1,y1 x2,y2 x3,y3 [...]"/>
-                    # to
-                    #   <path d="Mx1,y1 Lx2,y2 Lx3,y3 [...] Z"/>
-                    # Note: we ignore polygons with no points
-
-                    pl = node.get('points', '').strip()
-                    if pl == '':
-                        pass
-
-                    # if we're in resume mode AND self.pathcount < self.svgLastPath, then skip over this path.
-                    # if we're in resume mode and self.pathcount = self.svgLastPath, then start here, and set
-                    # self.nodeCount equal to self.svgLastPathNC
-
-                    doWePlotThisPath = False
-                    if (self.resumeMode):
-                        if (self.pathcount < self.svgLastPath_Old):
-                            # This path was *completely plotted* already; skip.
-                            self.pathcount += 1
-                        elif (self.pathcount == self.svgLastPath_Old):
-                            # this path is the first *not completely* plotted path:
-                            self.nodeCount = self.svgLastPathNC_Old  # Nodecount after last completed path
-                            doWePlotThisPath = True
-                    else:
-                        doWePlotThisPath = True
-                    if (doWePlotThisPath):
-                        self.pathcount += 1
-
-                        pa = pl.split()
-                        if not len(pa):
-                            pass
-                        d = "M {:.11f}".format(pa[0])
-                        for i in xrange(1, len(pa)):
-                            d += " L {:.11f} ".format(pa[i])
-                        d += " Z"
-                        newpath = fourxidraw_compat.compatEtreeElement(
-                            inkex.addNS('path', 'svg'))
-                        newpath.set('d', d)
-                        s = node.get('style')
-                        if s:
-                            newpath.set('style', s)
-                        t = node.get('transform')
-                        if t:
-                            newpath.set('transform', t)
-                        self.plotPath(newpath, matNew)
-
-                elif node.tag == inkex.addNS('ellipse', 'svg') or \
-                        node.tag == 'ellipse' or \
-                        node.tag == inkex.addNS('circle', 'svg') or \
-                        node.tag == 'circle':
-
-                    # Convert circles and ellipses to a path with two 180 degree arcs.
-                    # In general (an ellipse), we convert
-                    #   <ellipse rx="RX" ry="RY" cx="X" cy="Y"/>
-                    # to
-                    #   <path d="MX1,CY A RX,RY 0 1 0 X2,CY A RX,RY 0 1 0 X1,CY"/>
-                    # where
-                    #   X1 = CX - RX
-                    #   X2 = CX + RX
-                    # Note: ellipses or circles with a radius attribute of value 0 are ignored
-
-                    if node.tag == inkex.addNS('ellipse', 'svg') or node.tag == 'ellipse':
-                        rx = float(node.get('rx', '0'))
-                        ry = float(node.get('ry', '0'))
-                    else:
-                        rx = float(node.get('r', '0'))
-                        ry = rx
-                    if rx == 0 or ry == 0:
-                        pass
-
-                    # if we're in resume mode AND self.pathcount < self.svgLastPath, then skip over this path.
-                    # if we're in resume mode and self.pathcount = self.svgLastPath, then start here, and set
-                    # self.nodeCount equal to self.svgLastPathNC
-
-                    doWePlotThisPath = False
-                    if (self.resumeMode):
-                        if (self.pathcount < self.svgLastPath_Old):
-                            # This path was *completely plotted* already; skip.
-                            self.pathcount += 1
-                        elif (self.pathcount == self.svgLastPath_Old):
-                            # this path is the first *not completely* plotted path:
-                            self.nodeCount = self.svgLastPathNC_Old  # Nodecount after last completed path
-                            doWePlotThisPath = True
-                    else:
-                        doWePlotThisPath = True
-                    if (doWePlotThisPath):
-                        self.pathcount += 1
-
-                        cx = float(node.get('cx', '0'))
-                        cy = float(node.get('cy', '0'))
-                        x1 = cx - rx
-                        x2 = cx + rx
-                        d = 'M %.15f,%.15f ' % (x1, cy) + \
-                            'A %.15f,%.15f ' % (rx, ry) + \
-                            '0 1 0 %.15f,%.15f ' % (x2, cy) + \
-                            'A %.15f,%.15f ' % (rx, ry) + \
-                            '0 1 0 %.15f,%.15f' % (x1, cy)
-                        newpath = fourxidraw_compat.compatEtreeElement(
-                            inkex.addNS('path', 'svg'))
-                        newpath.set('d', d)
-                        s = node.get('style')
-                        if s:
-                            newpath.set('style', s)
-                        t = node.get('transform')
-                        if t:
-                            newpath.set('transform', t)
-                        self.plotPath(newpath, matNew)
-
-                elif node.tag == inkex.addNS('metadata', 'svg') or node.tag == 'metadata':
-                    pass
-                elif node.tag == inkex.addNS('defs', 'svg') or node.tag == 'defs':
-                    pass
-                elif node.tag == inkex.addNS('namedview', 'sodipodi') or node.tag == 'namedview':
-                    pass
-                elif node.tag == inkex.addNS('WCB', 'svg') or node.tag == 'WCB':
-                    pass
-                elif node.tag == inkex.addNS('eggbot', 'svg') or node.tag == 'eggbot':
-                    pass
-                elif node.tag == inkex.addNS('title', 'svg') or node.tag == 'title':
-                    pass
-                elif node.tag == inkex.addNS('desc', 'svg') or node.tag == 'desc':
-                    pass
-                elif (node.tag == inkex.addNS('text', 'svg') or node.tag == 'text' or
-                      node.tag == inkex.addNS('flowRoot', 'svg') or node.tag == 'flowRoot'):
-                    if (not 'text' in self.warnings) and (self.plotCurrentLayer):
-                        inkex.errormsg(gettext.gettext('Note: This file contains some plain text, found in a \nlayer named: "' +
-                                                       self.sCurrentLayerName + '" .\n' +
-                                                       'Please convert your text into paths before drawing,  \n' +
-                                                       'using Path > Object to Path. \n' +
-                                                       'You can also create new text by using Hershey Text,\n' +
-                                                       'located in the menu at Extensions > Render.'))
-                        self.warnings['text'] = 1
-                    pass
-                elif node.tag == inkex.addNS('image', 'svg') or node.tag == 'image':
-                    if (not 'image' in self.warnings) and (self.plotCurrentLayer):
-                        inkex.errormsg(gettext.gettext('Warning: in layer "' +
-                                                       self.sCurrentLayerName + '" unable to draw bitmap images; ' +
-                                                       'Please convert images to line art before drawing. ' +
-                                                       ' Consider using the Path > Trace bitmap tool. '))
-                        self.warnings['image'] = 1
-                    pass
-                elif node.tag == inkex.addNS('pattern', 'svg') or node.tag == 'pattern':
-                    pass
-                elif node.tag == inkex.addNS('radialGradient', 'svg') or node.tag == 'radialGradient':
-                    # Similar to pattern
-                    pass
-                elif node.tag == inkex.addNS('linearGradient', 'svg') or node.tag == 'linearGradient':
-                    # Similar in pattern
-                    pass
-                elif node.tag == inkex.addNS('style', 'svg') or node.tag == 'style':
-                    # This is a reference to an external style sheet and not the value
-                    # of a style attribute to be inherited by child elements
-                    pass
-                elif node.tag == inkex.addNS('cursor', 'svg') or node.tag == 'cursor':
-                    pass
-                elif node.tag == inkex.addNS('color-profile', 'svg') or node.tag == 'color-profile':
-                    # Gamma curves, color temp, etc. are not relevant to single color output
-                    pass
-                elif not fourxidraw_compat.compatIsBasestring(node.tag):
-                    # This is likely an XML processing instruction such as an XML
-                    # comment.  lxml uses a function reference for such node tags
-                    # and as such the node tag is likely not a printable string.
-                    # Further, converting it to a printable string likely won't
-                    # be very useful.
-                    pass
-                else:
-                    if (not str(node.tag) in self.warnings) and (self.plotCurrentLayer):
-                        t = str(node.tag).split('}')
-                        inkex.errormsg(gettext.gettext('Warning: in layer "' +
-                                                       self.sCurrentLayerName + '" unable to draw <' + str(t[-1]) +
-                                                       '> object, please convert it to a path first.'))
-                        self.warnings[str(node.tag)] = 1
-                    pass
-
-    def DoWePlotLayer(self, strLayerName):
-        """
-        Parse layer name for layer number and other properties.
+                matNew, fourxidraw_compat.compatParseTransform('translate(%.15f,%.15f)' % (x, y)))
+        v = node.get('visibility', v)
+        self.recursivelyTraverseSvg(refnode, matNew, parent_visibility=v)
 
-        First: scan layer name for first non-numeric character,
-        and scan the part before that (if any) into a number
-        Then, (if not printing in all-layers mode)
-        see if the number matches the layer number that we are printing.
+    def plotThisPath(self):
+        '''
+        Count the path about to be plotted, and say whether to plot it.
+        If we're in resume mode, paths completely plotted already are
+        skipped, and plotting starts again at the first that was not,
+        with self.nodeCount as it was after the last path completed.
+        '''
+        if (self.resumeMode):
+            if (self.pathcount < self.resumeOld.lastPath):
+                # This path was *completely plotted* already; skip.
+                self.pathcount += 1
+                return False
+            elif (self.pathcount == self.resumeOld.lastPath):
+                # this path is the first *not completely* plotted path:
+                self.nodeCount = self.resumeOld.lastPathNC  # Nodecount after last completed path
+            else:
+                return False
+        self.pathcount += 1
+        return True
+
+    def traversePath(self, node, matCurrent, v):
+        if self.plotThisPath():
+            self.plotPath(node, self.nodeTransform(node, matCurrent))
+
+    def traverseRect(self, node, matCurrent, v):
+        # Plot the outline of <rect x="X" y="Y" width="W" height="H" rx="RX" ry="RY"/>
+        # If only one of rx and ry is given, it is used for both; each is at
+        # most half the width or height.
+        if not self.plotThisPath():
+            return
+        x = float(node.get('x', '0'))
+        y = float(node.get('y', '0'))
+        width = float(node.get('width', '0'))
+        height = float(node.get('height', '0'))
+        rx = float(node.get('rx', node.get('ry', '0')))
+        ry = float(node.get('ry', node.get('rx', '0')))
+        matrix = self.shapeMatrix(node, matCurrent)
+        if rx > 0 and ry > 0:
+            rx = min(rx, width / 2)
+            ry = min(ry, height / 2)
+            segments = plot_utils.arcSegments(
+                max(rx, ry) * plot_utils.transformScale(matrix), 0.02 / self.options.smoothness)
+            coords = plot_utils.roundedRectPoints(x, y, width, height, rx, ry, segments // 4)
+        else:
+            coords = plot_utils.rectPoints(x, y, width, height)
+        self.plotShape(node, coords, matrix)
+
+    def traverseLine(self, node, matCurrent, v):
+        # <line x1="X1" y1="Y1" x2="X2" y2="Y2"/>
+        if self.plotThisPath():
+            coords = [float(node.get('x1', '0')), float(node.get('y1', '0')),
+                      float(node.get('x2', '0')), float(node.get('y2', '0'))]
+            self.plotShape(node, coords, self.shapeMatrix(node, matCurrent))
+
+    def traversePolyline(self, node, matCurrent, v):
+        # <polyline points="x1,y1 x2,y2 x3,y3 [...]"/>
+        # Note: we ignore polylines with no points
+        coords = plot_utils.parsePoints(node.get('points'))
+        if coords and self.plotThisPath():
+            self.plotShape(node, coords, self.shapeMatrix(node, matCurrent))
+
+    def traversePolygon(self, node, matCurrent, v):
+        # <polygon points="x1,y1 x2,y2 x3,y3 [...]"/>, closed back to x1,y1
+        # Note: we ignore polygons with no points
+        coords = plot_utils.parsePoints(node.get('points'))
+        if coords and self.plotThisPath():
+            self.plotShape(node, coords + coords[:2], self.shapeMatrix(node, matCurrent))
+
+    def traverseEllipse(self, node, matCurrent, v):
+        # <circle r="R" cx="X" cy="Y"/> or <ellipse rx="RX" ry="RY" cx="X" cy="Y"/>
+        # These are drawn as the unit circle, cut into as many segments as
+        # the smoothness calls for at the size it is plotted, and scaled
+        # to the ellipse by its transform.
+        # Note: ellipses or circles with a radius attribute of value 0 are ignored
+
+        if node.tag == 'ellipse' or node.tag == SVG_ELLIPSE:
+            rx = float(node.get('rx', '0'))
+            ry = float(node.get('ry', '0'))
+        else:
+            rx = float(node.get('r', '0'))
+            ry = rx
+        if rx == 0 or ry == 0:
+            return
 
-        Secondary function: Parse characters following the layer number (if any) to see if
-        there is a "+H" or "+S" escape code, that indicates that overrides the pen-down
-        height or speed for the given layer.
+        if self.plotThisPath():
+            cx = float(node.get('cx', '0'))
+            cy = float(node.get('cy', '0'))
+            matrix = self.shapeMatrix(node, matCurrent)
+            segments = plot_utils.arcSegments(
+                max(abs(rx), abs(ry)) * plot_utils.transformScale(matrix),
+                0.02 / self.options.smoothness)
+            self.plotShape(node, plot_utils.unitCircle(segments),
+                           plot_utils.ellipseTransform(matrix, cx, cy, rx, ry))
+
+    def warnText(self, node, matCurrent, v):
+        if (not 'text' in self.warnings):
+            inkex.errormsg(gettext.gettext('Note: This file contains some plain text, found in a \nlayer named: "' +
+                                           self.sCurrentLayerName + '" .\n' +
+                                           'Please convert your text into paths before drawing,  \n' +
+                                           'using Path > Object to Path. \n' +
+                                           'You can also create new text by using Hershey Text,\n' +
+                                           'located in the menu at Extensions > Render.'))
+            self.warnings['text'] = 1
+
+    def warnImage(self, node, matCurrent, v):
+        if (not 'image' in self.warnings):
+            inkex.errormsg(gettext.gettext('Warning: in layer "' +
+                                           self.sCurrentLayerName + '" unable to draw bitmap images; ' +
+                                           'Please convert images to line art before drawing. ' +
+                                           ' Consider using the Path > Trace bitmap tool. '))
+            self.warnings['image'] = 1
+
+    def warnUnhandled(self, node, matCurrent, v):
+        if not fourxidraw_compat.compatIsBasestring(node.tag):
+            # This is likely an XML processing instruction such as an XML
+            # comment.  lxml uses a function reference for such node tags
+            # and as such the node tag is likely not a printable string.
+            # Further, converting it to a printable string likely won't
+            # be very useful.
+            return
+        if (not str(node.tag) in self.warnings):
+            t = str(node.tag).split('}')
+            inkex.errormsg(gettext.gettext('Warning: in layer "' +
+                                           self.sCurrentLayerName + '" unable to draw <' + str(t[-1]) +
+                                           '> object, please convert it to a path first.'))
+            self.warnings[str(node.tag)] = 1
+
+    def DoWePlotLayer(self, layer):
+        """
+        Decide whether to plot a layer, from its entry in the layer index
+        (see plot_layers): not if its name starts with "%", nor, when
+        printing in layers mode, unless its number is the one being printed.
 
+        Secondary function: apply any "+H" or "+S" overrides of the
+        pen-down height or speed given in the layer name.
         """
 
-        # Look at layer name.  Sample first character, then first two, and
-        # so on, until the string ends or the string no longer consists of digit characters only.
-        TempNumString = 'x'
-        stringPos = 1
-        layerNameInt = -1
-        layerMatch = False
-        # Yes this is ugly. More elegant suggestions welcome. :)
-        if sys.version_info < (3,):
-            CurrentLayerName = strLayerName.encode(
-                'ascii', 'ignore')  # Drop non-ascii characters
-        else:
-            CurrentLayerName = str(strLayerName)
-        CurrentLayerName.lstrip  # remove leading whitespace
-        self.plotCurrentLayer = True  # Temporarily assume that we are plotting the layer
-
-        MaxLength = len(CurrentLayerName)
-        if MaxLength > 0:
-            if CurrentLayerName[0] == '%':
-                self.plotCurrentLayer = False  # First character is "%" -- skip this layer
-            while stringPos <= MaxLength:
-                LayerNameFragment = CurrentLayerName[:stringPos]
-                if (LayerNameFragment.isdigit()):
-                    # Store longest numeric string so far
-                    TempNumString = CurrentLayerName[:stringPos]
-                    stringPos = stringPos + 1
-                else:
-                    break
+        self.plotCurrentLayer = not layer.skip
 
         # Also true if resuming a print that was of a single layer.
-        if (self.PrintInLayersMode):
-            if (str.isdigit(TempNumString)):
-                layerNameInt = int(float(TempNumString))
-                if (self.svgLayer == layerNameInt):
-                    layerMatch = True  # Match! The current layer IS named.
-
-            if (layerMatch == False):
-                self.plotCurrentLayer = False
+        if (self.PrintInLayersMode) and (layer.number != self.resume.layer):
+            self.plotCurrentLayer = False
 
         if (self.plotCurrentLayer == True):
             self.LayersFoundToPlot = True
 
-            # End of part 1, current layer to see if we print it.
-            # Now, check to see if there is additional information coded here.
-
-            oldPenDown = self.LayerPenDownPosition
             oldSpeed = self.LayerPenDownSpeed
 
             # set default values before checking for any overrides:
@@ -1173,58 +1382,33 @@ class FourxiDrawClass(inkex.Effect):
             self.LayerPenDownPosition = -1
             self.LayerPenDownSpeed = -1
 
-            if (stringPos > 0):
-                stringPos = stringPos - 1
-
-            if MaxLength > stringPos + 2:
-                while stringPos <= MaxLength:
-                    EscapeSequence = CurrentLayerName[stringPos:stringPos+2].lower()
-                    if (EscapeSequence == "+h") or (EscapeSequence == "+s"):
-                        paramStart = stringPos + 2
-                        stringPos = stringPos + 3
-                        TempNumString = 'x'
-                        if MaxLength > 0:
-                            while stringPos <= MaxLength:
-                                if str.isdigit(CurrentLayerName[paramStart:stringPos]):
-                                    # Longest numeric string so far
-                                    TempNumString = CurrentLayerName[paramStart:stringPos]
-                                    stringPos = stringPos + 1
-                                else:
-                                    break
-                        if (str.isdigit(TempNumString)):
-                            parameterInt = int(float(TempNumString))
-
-                            if (EscapeSequence == "+h"):
-                                if ((parameterInt >= 0) and (parameterInt <= 100)):
-                                    self.LayerOverridePenDownHeight = True
-                                    self.LayerPenDownPosition = parameterInt
-
-                            if (EscapeSequence == "+s"):
-                                if ((parameterInt > 0) and (parameterInt <= 100)):
-                                    self.LayerOverrideSpeed = True
-                                    self.LayerPenDownSpeed = parameterInt
-
-                        stringPos = paramStart + len(TempNumString)
-                    else:
-                        break  # exit loop.
+            if layer.penDownHeight is not None:
+                self.LayerOverridePenDownHeight = True
+                self.LayerPenDownPosition = layer.penDownHeight
+            if layer.penDownSpeed is not None:
+                self.LayerOverrideSpeed = True
+                self.LayerPenDownSpeed = layer.penDownSpeed
 
             if (self.LayerPenDownSpeed != oldSpeed):
                 # Set speed value variables for this layer.
                 self.EnableMotors()
 
-    def plotPath(self, path, matTransform):
+    def plotPath(self, path, matTransform, d=None):
         '''
         Plot the path while applying the transformation defined
-        by the matrix [matTransform].
+        by the matrix [matTransform].  d, if given, is plotted in place
+        of the path's own d attribute.
         '''
         self.logDebug('plotPath: Enter')
         # turn this path into a cubicsuperpath (list of beziers)...
 
-        d = path.get('d')
+        if d is None:
+            d = path.get('d')
 
         if fourxidraw_compat.compatIsEmptyPath(d):
             self.logDebug('plotPath: Zero length')
             return
+        self.currentPath = path
 
         if self.plotCurrentLayer:
             self.logDebug('plotPath: plotCurrentLayer')
@@ -1239,45 +1423,71 @@ class FourxiDrawClass(inkex.Effect):
 
                 plot_utils.subdivideCubicPath(
                     sp, 0.02 / self.options.smoothness)
-                nIndex = 0
-
-                singlePath = []
-                if self.plotCurrentLayer:
-                    for csp in sp:
-                        if self.bStopped:
-                            return
-                        if (self.printPortrait):
-                            fX = float(csp[1][1])  # Flipped X/Y
-                            fY = (self.svgWidth) - float(csp[1][0])
-                        else:
-                            fX = float(csp[1][0])  # Set move destination
-                            fY = float(csp[1][1])
-
-                        self.logDebug('plotPath: X %.15f Y %.15f' % (fX, fY))
-
-                        if nIndex == 0:
-                            if (plot_utils.distance(fX - self.fCurrX, fY - self.fCurrY) > fourxidraw_conf.MinGap):
-                                if not self.options.boundingBox:
-                                    self.penUp()
-                                self.plotSegment(fX, fY)
-                        elif nIndex == 1:
-                            if not self.options.boundingBox:
-                                self.penDown()
-                        nIndex += 1
-
-                        singlePath.append([fX, fY])
-
-                    self.PlanTrajectory(singlePath)
-
-            if (not self.bStopped):  # an "index" for resuming plots quickly-- record last complete path
-                self.svgLastPath = self.pathcount  # The number of the last path completed
-                # the node count after the last path was completed.
-                self.svgLastPathNC = self.nodeCount
+
+                if self.plotCurrentLayer and sp:
+                    if self.bStopped:
+                        return
+                    singlePath = plot_utils.Polyline.fromSubpath(
+                        sp, self.printPortrait, self.svgWidth)
+                    if not self.plotPolyline(singlePath):
+                        return
+
+            self.finishPath()
+        self.currentPath = None
+
+    def plotShape(self, node, coords, matrix):
+        '''
+        Plot the outline of a basic shape: the points coords, a flat list
+        [x1, y1, x2, y2, ...], after applying the 2x3 transform [matrix]
+        (see shapeMatrix).  These are drawn straight from their points, or
+        from arcs flattened analytically, so skip the path data altogether.
+        '''
+        if not self.plotCurrentLayer or self.bStopped:
+            return
+        self.currentPath = node
+        singlePath = plot_utils.Polyline.fromPoints(
+            coords, matrix, self.printPortrait, self.svgWidth)
+        if self.plotPolyline(singlePath):
+            self.finishPath()
+        self.currentPath = None
+
+    def plotPolyline(self, singlePath):
+        '''
+        Plot one subpath, a plot_utils.Polyline: move to its start, and draw
+        the rest of it.  Returns False if the plot was stopped first.
+        '''
+        if self.doLogDebug:
+            for fX, fY in singlePath:
+                self.logDebug('plotPath: X %.15f Y %.15f' % (fX, fY))
+
+        # Move to the start of the subpath, and lower the pen if there is more to it
+        fX, fY = singlePath.point(0)
+        if (plot_utils.distance(fX - self.fCurrX, fY - self.fCurrY) > fourxidraw_conf.MinGap):
+            if not self.options.boundingBox:
+                self.penUp()
+            self.plotSegment(fX, fY)
+        if len(singlePath) > 1:
+            if self.bStopped:
+                return False
+            if not self.options.boundingBox:
+                self.penDown()
+
+        self.PlanTrajectory(singlePath)
+        return True
+
+    def finishPath(self):
+        if (not self.bStopped):  # an "index" for resuming plots quickly-- record last complete path
+            self.resume.lastPath = self.pathcount  # The number of the last path completed
+            # the node count after the last path was completed.
+            self.resume.lastPathNC = self.nodeCount
+            if self.compiling:
+                self.motion.checkpoint(self.pathcount)
 
     def PlanTrajectory(self, inputPath):
         '''
         Plan the trajectory for a full path, accounting for linear acceleration.
-        Inputs: Ordered (x,y) pairs to cover.
+        Inputs: A plot_utils.Polyline of the (x,y) points to cover, in order;
+          it is clamped to the page in place.
         Output: A list of segments to plot, of the form (Xfinal, Yfinal, Vinitial, Vfinal)
 
         Note: Native motor axes are Motor 1, Motor 2.
@@ -1298,30 +1508,34 @@ class FourxiDrawClass(inkex.Effect):
         if (self.fCurrX is None):
             return
 
-        # check page size limits:
+        # check page size limits, once for the whole path:
         if (self.ignoreLimits == False):
-            for xy in inputPath:
-                xy[0], xBounded = plot_utils.checkLimits(
-                    xy[0], self.xBoundsMin, self.xBoundsMax)
-                xy[1], yBounded = plot_utils.checkLimits(
-                    xy[1], self.yBoundsMin, self.yBoundsMax)
-                if (xBounded or yBounded):
-                    self.warnOutOfBounds = True
+            clip = inputPath.clamp(self.xBoundsMin, self.xBoundsMax,
+                                   self.yBoundsMin, self.yBoundsMax)
+            if clip is not None:
+                points, excess, (x, y) = clip
+                self.noteClipped(points, excess, x, y)
+
+        if self.options.boundingBox:
+            # Only the extents are wanted: take in the whole path at once
+            self.widenBoundingBox(*inputPath.extents())
+            return
 
         # Handle simple segments (lines) that do not require any complex planning:
         if (len(inputPath) < 3):
             if spewTrajectoryDebugData:
                 # This is the "SHORTPATH ESCAPE"
                 self.logDebug('Drawing straight line, not a curve.')
-            self.plotSegment(xy[0], xy[1])
+            xDest, yDest = inputPath.point(-1)
+            self.plotSegment(xDest, yDest, True)
             return
 
         # For other trajectories, we need to go deeper.
         TrajLength = len(inputPath)
 
         if spewTrajectoryDebugData:
-            for xy in inputPath:
-                self.logDebug('x: %1.3f,  y: %1.3f' % (xy[0], xy[1]))
+            for x, y in inputPath:
+                self.logDebug('x: %1.3f,  y: %1.3f' % (x, y))
             self.logDebug('\nTrajLength: '+str(TrajLength) + '\n')
 
         # Absolute maximum and minimum speeds allowed:
@@ -1337,39 +1551,26 @@ class FourxiDrawClass(inkex.Effect):
         else:
             speedLimit = self.PenDownSpeed/self.stepsPerInch
 
-        # float, Segment length (distance) when arriving at the junction
-        TrajDists = array('f')
-        TrajVectors = []    # Array that will hold normalized unit vectors along each segment
-
-        TrajDists.append(0.0)  # First value, at time t = 0
-
-        for i in xrange(1, TrajLength):
-            # Distance per segment:
-            tmpDist = plot_utils.distance(inputPath[i][0] - inputPath[i - 1][0],
-                                          inputPath[i][1] - inputPath[i - 1][1])
-            TrajDists.append(tmpDist)
-            # Normalized unit vectors:
-
-            if (tmpDist == 0):
-                tmpDist = 1
-            tmpX = (inputPath[i][0] - inputPath[i - 1][0]) / tmpDist
-            tmpY = (inputPath[i][1] - inputPath[i - 1][1]) / tmpDist
-            TrajVectors.append([tmpX, tmpY])
-
         if spewTrajectoryDebugData:
-            for dist in TrajDists:
-                self.logDebug('TrajDists: %1.3f' % dist)
+            # Segment length (distance) when arriving at each junction
+            coords = inputPath.coords
+            self.logDebug('TrajDists: %1.3f' % 0.0)
+            for i in xrange(2, len(coords), 2):
+                self.logDebug('TrajDists: %1.3f' % plot_utils.distance(
+                    coords[i] - coords[i - 2], coords[i + 1] - coords[i - 1]))
             self.logDebug('\n')
 
-        for i in xrange(1, TrajLength):
-            self.plotSegment(inputPath[i][0], inputPath[i][1])
+        # GRBL plans the acceleration itself; hand it the points in order
+        for xDest, yDest in inputPath.points(1):
+            self.plotSegment(xDest, yDest, True)
 
-    def plotSegment(self, xDest, yDest):
+    def plotSegment(self, xDest, yDest, clamped=False):
         ''' 
         Control the serial port to command the machine to draw
         a straight line segment.
 
-        Inputs:   Destination (x,y)
+        Inputs:   Destination (x,y); clamped if it is already known
+                  to be within the machine's travel.
 
         Method: Divide the segment up into smaller segments.
         Send commands out the com port as a set of short line segments (dx, dy)
@@ -1382,12 +1583,14 @@ class FourxiDrawClass(inkex.Effect):
 #   spewSegmentDebugData = False
         spewSegmentDebugData = True
 
-        if spewSegmentDebugData:
+        if spewSegmentDebugData and self.doLogDebug:
             self.logDebug('\nPlotSegment(x = %1.2f, y = %1.2f) ' %
                           (xDest, yDest))
             if self.resumeMode:
                 self.logDebug('resumeMode is active')
 
+        if (not self.compiling) and self.motion.IsPausePressed():
+            self.bStopped = True
         if self.bStopped:
             self.logDebug('Stopped')
             return
@@ -1396,23 +1599,36 @@ class FourxiDrawClass(inkex.Effect):
             return
 
         # check page size limits:
-        if (self.ignoreLimits == False):
-            xDest, xBounded = plot_utils.checkLimits(
+        if (not clamped) and (self.ignoreLimits == False):
+            xBounded, xOut = plot_utils.checkLimits(
                 xDest, self.xBoundsMin, self.xBoundsMax)
-            yDest, yBounded = plot_utils.checkLimits(
+            yBounded, yOut = plot_utils.checkLimits(
                 yDest, self.yBoundsMin, self.yBoundsMax)
-            if (xBounded or yBounded):
-                self.warnOutOfBounds = True
-
-        self.logDebug('doAbsoluteMove(%.15f, %.15f)' % (xDest, yDest))
+            if (xOut or yOut):
+                self.noteClipped(1, plot_utils.distance(xDest - xBounded, yDest - yBounded),
+                                 xDest, yDest)
+                xDest = xBounded
+                yDest = yBounded
+
+        if self.doLogDebug:
+            self.logDebug('doAbsoluteMove(%.15f, %.15f)' % (xDest, yDest))
         if self.options.boundingBox:
-            self.bb['minX'] = min(self.bb['minX'], xDest)
-            self.bb['minY'] = min(self.bb['minY'], yDest)
-            self.bb['maxX'] = max(self.bb['maxX'], xDest)
-            self.bb['maxY'] = max(self.bb['maxY'], yDest)
+            self.widenBoundingBox(xDest, yDest, xDest, yDest)
         else:
             self.motion.doAbsoluteMove(xDest, yDest)
 
+    def widenBoundingBox(self, minX, minY, maxX, maxY):
+        '''Widen the bounding box, and the current layer's, to take in the given box.'''
+        layerBB = self.layerBB.get(self.sCurrentLayerName)
+        if layerBB is None:
+            layerBB = self.layerBB[self.sCurrentLayerName] = dict(EMPTY_BOUNDING_BOX)
+            self.layerBBOrder.append(self.sCurrentLayerName)
+        for bb in (self.bb, layerBB):
+            bb['minX'] = min(bb['minX'], minX)
+            bb['minY'] = min(bb['minY'], minY)
+            bb['maxX'] = max(bb['maxX'], maxX)
+            bb['maxY'] = max(bb['maxY'], maxY)
+
     def EnableMotors(self):
         ''' 
         Enable motors, set native motor resolution, and set speed scales.
@@ -1463,10 +1679,7 @@ class FourxiDrawClass(inkex.Effect):
                 vTime = 0
             self.motion.sendPenUp(
                 vTime, self.options.penUpSpeed if self.options.applySpeed else None)
-            if (vTime > 50):
-                if self.options.mode != "manual":
-                    # pause before issuing next command
-                    time.sleep(float(vTime - 10)/1000.0)
+            self.penPause(vTime)
             self.bPenIsUp = True
 
     def penDown(self):
@@ -1487,12 +1700,16 @@ class FourxiDrawClass(inkex.Effect):
                     vTime = 0
                 self.motion.sendPenDown(
                     vTime, self.options.penDownSpeed if self.options.applySpeed else None)
-                if (vTime > 50):
-                    if self.options.mode != "manual":
-                        # pause before issuing next command
-                        time.sleep(float(vTime - 10)/1000.0)
+                self.penPause(vTime)
                 self.bPenIsUp = False
 
+    def penPause(self, vTime):
+        # Wait for the pen to settle, unless the plot is only being compiled
+        if (vTime > 50) and (not self.compiling):
+            if self.options.mode != "manual":
+                # pause before issuing next command
+                time.sleep(float(vTime - 10)/1000.0)
+
     def getDocProps(self):
         '''
         Get the document's height and width attributes from the <svg> tag.
@@ -1509,8 +1726,9 @@ class FourxiDrawClass(inkex.Effect):
             return True
 
 
-e = FourxiDrawClass()
-if fourxidraw_compat.isPython3():
-    e.run()
-else:
-    e.affect()
+if __name__ == '__main__':
+    e = FourxiDrawClass()
+    if fourxidraw_compat.isPython3():
+        e.run()
+    else:
+        e.affect()
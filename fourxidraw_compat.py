@@ -26,15 +26,11 @@ import sys
 def isPython3():
     return sys.version_info[0] == 3
 
-# Import what's necessary to support the code paths that we're using
-if isPython3():
-    # new
-    import inkex
-    from inkex.paths import *
-    from inkex.transforms import *
-    from inkex import bezier
-    from lxml import etree
-else:
+# Import what's necessary to support the code paths that we're using.
+# Under Python 3 each function imports what it uses of inkex when first
+# called, so that the command-line tools, which only need the simplest of
+# these, do not spend most of their start-up loading inkex.
+if not isPython3():
     # old
     import cspsubdiv
     from bezmisc import *
@@ -46,6 +42,7 @@ def compatGetArgumentTypeFromName(type_name):
         # Cater for non-built-in type as per
         # https://wiki.inkscape.org/wiki/index.php/Updating_your_Extension_for_1.0#Collecting_the_options_of_the_extension
         if type_name == 'inkbool':
+            import inkex
             return inkex.Boolean
             
         return getattr(builtins, type_name)
@@ -72,6 +69,7 @@ def compatPxPerInch():
 def compatEtreeElement(elem):
 
     if isPython3():
+        from lxml import etree
         return etree.Element(elem)
     else:
         return inkex.etree.Element(elem)
@@ -80,6 +78,7 @@ def compatEtreeElement(elem):
 def compatEtreeSubElement(a, b):
 
     if isPython3():
+        from lxml import etree
         return etree.SubElement(a, b)
     else:
         return inkex.etree.SubElement(a, b)
@@ -99,6 +98,7 @@ def compatAppendCommand(a, command, data):
 def compatFormatPath(a):
  
     if isPython3():
+        from inkex.paths import Path
         return str(Path(a))
     else:
         return simplepath.formatPath(a)
@@ -108,6 +108,7 @@ def compatFormatPath(a):
 def compatBezierSplitAtT(b, t):
 
     if isPython3():
+        from inkex import bezier
         return bezier.beziersplitatt( b, t )
     else:
         return beziersplitatt( b, t )        
@@ -116,6 +117,7 @@ def compatBezierSplitAtT(b, t):
 def compatCspSubDivMaxDist(b):
 
     if isPython3():
+        from inkex import bezier
         return bezier.maxdist( b )
     else:
         return cspsubdiv.maxdist( b )
@@ -124,6 +126,7 @@ def compatCspSubDivMaxDist(b):
 def compatParseTransform(stringRepresentation):
 
     if isPython3():
+        from inkex.transforms import Transform
         return Transform(stringRepresentation).matrix
     else:
         return simpletransform.parseTransform(stringRepresentation)
@@ -132,14 +135,25 @@ def compatParseTransform(stringRepresentation):
 def compatComposeTransform(a, b):
 
     if isPython3():
+        from inkex.transforms import Transform
         return Transform(a) * Transform(b)
     else:
         return composeTransform(a, b)
         
+# The [[a, c, e], [b, d, f]] matrix of a transform, as composed above
+def compatTransformMatrix(matTransform):
+
+    if isPython3():
+        from inkex.transforms import Transform
+        return Transform(matTransform).matrix
+    else:
+        return matTransform
+
 # DeprecationWarning: simplepath.parsePath -> element.path.to_arrays()
 def compatIsEmptyPath(stringRepresentation):
 
     if isPython3():
+        from inkex.paths import Path
         return len(Path(stringRepresentation).to_arrays()) == 0
     else:
         return len(simplepath.parsePath(stringRepresentation)) == 0
@@ -148,6 +162,7 @@ def compatIsEmptyPath(stringRepresentation):
 def compatParseCubicSuperPath(stringRepresentation):
 
     if isPython3():
+        from inkex.paths import CubicSuperPath, Path
         return CubicSuperPath(Path(stringRepresentation))
     else:
         return cubicsuperpath.parsePath(stringRepresentation)
@@ -166,7 +181,9 @@ def compatParseCubicSuperPath(stringRepresentation):
 def compatApplyTransformToPath(matTransform, p):
     
     if isPython3():
-        return inkex.paths.CubicSuperPath(Path(p).transform(Transform(matTransform)))
+        from inkex.paths import CubicSuperPath, Path
+        from inkex.transforms import Transform
+        return CubicSuperPath(Path(p).transform(Transform(matTransform)))
     else:
         applyTransformToPath(matTransform, p)
         return p
@@ -34,6 +34,7 @@ PenDownPos = 0			# Default pen-down position
 applySpeed = False      # Whether to apply speeds to GRBL for pen up and pen down
 PenUpSpeed = 5000       # Speed when pen up (mm/min)
 PenDownSpeed = 1000     # Speed when pen down (mm/min)
+keepFeedOverride = True # Reapply the feed override chosen during the last plot
 
 penLowerDelay = 0		# added delay (ms) for the pen to go down before the next move
 penLiftDelay = 0		# added delay (ms) for the pen to go up before the next move
@@ -46,11 +47,16 @@ autoRotate = True		# Print in portrait or landscape mode automatically
 constSpeed = False		# Use constant velocity mode when pen is down
 reportTime = True		# Report time elapsed
 logSerial = False		# Log serial communication
+keepConnection = False	# Keep GRBL connected between runs, so the board is not reset
+profile = False			# Report where the time taken by a plot goes
+profileFile = ''		# Where to write the profile as JSON; by default, the cache directory
+outlineFile = ''		# Where preflighting writes G-code tracing the plot's extents; '' for none
 
 smoothness = 10.0		# Curve smoothing (default: 10.0)
 cornering = 10.0		# Cornering speed factor (default: 10.0)
 
 DefaultLayer = 1		# Default inkscape layer, when plotting in "layers" mode
+batchLayers = False		# In "layers" mode, plot every numbered layer in turn, pausing to change pens
 
 
 '''
@@ -100,3 +106,6 @@ ShortThreshold = 1.0	# Distance Threshold (inches)
 
 # Skip pen-up moves shorter than this distance, when possible:
 MinGap = 0.010			# Distance Threshold (inches)
+
+# Paths listed, per layer, when a plot is clipped to the travel:
+ClipReportPaths = 5	# Any more are only counted
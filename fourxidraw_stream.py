@@ -0,0 +1,299 @@
+# fourxidraw_stream.py
+# Part of the 4xiDraw driver for Inkscape
+#
+# Plots an SVG file too large to load whole, reading it as it goes.
+# The extension hands fourxidraw.py the document as a complete tree;
+# this runs the same plot from the command line, with lxml's iterparse,
+# keeping only the elements still open at any moment, and the transform,
+# visibility and layer of each.  Every element is discarded as soon as
+# it has been plotted, so memory does not grow with the size of the file.
+#
+#     python fourxidraw_stream.py [options] drawing.svg
+#     python fourxidraw_stream.py --gcodeFile=drawing.gcode drawing.svg
+#     python fourxidraw_stream.py --journalFile=drawing.journal drawing.svg
+#
+# The options are those of the extension; only the "plot" and "layers"
+# modes can be used.  With --gcodeFile the plot is written there as
+# G-code instead of being sent to the 4xiDraw.  With --journalFile it is
+# compiled into a plot journal there, for grbl_fleet.py to plot.
+#
+# What cannot be done without the whole document is left out: <use>
+# clones, whose originals may be anywhere in the file, are skipped with
+# a warning; and as the file is not written back, a stopped plot cannot
+# be resumed.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import gettext
+import sys
+
+import inkex
+from lxml import etree
+
+import fourxidraw
+import fourxidraw_compat
+import grbl_daemon
+import grbl_serial
+import plot_journal
+import plot_layers
+
+GROUP_TAGS = (inkex.addNS('g', 'svg'), 'g')
+USE_TAGS = (inkex.addNS('use', 'svg'), 'use')
+
+STREAMED_MODES = ('plot', 'layers')
+
+
+def iterateDocument(f, events=('start', 'end')):
+    '''
+    The (event, element) pairs of the SVG file f, as iterparse gives them,
+    with every element cleared at its end and dropped from its parent
+    once the next one ends: only the elements still open are kept.
+    '''
+    for event, node in etree.iterparse(f, events=('start', 'end'), huge_tree=True,
+                                       remove_comments=True, remove_pis=True):
+        if event in events:
+            yield event, node
+        if event == 'end':
+            node.clear()
+            parent = node.getparent()
+            if parent is not None:
+                while node.getprevious() is not None:
+                    del parent[0]
+
+
+def documentRoot(filename):
+    '''The document's <svg> element, read alone: a copy without children.'''
+    with open(filename, 'rb') as f:
+        for event, node in etree.iterparse(f, events=('start',)):
+            return etree.Element(node.tag, dict(node.attrib), nsmap=node.nsmap)
+    return None
+
+
+def layerNumbers(filename):
+    '''The layer numbers used in a file, in ascending order, as LayerIndex.numbers.'''
+    numbers = set()
+    with open(filename, 'rb') as f:
+        for event, node in iterateDocument(f, ('start',)):
+            if (node.tag in GROUP_TAGS) and plot_layers.isLayer(node):
+                layer = plot_layers.Layer(node)
+                if (layer.number is not None) and not layer.skip:
+                    numbers.add(layer.number)
+    return sorted(numbers)
+
+
+class GroupState(object):
+    '''What the children of an open group inherit from it.'''
+    __slots__ = ('matrix', 'visibility', 'layer')
+
+    def __init__(self, matrix, visibility, layer=None):
+        self.matrix = matrix            # Document units to inches, less their own transform
+        self.visibility = visibility
+        self.layer = layer              # For a layer: what to restore at its end
+
+
+class StreamPlotter(fourxidraw.FourxiDrawClass):
+
+    def __init__(self):
+        fourxidraw.FourxiDrawClass.__init__(self)
+        self.compat_add_option("--gcodeFile",
+                               action="store", type="string",
+                               dest="gcodeFile", default='',
+                               help="Write the plot to this G-code file instead of the 4xiDraw")
+        self.compat_add_option("--journalFile",
+                               action="store", type="string",
+                               dest="journalFile", default='',
+                               help="Compile the plot into this journal file, for grbl_fleet.py")
+        self.filename = None
+
+    def parseArguments(self, args):
+        if fourxidraw_compat.isPython3():
+            self.parse_arguments(args)
+            self.filename = self.options.input_file
+        else:
+            self.getoptions(args)
+            self.filename = self.args[-1]
+
+    def plot(self):
+        '''Plot the file; returns the exit status.'''
+        self.options.mode = self.options.mode.strip("\"")
+        if self.options.mode not in STREAMED_MODES:
+            inkex.errormsg(gettext.gettext(
+                'Only the plot and layers modes can be used on a streamed document.'))
+            return 2
+        if not self.filename:
+            inkex.errormsg(gettext.gettext('No SVG file was given to plot.'))
+            return 2
+        try:
+            self.svg = documentRoot(self.filename)
+        except (IOError, OSError, etree.XMLSyntaxError) as error:
+            inkex.errormsg(gettext.gettext('Could not read %s: %s') % (self.filename, error))
+            return 1
+        self.document = etree.ElementTree(self.svg)
+
+        if self.options.mode == 'plot':
+            self.PrintInLayersMode = False
+            self.plotCurrentLayer = True
+            self.resume.layer = 12345
+        else:
+            self.PrintInLayersMode = True
+            self.plotCurrentLayer = False
+            self.resume.layer = self.options.layerNumber
+            if self.options.batchLayers:
+                self.layerBatch = layerNumbers(self.filename)
+                if not self.layerBatch:
+                    inkex.errormsg(gettext.gettext(
+                        'There are no numbered layers to plot.'))
+                    return 1
+                self.resume.layer = self.layerBatch[0]
+
+        if self.options.journalFile:
+            return self.writeJournal(self.options.journalFile)
+
+        if self.options.profile:
+            self.startProfile()
+        if self.options.gcodeFile:
+            self.serialPort = grbl_serial.GcodeFile(self.options.gcodeFile)
+        else:
+            if self.options.keepConnection:
+                grbl_daemon.ensureDaemon(self.options.logSerial)
+            self.serialPort = grbl_serial.openPort(self.options.logSerial)
+            if self.serialPort is None:
+                inkex.errormsg(gettext.gettext(
+                    "Failed to connect to 4xiDraw. :("))
+                return 1
+            if self.profiler is not None:
+                self.profiler.instrumentSerial(self.serialPort)
+        self.createMotion()
+        try:
+            self.plotDocument()
+        finally:
+            self.serialPort.close()
+        if self.profiler is not None:
+            self.reportProfile()
+        return 1 if self.bStopped else 0
+
+    def writeJournal(self, filename):
+        '''
+        Compile the plot into a journal at filename, without the 4xiDraw;
+        returns the exit status.
+        '''
+        if not self.setDocTransform():
+            return 1
+        self.createMotion()     # With no serial port, it sends nothing
+        self.EnableMotors()
+        self.sCurrentLayerName = '(Not Set)'
+        try:
+            writer = plot_journal.JournalWriter(filename)
+        except (IOError, OSError) as error:
+            inkex.errormsg(gettext.gettext('Could not write %s: %s') % (filename, error))
+            return 1
+        try:
+            self.recordPlot(writer)
+        except:
+            writer.close(False)
+            raise
+        writer.close()
+        return 0
+
+    def traverseDocument(self):
+        if not self.PrintInLayersMode:
+            self.streamDocument()
+        else:
+            fourxidraw.FourxiDrawClass.traverseDocument(self)
+
+    def traverseLayers(self, number):
+        # DoWePlotLayer picks out the layers numbered self.resume.layer as they come
+        self.streamDocument()
+
+    def streamDocument(self):
+        '''
+        Plot the file as it is read, as recursivelyTraverseSvg would the
+        whole document.  Only groups are descended into: what is inside
+        anything else is passed over.
+        '''
+        stack = []      # A GroupState for each open element, or None if not descended into
+        with open(self.filename, 'rb') as f:
+            for event, node in iterateDocument(f):
+                if self.bStopped:
+                    break
+                if event == 'end':
+                    state = stack.pop()
+                    if (state is not None) and (state.layer is not None):
+                        self.plotCurrentLayer, self.sCurrentLayerName = state.layer
+                elif not stack:
+                    # The <svg> element; its own transform is not applied
+                    stack.append(GroupState(self.docTransform, 'visible'))
+                elif stack[-1] is None:
+                    stack.append(None)
+                else:
+                    stack.append(self.startElement(node, stack[-1]))
+
+    def startElement(self, node, parent):
+        '''
+        Plot an element just begun, from its attributes, or set up the
+        state of a group for its children.  Returns the GroupState for its
+        children, or None if they are not to be plotted.
+        '''
+        v = self.nodeVisibility(node, parent.visibility)
+        if v == "hidden" or v == "collapse":
+            return None
+
+        if node.tag in GROUP_TAGS:
+            matrix = self.nodeTransform(node, parent.matrix)
+            if not plot_layers.isLayer(node):
+                return GroupState(matrix, v)
+            state = GroupState(matrix, v, (self.plotCurrentLayer, self.sCurrentLayerName))
+            layer = plot_layers.Layer(node)
+            self.sCurrentLayerName = layer.name
+            self.DoWePlotLayer(layer)
+            if not self.options.boundingBox:
+                self.penUp()
+            return state
+
+        if node.tag in USE_TAGS:
+            if self.plotCurrentLayer and (not 'use' in self.warnings):
+                inkex.errormsg(gettext.gettext(
+                    'Warning: in layer "' + self.sCurrentLayerName + '" unable to draw clones ' +
+                    'when streaming the document; please unlink them first, ' +
+                    'using Edit > Clone > Unlink Clone.'))
+                self.warnings['use'] = 1
+            return None
+
+        if self.plotCurrentLayer:
+            handler = self.shapeHandlers.get(node.tag, self.warnUnhandled)
+            if handler is not None:
+                handler(node, parent.matrix, v)
+        return None
+
+    def nodeTransform(self, node, matCurrent):
+        '''
+        The transform to inches of a node's coordinates: matCurrent, that
+        of its parent group's, and then its own.
+        '''
+        trans = node.get('transform')
+        if not trans:
+            return matCurrent
+        return fourxidraw_compat.compatComposeTransform(
+            matCurrent, fourxidraw_compat.compatParseTransform(trans))
+
+
+def main(args=None):
+    e = StreamPlotter()
+    e.parseArguments(sys.argv[1:] if args is None else args)
+    return e.plot()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,212 @@
+# grbl_control.py
+# Part of the 4xiDraw driver for Inkscape
+#
+# Lets a human hold, resume, slow down, speed up, pause or abort a plot
+# while it is running.  Inkscape gives a running extension no way to take
+# input, so the requests come in from outside: over a local socket, for
+# which this file is also the client,
+#
+#     python grbl_control.py hold
+#     python grbl_control.py resume
+#     python grbl_control.py slower
+#
+# or as signals: SIGUSR1 pauses the plot and SIGUSR2 holds the machine.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import os
+import queue
+import signal
+import socket
+import sys
+import threading
+
+import grbl_motion
+import plot_utils
+
+SOCKET_NAME = 'control.sock'    # Unix domain socket, where available
+PORT_FILE_NAME = 'control.port'  # Otherwise, the localhost TCP port in use
+
+ACCEPT_TIMEOUT = 0.5            # Seconds between checks for shutdown
+
+COMMANDS = {
+    # Hold the machine where it is; the plot carries on after 'resume'
+    'hold': lambda motion: motion.feedHold(),
+    'resume': lambda motion: motion.cycleStart(),
+    # Stop the plot, keeping what is needed to resume it later
+    'pause': lambda motion: motion.requestPause(),
+    # Stop at once, without waiting for the machine to come to a halt
+    'abort': lambda motion: motion.abort(),
+    'faster': lambda motion: motion.feedOverride(grbl_motion.FEED_OVERRIDE_PLUS_10),
+    'slower': lambda motion: motion.feedOverride(grbl_motion.FEED_OVERRIDE_MINUS_10),
+    'faster1': lambda motion: motion.feedOverride(grbl_motion.FEED_OVERRIDE_PLUS_1),
+    'slower1': lambda motion: motion.feedOverride(grbl_motion.FEED_OVERRIDE_MINUS_1),
+    'normal': lambda motion: motion.feedOverride(grbl_motion.FEED_OVERRIDE_RESET),
+}
+
+SIGNALS = (('SIGUSR1', 'pause'), ('SIGUSR2', 'hold'))
+
+
+def socketPath():
+    return os.path.join(plot_utils.cacheDirectory(), SOCKET_NAME)
+
+
+def portFilePath():
+    return os.path.join(plot_utils.cacheDirectory(), PORT_FILE_NAME)
+
+
+class ControlChannel(object):
+    '''
+    Listens for control requests while a plot runs, and passes them on
+    to a GrblMotion as real-time commands.
+    '''
+
+    def __init__(self, motion):
+        self.motion = motion
+        self.server = None
+        self.thread = None
+        self.stopping = threading.Event()
+        self.oldHandlers = {}
+        self.signalled = queue.Queue()
+        self.signalThread = None
+
+    def handle(self, command):
+        action = COMMANDS.get(command.strip().lower())
+        if action is None:
+            return 'error: unknown command'
+        action(self.motion)
+        return 'ok'
+
+    def start(self):
+        self.installSignalHandlers()
+        try:
+            self.server = self.listen()
+        except (IOError, OSError, socket.error):
+            # Plotting goes on without the socket; signals still work
+            self.server = None
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.restoreSignalHandlers()
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+            try:
+                if hasattr(socket, 'AF_UNIX'):
+                    os.remove(socketPath())
+                else:
+                    os.remove(portFilePath())
+            except OSError:
+                pass
+
+    def listen(self):
+        if hasattr(socket, 'AF_UNIX'):
+            path = socketPath()
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server.bind(path)
+        else:
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.bind(('127.0.0.1', 0))
+            with open(portFilePath(), 'w') as f:
+                f.write(str(server.getsockname()[1]))
+        server.listen(1)
+        server.settimeout(ACCEPT_TIMEOUT)
+        return server
+
+    def serve(self):
+        while not self.stopping.is_set():
+            try:
+                connection, unused = self.server.accept()
+            except socket.timeout:
+                continue
+            except (socket.error, OSError):
+                break
+            try:
+                connection.settimeout(ACCEPT_TIMEOUT)
+                request = connection.recv(256).decode('ascii', 'replace')
+                connection.sendall((self.handle(request) + '\n').encode('ascii'))
+            except (socket.error, OSError):
+                pass
+            finally:
+                connection.close()
+
+    def installSignalHandlers(self):
+        # Signal handlers can only be set from the main thread
+        if threading.current_thread() is not threading.main_thread():
+            return
+        # The handlers run on the main thread, which may be waiting for GRBL
+        # to accept a line; the commands are sent from a thread of their own.
+        self.signalThread = threading.Thread(target=self.serveSignals)
+        self.signalThread.daemon = True
+        self.signalThread.start()
+        for name, command in SIGNALS:
+            if hasattr(signal, name):
+                signum = getattr(signal, name)
+                self.oldHandlers[signum] = signal.signal(
+                    signum, lambda signum, frame, command=command: self.signalled.put(command))
+
+    def restoreSignalHandlers(self):
+        for signum, handler in self.oldHandlers.items():
+            signal.signal(signum, handler)
+        self.oldHandlers = {}
+        if self.signalThread is not None:
+            self.signalled.put(None)
+            self.signalThread.join()
+            self.signalThread = None
+
+    def serveSignals(self):
+        for command in iter(self.signalled.get, None):
+            self.handle(command)
+
+
+def sendCommand(command):
+    '''Send a control request to a running plot, returning its reply.'''
+    if hasattr(socket, 'AF_UNIX'):
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        address = socketPath()
+    else:
+        with open(portFilePath()) as f:
+            address = ('127.0.0.1', int(f.read()))
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        client.settimeout(5.0)
+        client.connect(address)
+        client.sendall(command.encode('ascii'))
+        return client.recv(256).decode('ascii').strip()
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or sys.argv[1] not in COMMANDS:
+        sys.stderr.write('usage: grbl_control.py %s\n' % '|'.join(sorted(COMMANDS)))
+        sys.exit(2)
+    try:
+        print(sendCommand(sys.argv[1]))
+    except (IOError, OSError, socket.error):
+        sys.stderr.write('No plot is running.\n')
+        sys.exit(1)
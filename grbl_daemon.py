@@ -0,0 +1,341 @@
+# grbl_daemon.py
+# Part of the 4xiDraw driver for Inkscape
+#
+# Keeps the serial connection to GRBL open between runs of the extension.
+# Opening the port resets most Arduino boards, which takes time and throws
+# away GRBL's state, so every Apply in Inkscape used to start from a freshly
+# booted board.  Instead, this daemon owns the GrblSerial connection and the
+# extension talks to it over a Unix socket, through a DaemonClient that
+# stands in for GrblSerial.
+#
+#     python grbl_daemon.py [--log]     start the daemon
+#     python grbl_daemon.py --stop      stop it, releasing the port
+#
+# The daemon also stops by itself after IDLE_TIMEOUT seconds without a
+# client.  Unix domain sockets are needed; elsewhere the extension simply
+# opens the port itself.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import grbl_serial
+import plot_utils
+
+SOCKET_NAME = 'daemon.sock'
+LOG_NAME = 'daemon.log'
+
+IDLE_TIMEOUT = 30 * 60      # Seconds without a client before the daemon exits
+ACCEPT_TIMEOUT = 1.0        # Seconds between idle checks
+START_TIMEOUT = 10.0        # Longest wait for a new daemon to find GRBL
+
+# GrblSerial methods and attributes a client may use
+METHODS = ('command', 'query', 'realtime', 'interrupt', 'isHeld',
+           'pollStatus', 'startStatusPolling', 'stopStatusPolling',
+           'clearTracking', 'executedMove', 'reset', 'waitForHold')
+ATTRIBUTES = ('status', 'feedOverride')
+
+
+def socketPath():
+    return os.path.join(plot_utils.cacheDirectory(), SOCKET_NAME)
+
+
+def isSupported():
+    return hasattr(socket, 'AF_UNIX')
+
+
+class GrblDaemon(object):
+    '''Serves one GrblSerial connection to any number of local clients.'''
+
+    def __init__(self, serialPort):
+        self.serialPort = serialPort
+        self.server = None
+        self.clients = 0
+        self.lastActivity = time.time()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.local = threading.local()
+
+    def errormsg(self, msg):
+        # Messages are passed back to the client that caused them
+        messages = getattr(self.local, 'messages', None)
+        if messages is None:
+            sys.stderr.write(msg + '\n')
+        else:
+            messages.append(msg)
+
+    def handle(self, request):
+        self.local.messages = []
+        reply = {}
+        try:
+            if 'call' in request and request['call'] in METHODS:
+                args = request.get('args', [])
+                if request['call'] == 'realtime':
+                    args = [args[0].encode('latin-1')]
+                reply['result'] = getattr(self.serialPort, request['call'])(*args)
+            elif 'get' in request and request['get'] in ATTRIBUTES:
+                reply['result'] = getattr(self.serialPort, request['get'])
+            elif request.get('call') == 'shutdown':
+                self.stopping.set()
+                reply['result'] = None
+            else:
+                reply['error'] = 'unknown request'
+        except SystemExit:
+            # GrblSerial gives up on the plot by exiting; the client does so
+            reply['exit'] = True
+        reply['messages'] = self.local.messages
+        self.local.messages = None
+        return reply
+
+    def serveClient(self, connection):
+        with self.lock:
+            self.clients += 1
+            if self.clients == 1:
+                # A new session: a stop, or the moves, left by a client that
+                # went away must not carry over into it
+                self.serialPort.interrupted.clear()
+                self.serialPort.clearTracking()
+        try:
+            stream = connection.makefile('rwb')
+            for line in stream:
+                reply = self.handle(json.loads(line.decode('utf-8')))
+                stream.write((json.dumps(reply) + '\n').encode('utf-8'))
+                stream.flush()
+                self.lastActivity = time.time()
+        except (socket.error, OSError, ValueError):
+            pass
+        finally:
+            connection.close()
+            with self.lock:
+                self.clients -= 1
+                self.lastActivity = time.time()
+
+    def run(self):
+        grbl_serial.errormsg = self.errormsg
+        path = socketPath()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen(4)
+        self.server.settimeout(ACCEPT_TIMEOUT)
+        try:
+            while not self.stopping.is_set():
+                try:
+                    connection, unused = self.server.accept()
+                except socket.timeout:
+                    with self.lock:
+                        idle = (self.clients == 0) and \
+                            (time.time() - self.lastActivity > IDLE_TIMEOUT)
+                    if idle:
+                        break
+                    continue
+                connection.settimeout(None)
+                thread = threading.Thread(target=self.serveClient, args=(connection,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            self.server.close()
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.serialPort.close()
+
+
+class DaemonClient(object):
+    '''
+    Stands in for GrblSerial, passing each call on to the daemon.  Each
+    thread gets its own connection, and real-time commands one more, so
+    that they reach GRBL while a thread waits for it to accept a line.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.port = path    # Only ever tested against None
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+        self.realtimeStream = None
+        self.realtimeLock = threading.Lock()
+
+    def openStream(self):
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(self.path)
+        stream = client.makefile('rwb')
+        client.close()  # The stream keeps the socket open
+        with self.lock:
+            self.connections.append(stream)
+        return stream
+
+    def connection(self):
+        stream = getattr(self.local, 'stream', None)
+        if stream is None:
+            stream = self.local.stream = self.openStream()
+        return stream
+
+    def request(self, request):
+        return self.exchange(self.connection(), request)
+
+    def realtimeRequest(self, request):
+        with self.realtimeLock:
+            if self.realtimeStream is None:
+                self.realtimeStream = self.openStream()
+            return self.exchange(self.realtimeStream, request)
+
+    def exchange(self, stream, request):
+        stream.write((json.dumps(request) + '\n').encode('utf-8'))
+        stream.flush()
+        line = stream.readline()
+        if not line:
+            grbl_serial.errormsg('Lost the connection to the 4xiDraw daemon.')
+            sys.exit()
+        reply = json.loads(line.decode('utf-8'))
+        for message in reply.get('messages', []):
+            grbl_serial.errormsg(message)
+        if reply.get('exit'):
+            sys.exit()
+        return reply.get('result')
+
+    def call(self, name, *args):
+        return self.request({'call': name, 'args': list(args)})
+
+    def command(self, cmd, tag=None, target=None):
+        return self.call('command', cmd, tag, target)
+
+    def query(self, cmd):
+        return self.call('query', cmd)
+
+    def realtime(self, code):
+        return self.realtimeRequest({'call': 'realtime', 'args': [code.decode('latin-1')]})
+
+    def interrupt(self):
+        return self.realtimeRequest({'call': 'interrupt', 'args': []})
+
+    def isHeld(self):
+        return self.call('isHeld')
+
+    def pollStatus(self):
+        return self.call('pollStatus')
+
+    def startStatusPolling(self):
+        return self.call('startStatusPolling')
+
+    def stopStatusPolling(self):
+        return self.call('stopStatusPolling')
+
+    def clearTracking(self):
+        return self.call('clearTracking')
+
+    def executedMove(self):
+        return self.call('executedMove')
+
+    def reset(self):
+        return self.call('reset')
+
+    def waitForHold(self, timeout=10.0):
+        return self.call('waitForHold', timeout)
+
+    @property
+    def status(self):
+        return self.request({'get': 'status'})
+
+    @property
+    def feedOverride(self):
+        return self.request({'get': 'feedOverride'})
+
+    def close(self):
+        # Leaves the port open, which is the point of the daemon
+        with self.lock:
+            for stream in self.connections:
+                try:
+                    stream.close()
+                except (socket.error, OSError):
+                    pass
+            self.connections = []
+        self.local = threading.local()
+        with self.realtimeLock:
+            self.realtimeStream = None
+
+
+def connect():
+    '''Return a DaemonClient for a running daemon, or None.'''
+    if not isSupported():
+        return None
+    path = socketPath()
+    if not os.path.exists(path):
+        return None
+    client = DaemonClient(path)
+    try:
+        client.connection()
+    except (socket.error, OSError):
+        return None
+    return client
+
+
+def ensureDaemon(doLog):
+    '''Start the daemon, unless it is already running, and wait for it.'''
+    if not isSupported():
+        return False
+    client = connect()
+    if client is not None:
+        client.close()
+        return True
+    args = [sys.executable, os.path.abspath(__file__)]
+    if doLog:
+        args.append('--log')
+    with open(os.path.join(plot_utils.cacheDirectory(), LOG_NAME), 'ab') as log:
+        process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+                                   close_fds=True, start_new_session=True,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+    deadline = time.time() + START_TIMEOUT
+    while time.time() < deadline:
+        time.sleep(0.1)
+        if process.poll() is not None:
+            return False    # No GRBL found, or it is already taken
+        client = connect()
+        if client is not None:
+            client.close()
+            return True
+    return False
+
+
+if __name__ == '__main__':
+    if '--stop' in sys.argv[1:]:
+        client = connect()
+        if client is not None:
+            client.call('shutdown')
+            client.close()
+        sys.exit(0)
+
+    if not isSupported():
+        sys.stderr.write('The 4xiDraw daemon needs Unix domain sockets.\n')
+        sys.exit(1)
+    if connect() is not None:
+        sys.stderr.write('The 4xiDraw daemon is already running.\n')
+        sys.exit(0)
+    serialPort = grbl_serial.openPort('--log' in sys.argv[1:], False)
+    if serialPort is None:
+        sys.stderr.write('Failed to connect to GRBL.\n')
+        sys.exit(1)
+    GrblDaemon(serialPort).run()
@@ -0,0 +1,252 @@
+# grbl_fleet.py
+# Part of the 4xiDraw driver for Inkscape
+#
+# Runs a queue of plots on several 4xiDraw machines at once.  Every GRBL
+# board that can be found is opened and asked for its identity ($I), and
+# each machine then takes the next job from the queue as soon as it is
+# idle, streaming it from its own thread.  A job is a plot journal, the
+# compiled form of a plot (see plot_journal.py), written with
+#
+#     python fourxidraw_stream.py --journalFile=drawing.journal drawing.svg
+#     python grbl_fleet.py [--port PORT ...] JOURNAL ...
+#
+# A journal of several layers, compiled with --batchLayers, pauses the
+# machine at each pen change; press its cycle start (resume) button to
+# carry on.  A job fails if its machine stops answering, or does not come
+# to rest within IDLE_TIMEOUT of the last move, and the machine is then
+# given no more jobs.
+#
+# Without --port, every port findPorts() turns up is tried.  Naming the
+# ports also allows the scheduler to be run against simulated boards on
+# pseudo-terminals.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import argparse
+import math
+import os
+import sys
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import fourxidraw_conf
+import grbl_serial
+import plot_journal
+from grbl_motion import GrblMotion
+
+IDLE_TIMEOUT = 600.0    # Longest wait (seconds) for a machine to finish a job
+
+
+class Job(object):
+    '''A plot journal waiting to be plotted, and what became of it.'''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.name = os.path.basename(filename)
+        self.machine = None
+        self.started = None
+        self.finished = None
+        self.moves = 0
+        self.distance = 0.0     # inches
+        self.error = None
+
+
+class Machine(object):
+    '''One GRBL board, and the jobs it has plotted.'''
+
+    def __init__(self, comPort, serialPort, identity):
+        self.comPort = comPort
+        self.serialPort = serialPort
+        self.identity = identity
+        self.motion = GrblMotion(serialPort, fourxidraw_conf.DPI_16X,
+                                 fourxidraw_conf.PenUpPos, fourxidraw_conf.PenDownPos)
+        self.jobs = []
+        self.busy = 0.0     # seconds spent plotting
+
+    def plot(self, job):
+        '''Stream a job to the machine and wait until it has been drawn.'''
+        job.machine = self
+        job.started = time.time()
+        penUpSpeed = fourxidraw_conf.PenUpSpeed if fourxidraw_conf.applySpeed else None
+        penDownSpeed = fourxidraw_conf.PenDownSpeed if fourxidraw_conf.applySpeed else None
+        journal = None
+        try:
+            journal = plot_journal.JournalReader(job.filename)
+            # Status reports show GRBL held, rather than silent, at a pen change
+            self.serialPort.startStatusPolling()
+            x = fourxidraw_conf.StartPosX
+            y = fourxidraw_conf.StartPosY
+            for index, op, flags, count, fX, fY in journal.records():
+                if op == plot_journal.MOVE:
+                    self.motion.doAbsoluteMove(fX, fY)
+                    job.moves += 1
+                    job.distance += math.hypot(fX - x, fY - y)
+                    x = fX
+                    y = fY
+                elif op == plot_journal.PEN_UP:
+                    self.motion.sendPenUp(count, penUpSpeed)
+                elif op == plot_journal.PEN_DOWN:
+                    self.motion.sendPenDown(count, penDownSpeed)
+                elif op == plot_journal.PEN_CHANGE:
+                    sys.stderr.write('%s: put in the pen for layer %d, then press resume.\n'
+                                     % (self.comPort, count))
+                    self.motion.pauseForPenChange(count)
+            # Return home, as the extension does at the end of a plot
+            self.motion.sendPenUp(fourxidraw_conf.penLiftDelay, penUpSpeed)
+            self.motion.doAbsoluteMove(fourxidraw_conf.StartPosX, fourxidraw_conf.StartPosY)
+            if not self.waitUntilIdle():
+                job.error = 'still not idle %d s after the last move' % IDLE_TIMEOUT
+        except (IOError, OSError, plot_journal.JournalError) as e:
+            job.error = str(e)
+        finally:
+            self.serialPort.stopStatusPolling()
+            if journal is not None:
+                journal.close()
+            job.finished = time.time()
+            self.busy += job.finished - job.started
+            self.jobs.append(job)
+
+    def waitUntilIdle(self):
+        # GRBL accepts moves well before it carries them out
+        deadline = time.time() + IDLE_TIMEOUT
+        while time.time() < deadline:
+            status = self.serialPort.pollStatus()
+            if status and status.get('state') == 'Idle':
+                return True
+            time.sleep(grbl_serial.STATUS_INTERVAL)
+        return False
+
+    def close(self):
+        self.serialPort.close()
+
+
+def discover(comPorts=None, doLog=False):
+    '''
+    Open every GRBL board among comPorts (by default, every port that
+    could have one) and return a Machine for each.
+    '''
+    if comPorts is None:
+        comPorts = grbl_serial.findPorts()
+    machines = []
+    for comPort in comPorts:
+        port = grbl_serial.testPort(comPort)
+        if port is None:
+            continue
+        serialPort = grbl_serial.GrblSerial(port, doLog)
+        serialPort.command('G90\r')
+        identity = serialPort.query('$I\r').replace('\r', ' ').strip()
+        machines.append(Machine(comPort, serialPort, identity))
+    return machines
+
+
+class Fleet(object):
+    '''
+    Plots a queue of jobs on a set of machines.  Each machine has a thread
+    of its own, which takes the next job whenever the machine is idle.
+    '''
+
+    def __init__(self, machines):
+        self.machines = machines
+        self.jobs = queue.Queue()
+        self.submitted = []
+
+    def submit(self, filename):
+        job = Job(filename)
+        self.submitted.append(job)
+        self.jobs.put(job)
+        return job
+
+    def worker(self, machine):
+        while True:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                machine.plot(job)
+            except SystemExit:
+                # GrblSerial gives up on a machine that stops answering
+                job.error = 'lost contact with the machine'
+                return
+
+    def run(self):
+        '''Plot every job submitted, returning once all are done.'''
+        started = time.time()
+        threads = []
+        for machine in self.machines:
+            thread = threading.Thread(target=self.worker, args=(machine,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        # Jobs still queued once every machine has dropped out
+        while True:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            job.error = 'no machine was left to plot it'
+        return time.time() - started
+
+    def report(self, elapsed):
+        '''Return a per-machine throughput report, as lines of text.'''
+        lines = []
+        for machine in self.machines:
+            jobs = [job for job in machine.jobs if job.error is None]
+            moves = sum(job.moves for job in jobs)
+            distance = sum(job.distance for job in jobs) * 25.4
+            rate = (moves / machine.busy) if machine.busy > 0 else 0.0
+            lines.append('%s (%s): %d jobs, %d moves, %.0f mm in %.1f s, %.1f moves/s, %.0f%% busy'
+                         % (machine.comPort, machine.identity or 'unknown', len(jobs), moves,
+                            distance, machine.busy, rate,
+                            100.0 * machine.busy / elapsed if elapsed > 0 else 0.0))
+        for job in self.submitted:
+            if (job.error is not None) and (job.machine is not None):
+                lines.append('%s failed on %s: %s' % (job.name, job.machine.comPort, job.error))
+            elif job.error is not None:
+                lines.append('%s failed: %s' % (job.name, job.error))
+        lines.append('%d jobs on %d machines in %.1f s'
+                     % (len(self.submitted), len(self.machines), elapsed))
+        return lines
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Plot journals on every 4xiDraw found.')
+    parser.add_argument('--port', action='append', dest='ports',
+                        help='serial port of a machine (may be repeated)')
+    parser.add_argument('--log', action='store_true', help='log serial communication')
+    parser.add_argument('journals', nargs='+', help='plot journals to plot')
+    args = parser.parse_args()
+
+    machines = discover(args.ports, args.log)
+    if not machines:
+        sys.stderr.write('No GRBL boards found.\n')
+        sys.exit(1)
+    fleet = Fleet(machines)
+    for filename in args.journals:
+        fleet.submit(filename)
+    try:
+        elapsed = fleet.run()
+    finally:
+        for machine in machines:
+            machine.close()
+    for line in fleet.report(elapsed):
+        print(line)
@@ -0,0 +1,88 @@
+# grbl_manual.py
+# Part of the 4xiDraw driver for Inkscape
+#
+# The quick commands of the extension's Setup and Manual tabs, from the
+# command line:
+#
+#     python grbl_manual.py raise-pen
+#     python grbl_manual.py lower-pen
+#     python grbl_manual.py toggle-pen
+#     python grbl_manual.py version-check
+#
+# The extension has to load inkex and parse the whole document before it
+# can act on any of these; this loads only the serial code, so it answers
+# in a fraction of the time.  The pen positions and timings are those set
+# in fourxidraw_conf.py.  A running grbl_daemon is used if there is one.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import argparse
+import sys
+import time
+
+import fourxidraw_conf
+import grbl_serial
+from grbl_motion import GrblMotion
+
+
+def penDelay(rate, delay):
+    '''The time (ms) the pen takes to move, as the extension works it out.'''
+    distance = abs(fourxidraw_conf.PenUpPos - fourxidraw_conf.PenDownPos)
+    return max(0, int(1000.0 * distance / rate) + delay)
+
+
+def raisePen(motion):
+    speed = fourxidraw_conf.PenUpSpeed if fourxidraw_conf.applySpeed else None
+    motion.sendPenUp(penDelay(fourxidraw_conf.penLiftRate, fourxidraw_conf.penLiftDelay), speed)
+
+
+def lowerPen(motion):
+    speed = fourxidraw_conf.PenDownSpeed if fourxidraw_conf.applySpeed else None
+    motion.sendPenDown(penDelay(fourxidraw_conf.penLowerRate, fourxidraw_conf.penLowerDelay), speed)
+
+
+def togglePen(motion):
+    raisePen(motion)
+    time.sleep(1)
+    lowerPen(motion)
+
+
+def versionCheck(motion):
+    print('GRBL replied: ' + motion.port.query('$I\r').replace('\r', '\n'))
+
+
+COMMANDS = {
+    'raise-pen': raisePen,
+    'lower-pen': lowerPen,
+    'toggle-pen': togglePen,
+    'version-check': versionCheck,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Move the pen or query GRBL, without Inkscape.')
+    parser.add_argument('command', choices=sorted(COMMANDS))
+    parser.add_argument('--log', action='store_true', help='log serial communication')
+    args = parser.parse_args()
+
+    serialPort = grbl_serial.openPort(args.log or fourxidraw_conf.logSerial)
+    if serialPort is None:
+        sys.stderr.write('Failed to connect to GRBL.\n')
+        sys.exit(1)
+    try:
+        COMMANDS[args.command](GrblMotion(serialPort, fourxidraw_conf.DPI_16X,
+                                          fourxidraw_conf.PenUpPos, fourxidraw_conf.PenDownPos))
+    finally:
+        serialPort.close()
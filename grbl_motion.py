@@ -23,16 +23,100 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+# GRBL real-time commands.  These bypass the line queue and act at once.
+FEED_HOLD = b'!'
+CYCLE_START = b'~'
+SOFT_RESET = b'\x18'
+
+# GRBL 1.1 feed overrides
+FEED_OVERRIDE_RESET = b'\x90'      # Back to 100% of the programmed rate
+FEED_OVERRIDE_PLUS_10 = b'\x91'
+FEED_OVERRIDE_MINUS_10 = b'\x92'
+FEED_OVERRIDE_PLUS_1 = b'\x93'
+FEED_OVERRIDE_MINUS_1 = b'\x94'
+
+FEED_OVERRIDES = {FEED_OVERRIDE_RESET: None, FEED_OVERRIDE_PLUS_10: 10,
+                  FEED_OVERRIDE_MINUS_10: -10, FEED_OVERRIDE_PLUS_1: 1,
+                  FEED_OVERRIDE_MINUS_1: -1}
+
+FEED_OVERRIDE_MIN = 10      # GRBL's limits on the feed override, in percent
+FEED_OVERRIDE_MAX = 200
+
+DEFAULT_FEED_RATE = 10000   # mm/min, when no pen speed has been applied
+
+
 class GrblMotion(object):
     def __init__(self, port, stepsPerInch, penUpPosition, penDownPosition):
         self.port = port
         self.stepsPerInch = stepsPerInch
         self.penUpPosition = penUpPosition
         self.penDownPosition = penDownPosition
+        self.pauseRequested = False
+        self.feedOverridePercent = 100
+        self.feedRate = DEFAULT_FEED_RATE
 
     def IsPausePressed(self):
+        return self.pauseRequested
+
+    def feedHold(self):
+        if (self.port is not None):
+            self.port.realtime(FEED_HOLD)
+
+    def cycleStart(self):
         if (self.port is not None):
-            return False  # TODO
+            self.port.realtime(CYCLE_START)
+
+    def softReset(self):
+        if (self.port is not None):
+            self.port.realtime(SOFT_RESET)
+
+    def feedOverride(self, code):
+        if code not in FEED_OVERRIDES:
+            raise ValueError('not a feed override: %r' % code)
+        if (self.port is not None):
+            self.port.realtime(code)
+        step = FEED_OVERRIDES[code]
+        if step is None:
+            self.feedOverridePercent = 100
+        else:
+            self.feedOverridePercent = min(FEED_OVERRIDE_MAX, max(
+                FEED_OVERRIDE_MIN, self.feedOverridePercent + step))
+
+    def setFeedOverride(self, percent):
+        '''Set the feed override to percent, in the fewest real-time commands.'''
+        percent = min(FEED_OVERRIDE_MAX, max(FEED_OVERRIDE_MIN, int(percent)))
+        self.feedOverride(FEED_OVERRIDE_RESET)
+        tens, ones = divmod(abs(percent - 100), 10)
+        if percent > 100:
+            codes = [FEED_OVERRIDE_PLUS_10] * tens + [FEED_OVERRIDE_PLUS_1] * ones
+        else:
+            codes = [FEED_OVERRIDE_MINUS_10] * tens + [FEED_OVERRIDE_MINUS_1] * ones
+        for code in codes:
+            self.feedOverride(code)
+
+    def currentFeedOverride(self):
+        # GRBL's own figure, when it has reported one, allows for overrides
+        # made with the buttons on the machine
+        if (self.port is not None) and (getattr(self.port, 'feedOverride', None) is not None):
+            return self.port.feedOverride
+        return self.feedOverridePercent
+
+    def requestPause(self):
+        '''
+        Hold the machine where it is and have the plot stop, so that it
+        can be resumed later.  May be called from another thread.
+        '''
+        self.pauseRequested = True
+        self.feedHold()
+        if (self.port is not None):
+            self.port.interrupt()
+
+    def abort(self):
+        '''Stop the machine at once with a soft reset, and stop the plot.'''
+        self.pauseRequested = True
+        self.softReset()
+        if (self.port is not None):
+            self.port.interrupt()
 
     def sendPenUp(self, PenDelay, fSpeed):
         if (self.port is not None):
@@ -45,6 +129,7 @@ class GrblMotion(object):
                 self.port.command(strOutput)
                 strOutput = '$111=' + str(fSpeed) + '\r'
                 self.port.command(strOutput)
+                self.feedRate = fSpeed
             strOutput = 'G4 P' + str(PenDelay/1000.0) + '\r'
             self.port.command(strOutput)
 
@@ -57,14 +142,27 @@ class GrblMotion(object):
                 self.port.command(strOutput)
                 strOutput = '$111=' + str(fSpeed)+'\r'
                 self.port.command(strOutput)
+                self.feedRate = fSpeed
             strOutput = 'M3 S' + str(self.penDownPosition) + '\r'
             self.port.command(strOutput)
             strOutput = 'G4 P' + str(PenDelay/1000.0) + '\r'
             self.port.command(strOutput)
 
-    def doAbsoluteMove(self, x, y):
+    def pauseForPenChange(self, layerNumber):
+        # A program pause: GRBL finishes the moves before it, then holds
+        # until a cycle start, and only then answers 'ok'
+        if (self.port is not None):
+            self.port.command('M0\r')
+
+    def doAbsoluteMove(self, x, y, tag=None):
+        # A tagged move is tracked until GRBL reports it executed
         if (self.port is not None):
-            strOutput = ('G1 F10000 X{:.12f}'.format(25.4*x)) + \
+            # The feed override scales the programmed rate, and GRBL caps the
+            # result at $110/$111; so program the pen speed itself, if set.
+            strOutput = ('G1 F{:d} X{:.12f}'.format(self.feedRate, 25.4*x)) + \
                 (' Y{:.12f}'.format(25.4*y)) + '\r'
-            self.port.command(strOutput)
+            if tag is None:
+                self.port.command(strOutput)
+            else:
+                self.port.command(strOutput, tag, (25.4*x, 25.4*y))
 
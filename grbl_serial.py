@@ -1,38 +1,117 @@
 # grbl_serial.py
 # Serial connection utilities for RAMPS
 
+import os
 import serial
 import time
 import sys
 import string
-import inkex
 import gettext
 import datetime
+import re
+import threading
+from collections import deque
 
 import fourxidraw_compat  # To bridge Python 2/3, Inkscape 0.*/1.*
+import plot_utils
 
 
-def findPort():
-    # Find a GRBL board connected to a USB port.
+# Name of the file, in plot_utils.cacheDirectory(), naming the last port
+# on which GRBL was found
+PORT_CACHE_FILE = 'last_port'
+
+PROBE_TIMEOUT = 3.0     # Longest wait (s) for GRBL to show itself on a port
+RESET_TIMEOUT = 1.5     # Longest wait (s) for the banner after a soft reset
+PROBE_INTERVAL = 0.25   # Status requests are repeated this often meanwhile
+POLL_TIMEOUT = 0.02     # Serial read timeout (s) while probing
+READ_TIMEOUT = 1.0      # Serial read timeout (s) once connected
+
+
+def errormsg(msg):
+    # inkex is only loaded once there is something to report, so that the
+    # command-line tools using this module start without it
+    import inkex
+    inkex.errormsg(msg)
+
+
+def findPorts():
+    # Find all USB ports that could have a GRBL board connected.
     try:
         from serial.tools.list_ports import comports
     except ImportError:
-        comports = None
-        return None
-    if comports:
-        comPortsList = list(comports())
-        for port in comPortsList:
-            desc = port[1].lower()
-            isUsbSerial = "usb" in desc and "serial" in desc
-            isArduino = "arduino" in desc or "acm" in desc
-            # I used NetBurner from eltima software to create the virtual com port
-            isWifi = "eltima" in desc
-            isCDC = "CDC" in desc
-            if isUsbSerial or isArduino or isCDC or isWifi:
-                return port[0]
+        return []
+    ports = []
+    for port in comports():
+        desc = port[1].lower()
+        isUsbSerial = "usb" in desc and "serial" in desc
+        isArduino = "arduino" in desc or "acm" in desc
+        # I used NetBurner from eltima software to create the virtual com port
+        isWifi = "eltima" in desc
+        isCDC = "CDC" in desc
+        if isUsbSerial or isArduino or isCDC or isWifi:
+            ports.append(port[0])
+    return ports
+
+
+def findPort():
+    # Find a GRBL board connected to a USB port.
+    ports = findPorts()
+    if ports:
+        return ports[0]
     return None
 
 
+def portCachePath():
+    return os.path.join(plot_utils.cacheDirectory(), PORT_CACHE_FILE)
+
+
+def cachedPort():
+    try:
+        with open(portCachePath()) as f:
+            return f.read().strip() or None
+    except (IOError, OSError):
+        return None
+
+
+def savePort(comPort):
+    try:
+        if cachedPort() != comPort:
+            with open(portCachePath(), 'w') as f:
+                f.write(comPort)
+    except (IOError, OSError):
+        pass
+
+
+def awaitGrbl(serialPort, timeout, probe):
+    '''
+    Wait up to timeout seconds for GRBL to show itself, by its start-up
+    banner or, if probe is set, by answering a status request.  Returns
+    as soon as either arrives.
+    '''
+    deadline = time.time() + timeout
+    nextProbe = 0
+    data = b''
+    while time.time() < deadline:
+        if probe and time.time() >= nextProbe:
+            # Harmless if GRBL is still starting up: it is simply lost
+            serialPort.write(b'?')
+            nextProbe = time.time() + PROBE_INTERVAL
+        try:
+            waiting = serialPort.in_waiting
+        except AttributeError:
+            waiting = serialPort.inWaiting()    # Pyserial 2.7
+        data += serialPort.read(max(1, waiting))
+        lines = data.split(b'\n')
+        data = lines.pop()
+        for line in lines:
+            line = line.strip()
+            if line.startswith(b'Grbl'):
+                return True
+            if probe and line.startswith(b'<') and line.endswith(b'>'):
+                return True
+    return False
+
+
 def testPort(comPort):
     '''
     Return a SerialPort object for the first port with a GRBL board.
@@ -42,47 +121,25 @@ def testPort(comPort):
         try:
             serialPort = serial.Serial()
             serialPort.baudrate = 115200
-            serialPort.timeout = 1.0
+            serialPort.timeout = POLL_TIMEOUT
             serialPort.rts = False
             serialPort.dtr = True
             serialPort.port = comPort
             serialPort.open()
-            time.sleep(2)
-
-            # Opening the serial port may reset the unit, in which case we'll get a Grbl message
-            #
-            # In my (Python3) setup, opening the port resets GRBL on the Arduino: I get a blank line, then a Grbl version
-            # line. If we don't pick this info up here and exit, then sending '\x18' causes a *second* reset - we end up
-            # having *two* Grbl version messages sent back! The second Grbl message appears as a response to the first
-            # command we sent, which causes an error "Error: Unexpected response from GRBL."
-            #
-            # I'm making this conditional on Python3 because for all I know earlier versions act differently here. But it's
-            # possible that this behaviuor may occur with others. If we make the code unconditional we potentially incur
-            # 2 comms timeouts at 1 second each.
-            if fourxidraw_compat.isPython3():
-                nTryCount = 0
-                returnedMessage = ''
-                while (len(returnedMessage) == 0) and (nTryCount < 2):
-                    returnedMessage = serialPort.readline().decode().rstrip()
-                    nTryCount += 1
-                if len(returnedMessage) != 0:
-                    if returnedMessage.startswith('Grbl'):
-                        return serialPort
-
-            # If opening the port hasn't caused a reset, send an explicit reset message
-            if fourxidraw_compat.isPython3():
+
+            # Opening the port resets most Arduino boards, and GRBL then sends
+            # its banner once the bootloader is done.  Other boards carry on
+            # as they were, and answer a status request straight away.  So
+            # ask for status until either shows up, rather than sleeping for
+            # as long as the slowest bootloader could take.
+            found = awaitGrbl(serialPort, PROBE_TIMEOUT, True)
+            if not found:
+                # Nothing yet; an explicit reset makes GRBL announce itself
                 serialPort.write(b'\x18')
-            else:
-                serialPort.write('\x18')
-            time.sleep(1)
-
-            while True:
-                strVersion = serialPort.readline()
-                if len(strVersion) == 0:
-                    break
-                grblTarget = b'Grbl' if fourxidraw_compat.isPython3() else 'Grbl'
-                if strVersion and strVersion.startswith(grblTarget):
-                    return serialPort
+                found = awaitGrbl(serialPort, RESET_TIMEOUT, False)
+            if found:
+                serialPort.timeout = READ_TIMEOUT
+                return serialPort
             serialPort.close()
         except serial.SerialException:
             pass
@@ -93,10 +150,27 @@ def testPort(comPort):
 # Return a GrblSerial object
 
 
-def openPort(doLog):
-    foundPort = findPort()
-    serialPort = testPort(foundPort)
+def openPort(doLog, useDaemon=True):
+    # A running grbl_daemon already holds the port open, without a reset
+    if useDaemon:
+        import grbl_daemon
+        g = grbl_daemon.connect()
+        if g is not None:
+            return g
+    # Try the port GRBL was found on last time before looking any further
+    serialPort = None
+    lastPort = comPort = cachedPort()
+    if comPort is not None:
+        serialPort = testPort(comPort)
+    if serialPort is None:
+        for comPort in findPorts():
+            if comPort == lastPort:
+                continue    # Already tried, and it did not answer
+            serialPort = testPort(comPort)
+            if serialPort:
+                break
     if serialPort:
+        savePort(comPort)
         g = GrblSerial(serialPort, doLog)
         # Set absolute mode
         g.command('G90\r')
@@ -104,6 +178,63 @@ def openPort(doLog):
     return None
 
 
+# Status reports are requested this often (seconds) while a plot streams
+STATUS_INTERVAL = 0.2
+
+# Planner blocks on an ATmega328p; raised if GRBL reports more free blocks
+PLANNER_BLOCKS = 15
+
+# How close (mm) a reported position must be to a move to count as on it
+POSITION_TOLERANCE = 0.01
+
+positionPattern = re.compile(r'(MPos|WPos|WCO):(-?[0-9.]+),(-?[0-9.]+)')
+bufferPattern = re.compile(r'Bf:([0-9]+),([0-9]+)')
+overridePattern = re.compile(r'Ov:([0-9]+),([0-9]+),([0-9]+)')
+
+
+def isStatusReport(line):
+    return line.startswith('<') and line.endswith('>')
+
+
+def parseStatus(line):
+    '''
+    Parse a GRBL status report into a dictionary.  Handles both the 0.9
+    format, <Run,MPos:1.000,2.000,0.000,WPos:...>, and the 1.1 format,
+    <Run|MPos:1.000,2.000,0.000|Bf:15,128|WCO:...>.  Only the X and Y
+    coordinates of positions are kept.  Ov, the feed, rapid and spindle
+    overrides in percent, is only reported by 1.1 now and then.
+    '''
+    body = line[1:-1]
+    state = re.split('[|,]', body, 1)[0].split(':')
+    status = {'state': state[0], 'v11': '|' in body}
+    if len(state) > 1:
+        status['substate'] = state[1]
+    for name, x, y in positionPattern.findall(body):
+        status[name] = (float(x), float(y))
+    match = bufferPattern.search(body)
+    if match:
+        status['Bf'] = (int(match.group(1)), int(match.group(2)))
+    match = overridePattern.search(body)
+    if match:
+        status['Ov'] = tuple(int(group) for group in match.groups())
+    return status
+
+
+def onSegment(p, a, b):
+    '''True if point p lies on the segment from a to b, within tolerance.'''
+    dx = b[0] - a[0]
+    dy = b[1] - a[1]
+    length2 = dx * dx + dy * dy
+    if length2 == 0:
+        t = 0.0
+    else:
+        t = ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / length2
+        t = min(1.0, max(0.0, t))
+    ex = a[0] + t * dx - p[0]
+    ey = a[1] + t * dy - p[1]
+    return ex * ex + ey * ey <= POSITION_TOLERANCE * POSITION_TOLERANCE
+
+
 def escaped(s):
     r = ''
     for c in s:
@@ -118,13 +249,31 @@ class GrblSerial(object):
     def __init__(self, port, doLog):
         self.port = port
         self.doLog = doLog
+        # Re-entrant, as real-time commands may be sent from a signal handler
+        self.writeLock = threading.RLock()
+        # Set to abandon the line in flight, e.g. while a plot is stopping
+        self.interrupted = threading.Event()
+
+        # Acknowledged-position tracking.  Moves sent with a tag are
+        # remembered, in order, until a status report shows that GRBL
+        # has executed them (and not merely queued them).
+        self.acks = 0               # Number of tagged moves acknowledged
+        self.pending = deque()      # (ack number, tag, target) not yet executed
+        self.executed = None        # (tag, target) of the last executed move
+        self.lastTarget = None      # target of the last executed move
+        self.status = None          # Latest status report
+        self.statusAcks = 0         # self.acks when that report was read
+        self.plannerBlocks = PLANNER_BLOCKS
+        self.feedOverride = None    # Last feed override GRBL reported (%)
+        self.poller = None
+        self.polling = threading.Event()
 
     def gcodeLog(self, data):
         try:
             with open("4xidraw-gcode.gcode", "a") as myfile:
                 myfile.write(data)
         except:
-            inkex.errormsg(gettext.gettext("Error logging serial data."))
+            errormsg(gettext.gettext("Error logging serial data."))
 
     def log(self, type, text):
         ts = datetime.datetime.now()
@@ -133,7 +282,7 @@ class GrblSerial(object):
                 myfile.write('--- %s\n%s\n%s\n' %
                              (ts.isoformat(), type, escaped(text)))
         except:
-            inkex.errormsg(gettext.gettext("Error logging serial data."))
+            errormsg(gettext.gettext("Error logging serial data."))
 
     def close(self):
         if self.port is not None:
@@ -145,16 +294,187 @@ class GrblSerial(object):
     def write(self, data):
         if self.doLog:
             self.log('SEND', data) 
-        if fourxidraw_compat.isPython3():
-            self.port.write(data.encode())
-        else:
-            self.port.write(data)
+        with self.writeLock:
+            if fourxidraw_compat.isPython3():
+                self.port.write(data.encode())
+            else:
+                self.port.write(data)
+
+    def readline(self, untilStatus=False):
+        # Status reports can arrive at any time; note them and read on,
+        # unless it is a status report that is being waited for.
+        while True:
+            data = self.port.readline().decode().rstrip()
+            if self.doLog:
+                self.log('RECV', data)
+            if not isStatusReport(data):
+                return data
+            self.status = parseStatus(data)
+            self.statusAcks = self.acks
+            if 'Bf' in self.status:
+                self.plannerBlocks = max(self.plannerBlocks, self.status['Bf'][0])
+            if 'Ov' in self.status:
+                self.feedOverride = self.status['Ov'][0]
+            if untilStatus or self.interrupted.is_set():
+                return ''
 
-    def readline(self):
-        data = self.port.readline().decode().rstrip()
+    def realtime(self, code):
+        '''
+        Send a GRBL real-time command byte.  These act at once, ahead of
+        anything queued, and are not acknowledged.
+        '''
+        if self.port is None:
+            return
         if self.doLog:
-            self.log('RECV', data)
-        return data
+            self.log('SEND', code.decode('latin-1'))
+        with self.writeLock:
+            self.port.write(code)
+
+    def interrupt(self):
+        '''Stop waiting for the reply to the current line.'''
+        self.interrupted.set()
+
+    def isHeld(self):
+        return (self.status is not None) and (self.status['state'] in ('Hold', 'Door'))
+
+    def waitForHold(self, timeout=10.0):
+        '''
+        Wait for a feed hold to bring the machine to a stop.  Returns the
+        last status report.  GRBL 1.1 reports Hold:0 once stopped; 0.9
+        only reports Hold, so the machine is taken to have stopped once
+        its position is the same in two reports running.
+        '''
+        deadline = time.time() + timeout
+        status = self.pollStatus()
+        lastPosition = None
+        while (status is not None) and (time.time() < deadline):
+            if status['state'] == 'Idle':
+                break
+            if status['state'] == 'Hold':
+                if 'substate' in status:
+                    if status['substate'] == '0':
+                        break
+                else:
+                    position = (status.get('MPos'), status.get('WPos'))
+                    if position == lastPosition:
+                        break
+                    lastPosition = position
+            time.sleep(STATUS_INTERVAL)
+            status = self.pollStatus()
+        return status
+
+    def reset(self):
+        '''
+        Soft-reset GRBL, throwing away whatever is in its planner, and
+        wait for it to come back.  The machine position is kept as long
+        as the machine was not moving.
+        '''
+        if self.port is None:
+            return
+        self.realtime(b'\x18')
+        nTryCount = 0
+        while nTryCount < 5:
+            data = self.readline()
+            if data.startswith('Grbl'):
+                break
+            if data == '':
+                nTryCount += 1
+        self.pending.clear()
+        self.status = None
+        self.interrupted.clear()
+
+    def pollStatus(self):
+        '''Ask for a status report and wait for it.  Returns the report.'''
+        if self.port is None:
+            return None
+        status = self.status
+        self.write('?')
+        nRetryCount = 0
+        while (self.status is status) and (nRetryCount < 5):
+            if self.readline(True) == '':
+                nRetryCount += 1
+        return self.status
+
+    def statusPoller(self):
+        while not self.polling.wait(STATUS_INTERVAL):
+            try:
+                with self.writeLock:
+                    self.port.write(b'?')
+            except (serial.SerialException, ValueError):
+                break
+
+    def startStatusPolling(self):
+        '''Have a background thread request status reports from GRBL.'''
+        if (self.port is None) or (self.poller is not None):
+            return
+        self.polling.clear()
+        self.poller = threading.Thread(target=self.statusPoller)
+        self.poller.daemon = True
+        self.poller.start()
+
+    def stopStatusPolling(self):
+        if self.poller is not None:
+            self.polling.set()
+            self.poller.join()
+            self.poller = None
+
+    def clearTracking(self):
+        '''Forget the tagged moves of an earlier plot, before starting another.'''
+        self.acks = 0
+        self.pending.clear()
+        self.executed = None
+        self.lastTarget = None
+        self.statusAcks = 0
+
+    def executedMove(self):
+        '''
+        Return (tag, target) for the last tagged move that GRBL has actually
+        executed, going by the latest status report, or None if none has.
+
+        GRBL acknowledges a line once it is in the planner, which can hold
+        a dozen or more moves.  With buffer data in the report (Bf, $10=2)
+        the moves still in the planner are counted off the acknowledged
+        ones.  Otherwise the reported position is matched against the
+        pending moves.  Without any report, the planner is assumed full.
+        '''
+        status = self.status
+        if status is None:
+            done = self.acks - self.plannerBlocks
+        elif 'Bf' in status:
+            done = self.statusAcks - (self.plannerBlocks - status['Bf'][0])
+        elif status['state'] == 'Idle':
+            done = self.statusAcks
+        else:
+            done = self.matchPosition(status)
+
+        while self.pending and self.pending[0][0] <= done:
+            seq, tag, target = self.pending.popleft()
+            self.executed = (tag, target)
+            self.lastTarget = target
+        return self.executed
+
+    def matchPosition(self, status):
+        # Return the ack number of the last move finished at the reported position
+        if 'WPos' in status:
+            position = status['WPos']
+        elif 'MPos' in status:
+            position = status['MPos']
+            if 'WCO' in status:
+                position = (position[0] - status['WCO'][0],
+                            position[1] - status['WCO'][1])
+        else:
+            return self.statusAcks - self.plannerBlocks
+        start = self.lastTarget
+        for seq, tag, target in self.pending:
+            if seq > self.statusAcks:
+                break
+            if start is not None and onSegment(position, start, target):
+                # Under way from start to target; if at target, it is done
+                if onSegment(position, target, target):
+                    return seq
+                return seq - 1
+            start = target
+        return self.statusAcks - self.plannerBlocks
 
     def query(self, cmd):
         if (self.port is not None) and (cmd is not None):
@@ -179,38 +499,113 @@ class GrblSerial(object):
                 if self.doLog:
                     self.log('QUERY', 'response is '+response)
             except serial.SerialException:
-                inkex.errormsg(gettext.gettext("Error reading serial data."))
+                errormsg(gettext.gettext("Error reading serial data."))
             return response
         else:
             return None
 
-    def command(self, cmd):
+    def command(self, cmd, tag=None, target=None):
+        '''
+        Send a line and wait for GRBL to accept it.  A move may be given a
+        tag (and its target position), to be reported by executedMove()
+        once GRBL has executed it.
+        '''
         if (self.port is not None) and (cmd is not None):
+            if self.interrupted.is_set():
+                return
             try:
                 self.write(cmd)
                 response = self.readline()
                 self.gcodeLog(cmd)
                 nRetryCount = 0
                 while (len(response) == 0) and (nRetryCount < 30):
+                    if self.interrupted.is_set():
+                        return
                     # get new response to replace null response if necessary
                     response = self.readline()
                     nRetryCount += 1
+                    if self.isHeld():
+                        # A full planner is not drained during a feed hold
+                        nRetryCount = 0
                 if 'ok' in response.strip():
+                    if tag is not None:
+                        self.acks += 1
+                        self.pending.append((self.acks, tag, target))
                     return
                 else:
                     if (response != ''):
-                        inkex.errormsg('Error: Unexpected response from GRBL.')
-                        inkex.errormsg('   Command: ' + cmd.strip())
-                        inkex.errormsg('   Response: ' + str(response.strip()))
+                        errormsg('Error: Unexpected response from GRBL.')
+                        errormsg('   Command: ' + cmd.strip())
+                        errormsg('   Response: ' + str(response.strip()))
                     else:
-                        inkex.errormsg(
+                        errormsg(
                             'GRBL Serial Timeout after command: %s)' % cmd.strip())
                         sys.exit()
             except:
-                inkex.errormsg('Failed after command: ' + cmd)
+                errormsg('Failed after command: ' + cmd)
                 sys.exit()
 
 
+class GcodeFile(object):
+    '''
+    Stands in for GrblSerial, writing the G-code to a file instead of
+    sending it to GRBL.  Every line counts as executed once written.
+    '''
+
+    def __init__(self, filename):
+        self.port = open(filename, 'w')
+        self.status = {'state': 'Idle', 'v11': False}
+        self.feedOverride = None
+        self.executed = None
+        self.lines = 0
+
+    def close(self):
+        if self.port is not None:
+            self.port.close()
+            self.port = None
+
+    def command(self, cmd, tag=None, target=None):
+        if (self.port is not None) and (cmd is not None):
+            self.port.write(cmd.rstrip('\r') + '\n')
+            self.lines += 1
+            if tag is not None:
+                self.executed = (tag, target)
+
+    def query(self, cmd):
+        self.command(cmd)
+        return ''
+
+    def realtime(self, code):
+        pass
+
+    def interrupt(self):
+        pass
+
+    def isHeld(self):
+        return False
+
+    def waitForHold(self, timeout=10.0):
+        return self.status
+
+    def reset(self):
+        pass
+
+    def pollStatus(self):
+        return self.status
+
+    def startStatusPolling(self):
+        pass
+
+    def stopStatusPolling(self):
+        pass
+
+    def clearTracking(self):
+        self.executed = None
+
+    def executedMove(self):
+        return self.executed
+
+
 if __name__ == "__main__":
 
     serialPort = openPort(True)
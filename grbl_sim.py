@@ -0,0 +1,551 @@
+# grbl_sim.py
+# Part of the 4xiDraw driver for Inkscape
+#
+# A GRBL 1.1 simulator on a pseudo-terminal, so that grbl_serial and
+# grbl_motion can be exercised, timed and tested without a board.
+#
+#     python grbl_sim.py [-n COUNT] [--time-scale X] [--setting 110=5000 ...]
+#
+# prints the name of each simulated board's port and runs until stopped.
+# The simulator behaves as GRBL does on the wire:
+#
+#   - Characters go into a 128-byte receive buffer; any that do not fit
+#     are lost, as on the real board, and counted as overflows.
+#   - Each move line takes a block in a 15-block planner queue, and is
+#     only answered with 'ok' once there is room for it there.
+#   - Real-time commands (?, !, ~, ctrl-x and the feed overrides) act at
+#     once, and '?' is answered with a 1.1 status report.
+#   - Moves take as long as they would on the machine, given the rates
+#     and accelerations in $110/$111 and $120/$121 and the junction
+#     deviation in $11, planned across the whole queue as GRBL does.
+#   - G4, M3/M5 and M0 wait for the planner to empty, as they do in GRBL.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import argparse
+import math
+import os
+import pty
+import re
+import select
+import threading
+import time
+import tty
+from collections import deque
+
+RX_BUFFER_SIZE = 128
+PLANNER_BLOCKS = 15
+TICK = 0.005            # Seconds between updates of the simulated motion
+
+BANNER = "\r\nGrbl 1.1h ['$' for help]\r\n"
+IDENTITY = '[VER:1.1h.20190825:sim]\r\n[OPT:V,15,128]\r\n'
+
+# GRBL's defaults for the settings that the simulator uses
+DEFAULT_SETTINGS = {
+    11: 0.010,      # Junction deviation, mm
+    100: 250.0,     # X steps/mm
+    101: 250.0,     # Y steps/mm
+    102: 250.0,     # Z steps/mm
+    110: 500.0,     # X max rate, mm/min
+    111: 500.0,     # Y max rate, mm/min
+    112: 500.0,     # Z max rate, mm/min
+    120: 10.0,      # X acceleration, mm/s^2
+    121: 10.0,      # Y acceleration, mm/s^2
+    122: 10.0,      # Z acceleration, mm/s^2
+    130: 200.0,     # X max travel, mm
+    131: 200.0,     # Y max travel, mm
+    132: 200.0,     # Z max travel, mm
+}
+
+# Error codes, as numbered by GRBL 1.1
+ERROR_EXPECTED_COMMAND_LETTER = 1
+ERROR_BAD_NUMBER_FORMAT = 2
+ERROR_INVALID_STATEMENT = 3
+ERROR_SETTING_DISABLED = 5
+ERROR_IDLE_ERROR = 8
+ERROR_UNSUPPORTED_COMMAND = 20
+
+FEED_OVERRIDE_MIN = 10
+FEED_OVERRIDE_MAX = 200
+
+WORD_LETTERS = 'FGMNPSTXYZ'
+
+wordPattern = re.compile(r'([A-Z])([-+]?[0-9]*\.?[0-9]*)')
+settingPattern = re.compile(r'^\$([0-9]+)=(.*)$')
+
+
+def trapezoid(distance, v0, vc, v1, accel):
+    '''
+    Plan a move of distance mm, entered at v0 and left at v1 mm/s, with
+    cruising speed vc and acceleration accel.  Returns (v0, vc, v1, t1,
+    t2, duration), where t1 and t2 are the ends of the acceleration and
+    cruise phases.
+    '''
+    v0 = min(v0, vc)
+    v1 = min(v1, vc, math.sqrt(v0 * v0 + 2 * accel * distance))
+    accelDistance = (vc * vc - v0 * v0) / (2 * accel)
+    decelDistance = (vc * vc - v1 * v1) / (2 * accel)
+    if accelDistance + decelDistance > distance:
+        # No room to reach the cruising speed
+        vc = math.sqrt(max(v0 * v0, v1 * v1,
+                           (2 * accel * distance + v0 * v0 + v1 * v1) / 2))
+        accelDistance = max(0.0, (vc * vc - v0 * v0) / (2 * accel))
+        decelDistance = distance - accelDistance
+    t1 = (vc - v0) / accel
+    t2 = t1 + max(0.0, distance - accelDistance - decelDistance) / vc
+    duration = t2 + max(0.0, 2 * decelDistance / (vc + v1)) if vc + v1 > 0 else t2
+    return (v0, vc, v1, t1, t2, duration)
+
+
+class Block(object):
+    '''A straight move in the planner queue.'''
+
+    def __init__(self, start, end, feed, settings):
+        self.start = start
+        self.end = end
+        dx = end[0] - start[0]
+        dy = end[1] - start[1]
+        self.distance = math.hypot(dx, dy)
+        self.unit = (dx / self.distance, dy / self.distance)
+        # Rate and acceleration are limited by each axis along the way
+        rate = feed / 60.0
+        self.accel = float('inf')
+        for axis, component in enumerate(self.unit):
+            if abs(component) > 1e-9:
+                rate = min(rate, settings[110 + axis] / 60.0 / abs(component))
+                self.accel = min(self.accel, settings[120 + axis] / abs(component))
+        self.rate = rate
+        self.profile = None
+        self.elapsed = 0.0
+
+    def plan(self, entry, exit, feedOverride):
+        vc = self.rate * feedOverride / 100.0
+        self.profile = trapezoid(self.distance, entry, vc, exit, self.accel)
+
+    def travelled(self, t):
+        '''Distance along the block t seconds into it.'''
+        v0, vc, v1, t1, t2, duration = self.profile
+        if t <= t1:
+            return v0 * t + 0.5 * self.accel * t * t
+        s = v0 * t1 + 0.5 * self.accel * t1 * t1 + vc * (min(t, t2) - t1)
+        if t > t2:
+            dt = min(t, duration) - t2
+            s += vc * dt - 0.5 * self.accel * dt * dt
+        return min(s, self.distance)
+
+    def position(self):
+        s = self.travelled(self.elapsed)
+        return (self.start[0] + self.unit[0] * s, self.start[1] + self.unit[1] * s)
+
+
+def junctionSpeed(previous, block, junctionDeviation):
+    '''Fastest speed (mm/s) at which one block may run into the next.'''
+    cosTheta = -(previous.unit[0] * block.unit[0] + previous.unit[1] * block.unit[1])
+    if cosTheta > 0.999999:
+        return 0.0  # A reversal
+    if cosTheta < -0.999999:
+        return float('inf')    # Straight on
+    sinHalf = math.sqrt(0.5 * (1.0 - cosTheta))
+    return math.sqrt(min(previous.accel, block.accel) * junctionDeviation *
+                     sinHalf / (1.0 - sinHalf))
+
+
+class GrblSimulator(object):
+    '''
+    One simulated GRBL board, reached through the pseudo-terminal named
+    by portName.  timeScale runs the simulated motion faster than real
+    time.
+    '''
+
+    def __init__(self, settings=None, timeScale=1.0, identity=IDENTITY):
+        self.settings = dict(DEFAULT_SETTINGS)
+        if settings:
+            self.settings.update(settings)
+        self.timeScale = timeScale
+        self.identity = identity
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.portName = os.ttyname(self.slave)
+
+        self.lock = threading.Condition()
+        self.writeLock = threading.Lock()
+        self.rx = bytearray()
+        self.planner = deque()
+        self.position = (0.0, 0.0)
+        self.relative = False
+        self.inches = False
+        self.feed = 0.0
+        self.spindle = 0
+        self.feedOverride = 100
+        self.held = False
+        self.lastBlock = None   # The block just finished, while moving on
+        self.generation = 0     # Counts soft resets
+        self.running = False
+        self.threads = []
+
+        # Statistics
+        self.lines = 0
+        self.moves = 0
+        self.errors = 0
+        self.overflows = 0
+        self.distance = 0.0
+        self.motionTime = 0.0   # Simulated seconds spent moving
+
+    def start(self):
+        self.running = True
+        for target in (self.receive, self.protocol, self.stepper):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+            self.lock.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        os.close(self.master)
+        os.close(self.slave)
+
+    def send(self, text):
+        with self.writeLock:
+            try:
+                os.write(self.master, text.encode('ascii'))
+            except OSError:
+                pass
+
+    # Serial input
+
+    def receive(self):
+        while self.running:
+            ready, unused, unused = select.select([self.master], [], [], 0.1)
+            if not ready:
+                continue
+            try:
+                data = os.read(self.master, 1024)
+            except OSError:
+                return
+            with self.lock:
+                for c in bytearray(data):
+                    if not self.realtime(c):
+                        if len(self.rx) < RX_BUFFER_SIZE:
+                            self.rx.append(c)
+                        else:
+                            self.overflows += 1
+                self.lock.notify_all()
+
+    def realtime(self, c):
+        '''Act on a real-time command.  Called with the lock held.'''
+        if c == ord('?'):
+            self.send(self.statusReport())
+        elif c == ord('!'):
+            if self.planner:
+                self.held = True
+        elif c == ord('~'):
+            self.held = False
+        elif c == 0x18:
+            self.planner.clear()
+            self.rx = bytearray()
+            self.held = False
+            self.lastBlock = None
+            self.feedOverride = 100
+            self.generation += 1
+            self.send(BANNER)
+        elif c == 0x90:
+            self.feedOverride = 100
+        elif c in (0x91, 0x92, 0x93, 0x94):
+            step = {0x91: 10, 0x92: -10, 0x93: 1, 0x94: -1}[c]
+            self.feedOverride = min(FEED_OVERRIDE_MAX,
+                                    max(FEED_OVERRIDE_MIN, self.feedOverride + step))
+        elif c >= 0x80:
+            pass    # Other overrides and extended commands are ignored
+        else:
+            return False
+        return True
+
+    def statusReport(self):
+        if self.held:
+            state = 'Hold:0'
+        elif self.planner:
+            state = 'Run'
+        else:
+            state = 'Idle'
+        if self.planner and self.planner[0].profile is not None:
+            x, y = self.planner[0].position()
+            feed = self.planner[0].rate * 60.0 * self.feedOverride / 100.0
+        else:
+            x, y = self.position
+            feed = 0.0
+        return '<%s|MPos:%.3f,%.3f,0.000|Bf:%d,%d|FS:%d,%d|Ov:%d,100,100>\r\n' % (
+            state, x, y, PLANNER_BLOCKS - len(self.planner), RX_BUFFER_SIZE - len(self.rx),
+            feed, self.spindle, self.feedOverride)
+
+    # Line protocol
+
+    def protocol(self):
+        while True:
+            with self.lock:
+                while self.running and (b'\n' not in self.rx) and (b'\r' not in self.rx):
+                    self.lock.wait()
+                if not self.running:
+                    return
+                end = min(i for i in (self.rx.find(b'\n'), self.rx.find(b'\r')) if i >= 0)
+                line = bytes(self.rx[:end]).decode('ascii', 'replace')
+                del self.rx[:end + 1]
+                generation = self.generation
+            response = self.execute(line.replace(' ', '').upper(), generation)
+            if response is not None:
+                self.lines += 1
+                if response.startswith('error'):
+                    self.errors += 1
+                self.send(response + '\r\n')
+
+    def wait(self, ready, generation):
+        '''
+        Wait until ready() holds.  Returns False if GRBL was reset in the
+        meantime, when the line is dropped without a response.
+        '''
+        with self.lock:
+            while self.running and (self.generation == generation) and not ready():
+                self.lock.wait(0.1)
+            return self.running and (self.generation == generation)
+
+    def synchronize(self, generation):
+        return self.wait(lambda: not self.planner, generation)
+
+    def execute(self, line, generation):
+        if line == '':
+            return 'ok'     # GRBL answers blank lines, for syncing
+        if line.startswith('$'):
+            return self.systemCommand(line)
+
+        words = {}
+        gCodes = []
+        mCodes = []
+        position = 0
+        for match in wordPattern.finditer(line):
+            if match.start() != position:
+                return 'error:%d' % ERROR_EXPECTED_COMMAND_LETTER
+            position = match.end()
+            letter, value = match.groups()
+            if letter not in WORD_LETTERS:
+                return 'error:%d' % ERROR_UNSUPPORTED_COMMAND
+            try:
+                value = float(value)
+            except ValueError:
+                return 'error:%d' % ERROR_BAD_NUMBER_FORMAT
+            if letter == 'G':
+                gCodes.append(value)
+            elif letter == 'M':
+                mCodes.append(value)
+            else:
+                words[letter] = value
+        if position != len(line):
+            return 'error:%d' % ERROR_EXPECTED_COMMAND_LETTER
+
+        motion = False
+        dwell = None
+        for code in gCodes:
+            if code in (0, 1):
+                motion = True
+            elif code == 4:
+                dwell = words.get('P', 0.0)
+            elif code == 20:
+                self.inches = True
+            elif code == 21:
+                self.inches = False
+            elif code == 90:
+                self.relative = False
+            elif code == 91:
+                self.relative = True
+            elif code not in (17, 54, 94):
+                return 'error:%d' % ERROR_UNSUPPORTED_COMMAND
+        for code in mCodes:
+            if code not in (0, 2, 3, 4, 5, 30):
+                return 'error:%d' % ERROR_UNSUPPORTED_COMMAND
+
+        scale = 25.4 if self.inches else 1.0
+        if 'F' in words:
+            self.feed = words['F'] * scale
+
+        if dwell is not None:
+            if not self.synchronize(generation):
+                return None
+            time.sleep(dwell / self.timeScale)
+        if mCodes or ('S' in words):
+            if not self.synchronize(generation):
+                return None
+            if 'S' in words:
+                self.spindle = int(words['S'])
+            if 0 in mCodes:
+                # Program pause: hold until a cycle start
+                with self.lock:
+                    self.held = True
+                if not self.wait(lambda: not self.held, generation):
+                    return None
+        if (motion or 'X' in words or 'Y' in words) and (dwell is None):
+            if not self.queueMove(words, scale, generation):
+                return None
+        return 'ok'
+
+    def queueMove(self, words, scale, generation):
+        if not self.wait(lambda: len(self.planner) < PLANNER_BLOCKS, generation):
+            return False
+        with self.lock:
+            start = self.planner[-1].end if self.planner else self.position
+            end = list(start)
+            for axis, letter in enumerate('XY'):
+                if letter in words:
+                    if self.relative:
+                        end[axis] += words[letter] * scale
+                    else:
+                        end[axis] = words[letter] * scale
+            end = tuple(end)
+            if end == start:
+                return True
+            feed = self.feed if self.feed > 0 else self.settings[110]
+            self.planner.append(Block(start, end, feed, self.settings))
+            self.moves += 1
+            self.lock.notify_all()
+        return True
+
+    def systemCommand(self, line):
+        if line == '$I':
+            return self.identity + 'ok'
+        if line == '$$':
+            return ''.join('$%d=%s\r\n' % (key, formatSetting(self.settings[key]))
+                           for key in sorted(self.settings)) + 'ok'
+        if line == '$G':
+            return '[GC:G1 G54 G17 %s %s G94 M5 M9 T0 F%d S%d]\r\nok' % (
+                'G20' if self.inches else 'G21', 'G91' if self.relative else 'G90',
+                self.feed, self.spindle)
+        if line in ('$X', '$'):
+            return 'ok'
+        if line == '$H':
+            return 'error:%d' % ERROR_SETTING_DISABLED
+        match = settingPattern.match(line)
+        if match:
+            with self.lock:
+                if self.planner:
+                    return 'error:%d' % ERROR_IDLE_ERROR
+            try:
+                self.settings[int(match.group(1))] = float(match.group(2))
+            except ValueError:
+                return 'error:%d' % ERROR_BAD_NUMBER_FORMAT
+            return 'ok'
+        return 'error:%d' % ERROR_INVALID_STATEMENT
+
+    # Motion
+
+    def stepper(self):
+        now = time.time()
+        while True:
+            with self.lock:
+                if self.running and (self.held or not self.planner):
+                    while self.running and (self.held or not self.planner):
+                        if not self.planner:
+                            self.lastBlock = None   # Came to a stop
+                        self.lock.wait()
+                    now = time.time()
+                if not self.running:
+                    return
+                block = self.planner[0]
+                if block.profile is None:
+                    self.planBlock(block)
+                # Wake when the block ends, if that is sooner
+                remaining = (block.profile[5] - block.elapsed) / self.timeScale
+            time.sleep(min(TICK, max(0.0, remaining)))
+            with self.lock:
+                last = now
+                now = time.time()
+                self.advance((now - last) * self.timeScale)
+
+    def advance(self, dt):
+        '''
+        Carry the motion dt simulated seconds further, through as many
+        blocks as that takes.  Called with the lock held.
+        '''
+        while (dt > 0) and self.planner and not self.held:
+            block = self.planner[0]
+            if block.profile is None:
+                self.planBlock(block)
+            remaining = block.profile[5] - block.elapsed
+            if dt < remaining:
+                block.elapsed += dt
+                self.motionTime += dt
+                return
+            dt -= remaining
+            self.motionTime += remaining
+            self.planner.popleft()
+            self.position = block.end
+            self.distance += block.distance
+            self.lastBlock = block
+            self.lock.notify_all()
+
+    def planBlock(self, block):
+        '''Plan the block about to run.  Called with the lock held.'''
+        junctionDeviation = self.settings[11]
+        entry = 0.0
+        if self.lastBlock is not None:
+            entry = min(self.lastBlock.profile[2],
+                        junctionSpeed(self.lastBlock, block, junctionDeviation))
+        # Work back from a stop at the end of the queue, as GRBL's planner
+        # does, to find how fast this block may be left
+        exit = 0.0
+        blocks = list(self.planner)
+        for i in range(len(blocks) - 1, 0, -1):
+            following = blocks[i]
+            exit = min(junctionSpeed(blocks[i - 1], following, junctionDeviation),
+                       following.rate * self.feedOverride / 100.0,
+                       math.sqrt(exit * exit + 2 * following.accel * following.distance))
+        block.plan(entry, exit, self.feedOverride)
+
+
+def formatSetting(value):
+    if value == int(value):
+        return '%d' % value
+    return '%.3f' % value
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate GRBL boards on pseudo-terminals.')
+    parser.add_argument('-n', '--count', type=int, default=1, help='number of boards')
+    parser.add_argument('--time-scale', type=float, default=1.0, dest='timeScale',
+                        help='run motion this many times faster than real time')
+    parser.add_argument('--setting', action='append', default=[], metavar='N=VALUE',
+                        help='change a GRBL setting, for example 110=5000')
+    args = parser.parse_args()
+
+    settings = {}
+    for setting in args.setting:
+        key, value = setting.split('=', 1)
+        settings[int(key.lstrip('$'))] = float(value)
+
+    simulators = [GrblSimulator(settings, args.timeScale).start() for i in range(args.count)]
+    for simulator in simulators:
+        print(simulator.portName)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    for simulator in simulators:
+        simulator.stop()
+        print('%s: %d lines, %d moves, %d errors, %d overflows, %.0f mm in %.1f s'
+              % (simulator.portName, simulator.lines, simulator.moves, simulator.errors,
+                 simulator.overflows, simulator.distance, simulator.motionTime))
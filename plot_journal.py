@@ -0,0 +1,195 @@
+# plot_journal.py
+# Part of the 4xiDraw driver for Inkscape
+#
+# A plot journal is the compiled form of a plot: every pen lift, pen drop
+# and move that traversing the document produced, written to a file of
+# fixed-size binary records.  The plot is then streamed to GRBL from the
+# journal.  Because every record has the same size, a paused plot can be
+# resumed by seeking straight to the record after the last one carried
+# out, without parsing the document again.
+#
+# The extension keeps its journals in the cache directory and removes
+# each once its plot is done.  A journal to keep, for grbl_fleet.py to
+# plot, is written with fourxidraw_stream.py --journalFile.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import os
+import struct
+import time
+import uuid
+
+import plot_utils
+
+# File header: magic, format version, 1 once all records have been written
+HEADER = struct.Struct('<4sHH')
+MAGIC = b'4XDJ'
+VERSION = 1
+
+# Record: op, flags, count, x, y, where (x, y) is the position, in inches,
+# once the record has been carried out
+#   MOVE        absolute move to (x, y)
+#   PEN_UP      pen lift; count is the delay in ms
+#   PEN_DOWN    pen drop; count is the delay in ms
+#   CHECKPOINT  a path has been completed; count is the path number
+#   PEN_CHANGE  pause for the pen to be changed; count is the number of
+#               the layer to be plotted next
+RECORD = struct.Struct('<BBIdd')
+
+MOVE = 1
+PEN_UP = 2
+PEN_DOWN = 3
+CHECKPOINT = 4
+PEN_CHANGE = 5
+
+# Flags
+FLAG_PEN_DOWN = 0x01    # The pen is down when this record is reached
+
+READ_CHUNK = 1024       # Records read from the file at a time
+MAX_AGE = 30 * 24 * 3600  # Journals left over from abandoned plots expire
+
+
+class JournalError(Exception):
+    pass
+
+
+def newJournalId():
+    return uuid.uuid4().hex
+
+
+def journalPath(journalId):
+    return os.path.join(plot_utils.cacheDirectory(),
+                        'plot-%s.journal' % journalId)
+
+
+def removeJournal(journalId):
+    if journalId:
+        try:
+            os.remove(journalPath(journalId))
+        except OSError:
+            pass
+
+
+def pruneJournals():
+    '''Remove journals of plots that were never finished nor resumed.'''
+    try:
+        directory = plot_utils.cacheDirectory()
+        limit = time.time() - MAX_AGE
+        for name in os.listdir(directory):
+            if name.startswith('plot-') and name.endswith('.journal'):
+                path = os.path.join(directory, name)
+                if os.path.getmtime(path) < limit:
+                    os.remove(path)
+    except OSError:
+        pass
+
+
+class JournalWriter(object):
+    '''
+    Records a plot instead of sending it.  Provides the same sendPenUp,
+    sendPenDown and doAbsoluteMove methods as GrblMotion, so it can stand
+    in for it while the document is traversed.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, 0))
+        self.buffer = bytearray()
+        self.count = 0
+        self.flags = 0
+        self.x = 0.0
+        self.y = 0.0
+
+    def append(self, op, count, x, y):
+        self.buffer += RECORD.pack(op, self.flags, count, x, y)
+        self.count += 1
+        if len(self.buffer) >= READ_CHUNK * RECORD.size:
+            self.file.write(self.buffer)
+            del self.buffer[:]
+
+    def sendPenUp(self, PenDelay, fSpeed):
+        self.append(PEN_UP, PenDelay, self.x, self.y)
+        self.flags &= ~FLAG_PEN_DOWN
+
+    def sendPenDown(self, PenDelay, fSpeed):
+        self.append(PEN_DOWN, PenDelay, self.x, self.y)
+        self.flags |= FLAG_PEN_DOWN
+
+    def doAbsoluteMove(self, x, y):
+        self.x = x
+        self.y = y
+        self.append(MOVE, 0, x, y)
+
+    def checkpoint(self, pathCount):
+        self.append(CHECKPOINT, pathCount, self.x, self.y)
+
+    def pauseForPenChange(self, layerNumber):
+        self.append(PEN_CHANGE, layerNumber, self.x, self.y)
+
+    def close(self, complete=True):
+        '''Flush the records and mark the journal as complete.'''
+        self.file.write(self.buffer)
+        del self.buffer[:]
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, 1 if complete else 0))
+        self.file.close()
+
+
+class JournalReader(object):
+    '''Reads back a complete journal, starting at any record.'''
+
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        try:
+            header = self.file.read(HEADER.size)
+            if len(header) != HEADER.size:
+                raise JournalError('truncated journal')
+            magic, version, complete = HEADER.unpack(header)
+            if magic != MAGIC or version != VERSION:
+                raise JournalError('not a plot journal')
+            if not complete:
+                raise JournalError('incomplete journal')
+            self.file.seek(0, os.SEEK_END)
+            size = self.file.tell() - HEADER.size
+            if size % RECORD.size:
+                raise JournalError('truncated journal')
+            self.count = size // RECORD.size
+        except Exception:
+            self.file.close()
+            raise
+
+    def __len__(self):
+        return self.count
+
+    def record(self, index):
+        '''Return the (op, flags, count, x, y) tuple of one record.'''
+        self.file.seek(HEADER.size + index * RECORD.size)
+        return RECORD.unpack(self.file.read(RECORD.size))
+
+    def records(self, start=0):
+        '''Yield (index, op, flags, count, x, y) from record start onwards.'''
+        index = start
+        self.file.seek(HEADER.size + start * RECORD.size)
+        while index < self.count:
+            data = self.file.read(READ_CHUNK * RECORD.size)
+            if not data:
+                break
+            for record in RECORD.iter_unpack(data):
+                yield (index,) + record
+                index += 1
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,117 @@
+# plot_layers.py
+# Part of the 4xiDraw driver for Inkscape
+#
+# The layer index: every Inkscape layer of a document, found once, with
+# what its name says about plotting it.  A layer name may begin with
+#
+#   %           the layer is never plotted
+#   a number    the layer is plotted when that layer number is asked for
+#
+# and the number may be followed directly by overrides for the layer:
+#
+#   +H<n>       pen-down height, 0 to 100 (percent)
+#   +S<n>       pen-down speed, 1 to 100 (percent)
+#
+# so that "3+H40+S20 fine detail" is layer 3, drawn with the pen at 40%
+# and at 20% speed.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import re
+
+import inkex
+
+LAYER_NUMBER = re.compile(r'[0-9]+')
+LAYER_OVERRIDE = re.compile(r'\+([hs])([0-9]*)', re.IGNORECASE)
+
+
+class Layer(object):
+    def __init__(self, node):
+        self.node = node
+        self.name = node.get(inkex.addNS('label', 'inkscape'))
+        self.number = None          # None if the name does not start with one
+        self.skip = False
+        self.penDownHeight = None   # Overrides; None if not given
+        self.penDownSpeed = None
+        self.parseName(self.name or '')
+
+    def parseName(self, name):
+        self.skip = name.startswith('%')
+        position = 0
+        match = LAYER_NUMBER.match(name)
+        if match:
+            self.number = int(match.group())
+            position = match.end()
+
+        match = LAYER_OVERRIDE.match(name, position)
+        while match:
+            position = match.end()
+            if match.group(2):
+                value = int(match.group(2))
+                if match.group(1).lower() == 'h':
+                    if 0 <= value <= 100:
+                        self.penDownHeight = value
+                elif 0 < value <= 100:
+                    self.penDownSpeed = value
+            else:
+                position += 1   # Without a number, the next character is passed over
+            match = LAYER_OVERRIDE.match(name, position)
+
+
+def isLayer(node):
+    return node.get(inkex.addNS('groupmode', 'inkscape')) == 'layer'
+
+
+class LayerIndex(object):
+    '''The layers of a document, in document order.'''
+
+    def __init__(self, svg):
+        self.layers = [Layer(node) for node in svg.iter(inkex.addNS('g', 'svg'), 'g')
+                       if isLayer(node)]
+        self.byNode = dict((layer.node, layer) for layer in self.layers)
+
+    def __len__(self):
+        return len(self.layers)
+
+    def __iter__(self):
+        return iter(self.layers)
+
+    def layer(self, node):
+        '''The entry for the layer node; made now, if it is not in the document.'''
+        layer = self.byNode.get(node)
+        if layer is None:
+            layer = Layer(node)
+        return layer
+
+    def numbers(self):
+        '''The layer numbers used, in ascending order.'''
+        return sorted(set(layer.number for layer in self.layers
+                          if (layer.number is not None) and not layer.skip))
+
+    def numbered(self, number):
+        '''
+        The layers with that number, less any inside another of them: those
+        are plotted along with it.
+        '''
+        found = []
+        nodes = set()
+        for layer in self.layers:
+            if (layer.number != number) or layer.skip:
+                continue
+            if any(ancestor in nodes for ancestor in layer.node.iterancestors()):
+                continue
+            found.append(layer)
+            nodes.add(layer.node)
+        return found
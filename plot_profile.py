@@ -0,0 +1,173 @@
+# plot_profile.py
+# Part of the 4xiDraw driver for Inkscape
+#
+# Opt-in profiling of a plot.  The Profiler wraps chosen methods and
+# functions with timers, and sorts the time they take into three kinds:
+#
+#   cpu     work done here: traversing the document, flattening curves,
+#           planning trajectories, formatting G-code
+#   serial  waiting for GRBL to answer a line, as far as the round trip
+#           over the serial link accounts for it
+#   motion  waiting on the machine: for room in GRBL's planner, which
+#           only frees up as moves are carried out, and for the pen
+#
+# Time in a wrapped call is counted once, against the innermost wrapped
+# call it is spent in.  Nothing is wrapped unless profiling is asked for,
+# so the plot runs at full speed otherwise.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import json
+import os
+import time
+
+import plot_utils
+
+CPU = 'cpu'
+SERIAL = 'serial'
+MOTION = 'motion'
+CATEGORIES = (CPU, SERIAL, MOTION)
+
+PROFILE_FILE = 'profile.json'
+
+# A reply slower than twice the fastest round trip, plus this many seconds,
+# was held up by GRBL's planner being full
+ROUND_TRIP_SLACK = 0.002
+
+
+def profilePath():
+    return os.path.join(plot_utils.cacheDirectory(), PROFILE_FILE)
+
+
+class Profiler(object):
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.sections = {}  # name: {'category', 'calls', 'own', 'total'}
+        self.stack = []     # [name, started, time in wrapped calls within]
+        self.depth = {}     # name: wrapped calls of it under way
+        self.patched = []   # (object, attribute, original)
+        self.roundTrip = None
+
+    def section(self, name, category):
+        return self.sections.setdefault(
+            name, {'category': category, 'calls': 0, 'own': 0.0, 'total': 0.0})
+
+    def enter(self, name):
+        self.stack.append([name, time.perf_counter(), 0.0])
+        self.depth[name] = self.depth.get(name, 0) + 1
+
+    def leave(self, category):
+        '''End the innermost call; returns its (elapsed, own) time.'''
+        name, started, inner = self.stack.pop()
+        elapsed = time.perf_counter() - started
+        self.depth[name] -= 1
+        section = self.section(name, category)
+        section['calls'] += 1
+        section['own'] += elapsed - inner
+        if self.depth[name] == 0:
+            section['total'] += elapsed     # Recursive calls only once
+        if self.stack:
+            self.stack[-1][2] += elapsed
+        return elapsed, elapsed - inner
+
+    def instrument(self, owner, attribute, category, name=None):
+        '''Time every call to owner.attribute, as name.'''
+        function = getattr(owner, attribute)
+        name = name or attribute
+
+        def timed(*args, **kwargs):
+            self.enter(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.leave(category)
+
+        self.patched.append((owner, attribute, function))
+        setattr(owner, attribute, timed)
+
+    def instrumentSerial(self, serialPort):
+        '''
+        Time the lines sent to GRBL, telling the round trip from the wait
+        for room in the planner by how much longer than the fastest reply
+        each one takes.
+        '''
+        function = serialPort.command
+
+        def command(*args, **kwargs):
+            self.enter('GrblSerial.command')
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed, own = self.leave(SERIAL)
+                if (self.roundTrip is None) or (own < self.roundTrip):
+                    self.roundTrip = own
+                waited = own - (2 * self.roundTrip + ROUND_TRIP_SLACK)
+                if waited > 0:
+                    self.sections['GrblSerial.command']['own'] -= waited
+                    self.section('planner wait', MOTION)['own'] += waited
+                    self.sections['planner wait']['total'] += waited
+                    self.sections['planner wait']['calls'] += 1
+
+        self.patched.append((serialPort, 'command', function))
+        serialPort.command = command
+
+    def restore(self):
+        '''Put back everything that was wrapped.'''
+        for owner, attribute, function in reversed(self.patched):
+            setattr(owner, attribute, function)
+        self.patched = []
+
+    def finish(self):
+        self.finished = time.perf_counter()
+        self.restore()
+
+    def report(self):
+        '''The profile, as a dictionary that can be written as JSON.'''
+        wall = (self.finished or time.perf_counter()) - self.started
+        categories = dict((category, 0.0) for category in CATEGORIES)
+        for section in self.sections.values():
+            categories[section['category']] += section['own']
+        # Whatever was not in a wrapped call was spent here, too
+        categories['other'] = max(0.0, wall - sum(categories.values()))
+        return {
+            'wall': wall,
+            'categories': categories,
+            'sections': self.sections,
+            'roundTrip': self.roundTrip,
+        }
+
+    def summary(self):
+        '''The profile, as lines of text.'''
+        report = self.report()
+        wall = report['wall']
+        lines = ['Plot took %.2f s:' % wall]
+        for category, label in ((CPU, 'computing'), (SERIAL, 'serial round trips'),
+                                (MOTION, 'waiting on the machine'), ('other', 'other')):
+            seconds = report['categories'][category]
+            lines.append('  %-24s %8.2f s %5.1f%%' % (
+                label, seconds, 100.0 * seconds / wall if wall > 0 else 0.0))
+        sections = sorted(self.sections.items(), key=lambda item: -item[1]['own'])
+        for name, section in sections:
+            lines.append('  %-24s %8.2f s in %d calls (%s)' % (
+                name, section['own'], section['calls'], section['category']))
+        return lines
+
+    def write(self, filename=None):
+        '''Write the profile to filename as JSON; returns the file name.'''
+        filename = filename or profilePath()
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+        return filename
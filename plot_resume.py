@@ -0,0 +1,96 @@
+# plot_resume.py
+# Part of the 4xiDraw driver for Inkscape
+#
+# The resume data: what a plot keeps in its own document, so that the
+# next run of the extension can resume it if it was stopped.  It is kept
+# in the attributes of a <WCB> element among the children of the root,
+#
+#   <WCB layer="12345" node="0" lastpath="17" ... journalpos="5120"/>
+#
+# and read into a ResumeData record.  To keep more, add to FIELDS.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import inkex
+
+WCB_TAG = inkex.addNS('WCB', 'svg')
+WCB_TAGS = (WCB_TAG, 'WCB')
+# What "strip-data" removes: ours, and the EggBot extension's
+DATA_TAGS = WCB_TAGS + (inkex.addNS('eggbot', 'svg'), 'eggbot')
+
+# attribute, field, type, default
+FIELDS = (
+    ('layer', 'layer', int, 0),                     # Layer plotted; 12345 for all of them
+    ('node', 'nodeCount', int, 0),                  # Node paused at, if saved in paused state
+    ('lastpath', 'lastPath', int, 0),               # Last path number that has been fully painted
+    ('lastpathnc', 'lastPathNC', int, 0),           # Node count as of finishing last path
+    ('lastknownposx', 'lastKnownPosX', float, 0.0), # Last known position of carriage
+    ('lastknownposy', 'lastKnownPosY', float, 0.0),
+    ('pausedposx', 'pausedPosX', float, 0.0),       # The position of the carriage when "pause" was pressed
+    ('pausedposy', 'pausedPosY', float, 0.0),
+    ('journal', 'journal', str, ''),                # Plot journal, and the record to resume it from
+    ('journalpos', 'journalPos', int, 0),
+    ('feedoverride', 'feedOverride', int, 100),     # Feed override (%) chosen during the last plot
+)
+
+
+class ResumeData(object):
+    __slots__ = tuple(field for attribute, field, kind, default in FIELDS)
+
+    def __init__(self, **values):
+        for attribute, field, kind, default in FIELDS:
+            setattr(self, field, values.pop(field, default))
+        if values:
+            raise TypeError('No resume data field %s' % ', '.join(values))
+
+    @classmethod
+    def fromElement(cls, node):
+        '''
+        Read the record from a <WCB> element.  Fields it does not have, as
+        in files saved by older versions, take their defaults.  Raises
+        ValueError if one cannot be read.
+        '''
+        values = {}
+        for attribute, field, kind, default in FIELDS:
+            text = node.get(attribute)
+            if text is not None:
+                values[field] = kind(text)
+        return cls(**values)
+
+    def copy(self, **changes):
+        '''A copy of the record, with the fields given changed.'''
+        values = dict((field, getattr(self, field)) for field in self.__slots__)
+        values.update(changes)
+        return ResumeData(**values)
+
+    def writeTo(self, node):
+        '''Set the attributes of a <WCB> element from the record, in one go.'''
+        node.attrib.update(dict((attribute, str(getattr(self, field)))
+                                for attribute, field, kind, default in FIELDS))
+
+
+def findElement(svg):
+    '''The document's <WCB> element, or None.'''
+    for tag in WCB_TAGS:
+        node = svg.find(tag)
+        if node is not None:
+            return node
+    return None
+
+
+def stripElements(svg):
+    '''Remove the resume data, ours and the EggBot's, from the document.'''
+    for node in [node for node in svg if node.tag in DATA_TAGS]:
+        svg.remove(node)
@@ -30,9 +30,10 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from math import sqrt
-import cspsubdiv
-from bezmisc import *
+import os
+import re
+from array import array
+from math import acos, ceil, cos, pi, sin, sqrt
 
 import fourxidraw_compat # To bridge Python 2/3, Inkscape 0.*/1.*
 
@@ -41,6 +42,26 @@ def version():
 
 pxPerInch = fourxidraw_compat.compatPxPerInch()
 
+# A number in an SVG attribute such as a polyline's points
+SVG_NUMBER = re.compile( r'[-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?' )
+
+def cacheDirectory():
+	'''
+	Return the per-user directory in which the extensions keep files
+	that should outlive a single run (caches, journals and the like),
+	creating it if need be.
+	'''
+	base = os.environ.get( 'XDG_CACHE_HOME' ) or os.environ.get( 'LOCALAPPDATA' )
+	if not base:
+		base = os.path.join( os.path.expanduser( '~' ), '.cache' )
+	path = os.path.join( base, '4xidraw' )
+	try:
+		os.makedirs( path )
+	except OSError:
+		if not os.path.isdir( path ):
+			raise
+	return path
+
 def distance( x, y ):
 	'''
 	Pythagorean theorem!
@@ -190,6 +211,210 @@ def subdivideCubicPath( sp, flat, i=1 ):
 		sp[i:1] = [p]
 
 
+class Polyline( object ):
+	"""
+	A flattened path, in inches: its points kept as one flat array of
+	doubles, x0, y0, x1, y1, ...  It is made once, as a subpath is
+	flattened, and then clamped, planned and plotted in place, so that
+	no list is made per point along the way.
+	"""
+	__slots__ = ( 'coords', )
+
+	def __init__( self, coords=None ):
+		if coords is None:
+			coords = array( 'd' )
+		self.coords = coords
+
+	@classmethod
+	def fromSubpath( cls, sp, portrait=False, width=0.0 ):
+		"""
+		The polyline through the nodes of a (flattened) cubic superpath
+		subpath.  With [portrait], x and y are swapped and the new y
+		measured down from [width], as for plotting in portrait mode.
+		"""
+		coords = array( 'd' )
+		if portrait:
+			for csp in sp:
+				coords.append( float( csp[1][1] ) )
+				coords.append( width - float( csp[1][0] ) )
+		else:
+			for csp in sp:
+				coords.extend( csp[1] )
+		return cls( coords )
+
+	@classmethod
+	def fromPoints( cls, coords, matrix, portrait=False, width=0.0 ):
+		"""
+		The polyline through points given as a flat sequence of document
+		coordinates, x0, y0, x1, y1, ..., taken to inches by the 2x3
+		transform [matrix].  [portrait] and [width] are as for fromSubpath.
+		"""
+		( ( a, c, e ), ( b, d, f ) ) = matrix
+		points = array( 'd' )
+		for i in range( 0, len( coords ) - 1, 2 ):
+			x = coords[i]
+			y = coords[i + 1]
+			if portrait:
+				points.append( b * x + d * y + f )
+				points.append( width - ( a * x + c * y + e ) )
+			else:
+				points.append( a * x + c * y + e )
+				points.append( b * x + d * y + f )
+		return cls( points )
+
+	def __len__( self ):
+		return len( self.coords ) // 2
+
+	def append( self, x, y ):
+		self.coords.append( x )
+		self.coords.append( y )
+
+	def point( self, i ):
+		if i < 0:
+			i += len( self )
+		return self.coords[2 * i], self.coords[2 * i + 1]
+
+	def points( self, start=0 ):
+		"""
+		Iterate over the (x, y) points, from the one numbered [start].
+		"""
+		coords = self.coords
+		return zip( coords[2 * start::2], coords[2 * start + 1::2] )
+
+	def __iter__( self ):
+		return iter( self.points() )
+
+	def extents( self ):
+		"""
+		The smallest and largest coordinates, as (xMin, yMin, xMax, yMax).
+		There must be at least one point.
+		"""
+		xs = self.coords[0::2]
+		ys = self.coords[1::2]
+		return min( xs ), min( ys ), max( xs ), max( ys )
+
+	def clamp( self, xMin, xMax, yMin, yMax ):
+		"""
+		Clamp every point to the given limits, in place.  Returns None if
+		they were all inside, as is usual, which is found at C speed from
+		the extremes alone.  Otherwise returns (the number of points
+		moved, the furthest any was moved, and that point as it was).
+		"""
+		coords = self.coords
+		if not coords:
+			return None
+		left, top, right, bottom = self.extents()
+		if ( left >= xMin ) and ( right <= xMax ) and \
+				( top >= yMin ) and ( bottom <= yMax ):
+			return None
+
+		count = 0
+		excess = 0.0
+		worst = None
+		for i in range( 0, len( coords ), 2 ):
+			x = coords[i]
+			y = coords[i + 1]
+			dx, xBounded = checkLimits( x, xMin, xMax )
+			dy, yBounded = checkLimits( y, yMin, yMax )
+			if xBounded or yBounded:
+				coords[i] = dx
+				coords[i + 1] = dy
+				count += 1
+				moved = distance( x - dx, y - dy )
+				if moved > excess or worst is None:
+					excess = moved
+					worst = ( x, y )
+		return count, excess, worst
+
+
+def parsePoints( points ):
+	"""
+	The coordinates in an SVG points attribute, "x1,y1 x2,y2 ...", as a
+	flat list x1, y1, x2, y2, ...  An odd number left over is dropped.
+	"""
+	coords = [float( n ) for n in SVG_NUMBER.findall( points or '' )]
+	if len( coords ) % 2:
+		del coords[-1]
+	return coords
+
+def rectPoints( x, y, width, height ):
+	"""The outline of a rectangle, as a closed polyline's coordinates."""
+	return [x, y, x + width, y, x + width, y + height, x, y + height, x, y]
+
+def roundedRectPoints( x, y, width, height, rx, ry, segments ):
+	"""
+	The outline of a rectangle with corners rounded to radii [rx] and [ry],
+	as a closed polyline's coordinates, starting along the top edge as
+	SVG does.  Each corner is [segments] straight segments.
+	"""
+	quarter = [( cos( pi * k / ( 2 * segments ) ), sin( pi * k / ( 2 * segments ) ) )
+		for k in range( segments + 1 )]
+	coords = [x + rx, y]
+	# Each corner's centre, and the direction from it of each end of its arc
+	for ( cx, cy, ux, uy, vx, vy ) in (
+			( x + width - rx, y + ry, 0, -1, 1, 0 ),
+			( x + width - rx, y + height - ry, 1, 0, 0, 1 ),
+			( x + rx, y + height - ry, 0, 1, -1, 0 ),
+			( x + rx, y + ry, -1, 0, 0, -1 ) ):
+		for ( c, s ) in quarter:
+			px = cx + rx * ( c * ux + s * vx )
+			py = cy + ry * ( c * uy + s * vy )
+			if ( px != coords[-2] ) or ( py != coords[-1] ):	# No edge between the corners
+				coords.append( px )
+				coords.append( py )
+	coords[-2:] = coords[:2]
+	return coords
+
+def transformScale( matrix ):
+	"""
+	The most that the 2x3 transform [matrix] stretches any length by:
+	the larger singular value of its linear part.
+	"""
+	( ( a, c, e ), ( b, d, f ) ) = matrix
+	squares = a * a + b * b + c * c + d * d
+	det = a * d - b * c
+	return sqrt( ( squares + sqrt( max( squares * squares - 4 * det * det, 0.0 ) ) ) / 2 )
+
+def arcSegments( radius, flat ):
+	"""
+	The number of straight segments to draw a full circle of [radius] in,
+	so that no segment strays more than [flat] from the circle; a multiple
+	of four, so that it divides evenly into quarters.
+	"""
+	if radius <= flat:
+		return 4
+	step = 2 * acos( 1 - flat / radius )
+	return 4 * int( ceil( pi / ( 2 * step ) ) )
+
+_unitCircles = {}
+
+def unitCircle( segments ):
+	"""
+	The closed polyline of [segments] straight segments around the unit
+	circle, as a flat array of coordinates.  It starts at (-1, 0) and runs
+	the way an SVG arc with sweep-flag 0 would.  Made once for each
+	number of segments and shared, so it must not be changed.
+	"""
+	coords = _unitCircles.get( segments )
+	if coords is None:
+		coords = array( 'd' )
+		for k in range( segments ):
+			t = pi - 2 * pi * k / segments
+			coords.append( cos( t ) )
+			coords.append( sin( t ) )
+		coords.extend( coords[:2] )
+		_unitCircles[segments] = coords
+	return coords
+
+def ellipseTransform( matrix, cx, cy, rx, ry ):
+	"""
+	The 2x3 transform [matrix], applied after scaling the unit circle to
+	the ellipse with centre ([cx], [cy]) and radii [rx] and [ry].
+	"""
+	( ( a, c, e ), ( b, d, f ) ) = matrix
+	return ( ( a * rx, c * ry, a * cx + c * cy + e ),
+		( b * rx, d * ry, b * cx + d * cy + f ) )
+
 def checkLimits( value, lowerBound, upperBound ):
 	#Check machine size limit; truncate at edges
 	if (value > upperBound):
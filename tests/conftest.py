@@ -0,0 +1,98 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fourxidraw
+import grbl_serial
+import grbl_sim
+
+# Options the extension is run with: instant pen lifts and no speed changes
+PLOT_ARGS = ['--penLiftRate=1000000', '--penLowerRate=1000000',
+             '--penLiftDelay=0', '--penLowerDelay=0', '--applySpeed=false',
+             '--reportTime=false']
+
+# The rates and accelerations suggested in README.md
+SIM_SETTINGS = {110: 8500, 111: 8500, 120: 200, 121: 200}
+
+# Four separate strokes, on a 100 mm page
+FOUR_PATHS = '''<svg xmlns="http://www.w3.org/2000/svg" width="100mm" height="100mm" viewBox="0 0 100 100">
+  <path d="M 10,10 L 30,10"/>
+  <path d="M 10,20 L 30,20"/>
+  <path d="M 10,30 L 30,30"/>
+  <path d="M 10,40 L 30,40"/>
+</svg>
+'''
+
+# Two numbered layers, to be plotted with a pen change between them
+TWO_LAYERS = '''<svg xmlns="http://www.w3.org/2000/svg"
+     xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape"
+     width="100mm" height="100mm" viewBox="0 0 100 100">
+  <g inkscape:groupmode="layer" inkscape:label="1 black">
+    <path d="M 10,10 L 30,10"/>
+  </g>
+  <g inkscape:groupmode="layer" inkscape:label="2 red">
+    <path d="M 10,20 L 30,20"/>
+  </g>
+</svg>
+'''
+
+
+@pytest.fixture(autouse=True)
+def scratchDirectory(tmp_path, monkeypatch):
+    '''Keep journals, caches and the G-code log out of the user's own directories.'''
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    monkeypatch.chdir(tmp_path)
+
+
+@pytest.fixture
+def simulator():
+    sim = grbl_sim.GrblSimulator(SIM_SETTINGS, timeScale=20.0).start()
+    yield sim
+    sim.stop()
+
+
+def openSimulator(sim):
+    '''A GrblSerial talking to the simulated board, in absolute mode.'''
+    serialPort = grbl_serial.GrblSerial(grbl_serial.testPort(sim.portName), False)
+    serialPort.command('G90\r')
+    return serialPort
+
+
+def pressResumeWhenHeld(sim, motion, changeTime=0.0, timeout=30.0):
+    '''
+    Press resume, from another thread, changeTime seconds after the
+    simulated machine has stopped for a pen change.  The thread's held
+    list says whether it had.
+    '''
+    def changePen():
+        deadline = time.time() + timeout
+        while (not sim.held) and (time.time() < deadline):
+            time.sleep(0.05)
+        presser.held.append(sim.held)
+        time.sleep(changeTime)
+        motion.cycleStart()
+    presser = threading.Thread(target=changePen)
+    presser.held = []
+    presser.start()
+    return presser
+
+
+def loadExtension(filename, *args):
+    '''A FourxiDrawClass set up to plot filename, as effect() would.'''
+    e = fourxidraw.FourxiDrawClass()
+    e.parse_arguments(PLOT_ARGS + list(args) + [str(filename)])
+    e.load_raw()
+    e.svg = e.document.getroot()
+    e.options.mode = 'plot'
+    e.CheckSVGforWCBData()
+    e.PrintInLayersMode = False
+    e.plotCurrentLayer = True
+    e.resume.layer = 12345
+    assert e.setDocTransform()
+    return e
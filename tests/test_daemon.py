@@ -0,0 +1,115 @@
+import json
+import os
+import signal
+import socket
+import threading
+import time
+
+import pytest
+
+from conftest import FOUR_PATHS, loadExtension, openSimulator
+
+import grbl_daemon
+import grbl_serial
+
+
+def test_new_client_is_not_left_interrupted(simulator):
+    serialPort = openSimulator(simulator)
+    daemon = grbl_daemon.GrblDaemon(serialPort)
+    # A client stopped its plot, then died before it could reset GRBL
+    serialPort.interrupted.set()
+    serialPort.executed = (7, (10.0, 10.0))
+
+    ours, theirs = socket.socketpair()
+    server = threading.Thread(target=daemon.serveClient, args=(theirs,))
+    server.start()
+    try:
+        stream = ours.makefile('rwb')
+        stream.write((json.dumps({'call': 'command', 'args': ['G0 X5 Y5\r']}) + '\n').encode('utf-8'))
+        stream.flush()
+        json.loads(stream.readline().decode('utf-8'))
+        stream.close()
+        ours.close()
+        server.join()
+        serialPort.query('G4 P0\r')
+    finally:
+        serialPort.close()
+    assert simulator.moves == 1
+    assert serialPort.executedMove() is None
+
+
+def plotThroughDaemon(svg, pauseAtFirstMove):
+    '''Plot svg as the extension would with --keepConnection, maybe pausing at once.'''
+    e = loadExtension(svg)
+    e.serialPort = grbl_daemon.connect()
+    assert e.serialPort is not None
+    try:
+        e.createMotion()
+        e.penUp()
+        e.EnableMotors()
+        journal = e.compileJournal()
+        if pauseAtFirstMove:
+            doAbsoluteMove = e.motion.doAbsoluteMove
+
+            def moveThenPause(x, y, tag=None):
+                doAbsoluteMove(x, y, tag)
+                e.motion.requestPause()
+            e.motion.doAbsoluteMove = moveThenPause
+        e.streamJournal(journal, 0)
+    finally:
+        e.serialPort.close()
+    return e
+
+
+@pytest.fixture
+def daemon(simulator, monkeypatch):
+    '''A daemon serving the simulated board, from another thread.'''
+    # The daemon sends GrblSerial's messages to its clients
+    monkeypatch.setattr(grbl_serial, 'errormsg', grbl_serial.errormsg)
+    daemon = grbl_daemon.GrblDaemon(openSimulator(simulator))
+    server = threading.Thread(target=daemon.run)
+    server.start()
+    deadline = time.time() + 10.0
+    while (grbl_daemon.connect() is None) and (time.time() < deadline):
+        time.sleep(0.05)
+    yield daemon
+    daemon.stopping.set()
+    server.join()
+
+
+def test_second_plot_does_not_resume_from_first(tmp_path, daemon):
+    svg = tmp_path / 'four.svg'
+    svg.write_text(FOUR_PATHS)
+    first = plotThroughDaemon(svg, False)
+    second = plotThroughDaemon(svg, True)
+
+    assert first.resume.journalPos > 1
+    assert second.bStopped
+    # Nothing of the second plot had been executed: resume from its start
+    assert second.resume.journalPos <= 1
+
+
+def test_pause_signal_during_plot(tmp_path, simulator, daemon):
+    # Long enough for GRBL's planner to fill, so that the plot waits on it
+    paths = ''.join('<path d="M 10,%d L 90,%d"/>' % (y, y) for y in range(5, 95, 2))
+    svg = tmp_path / 'lines.svg'
+    svg.write_text(FOUR_PATHS.replace('<path', paths + '<path', 1))
+    e = loadExtension(svg)
+    e.serialPort = grbl_daemon.connect()
+    e.createMotion()
+
+    def pauseWhenPlotting():
+        deadline = time.time() + 30.0
+        while (simulator.moves < 20) and (time.time() < deadline):
+            time.sleep(0.01)
+        os.kill(os.getpid(), signal.SIGUSR1)
+    pauser = threading.Thread(target=pauseWhenPlotting)
+    pauser.start()
+    try:
+        e.plotDocument()
+    finally:
+        pauser.join()
+        e.serialPort.close()
+
+    assert e.bStopped
+    assert 1 < e.resume.journalPos < 100
@@ -0,0 +1,89 @@
+import pytest
+
+from conftest import FOUR_PATHS, SIM_SETTINGS, TWO_LAYERS, pressResumeWhenHeld
+
+import fourxidraw_stream
+import grbl_fleet
+import grbl_sim
+import plot_journal
+
+
+def compileJournal(tmp_path, name, svgText, *args):
+    '''Write a journal for grbl_fleet.py, as fourxidraw_stream.py --journalFile does.'''
+    svg = tmp_path / (name + '.svg')
+    svg.write_text(svgText)
+    journal = str(tmp_path / (name + '.journal'))
+    assert fourxidraw_stream.main(list(args) + ['--journalFile=' + journal, str(svg)]) == 0
+    return journal
+
+
+@pytest.fixture
+def simulators():
+    sims = [grbl_sim.GrblSimulator(SIM_SETTINGS, timeScale=20.0).start() for i in range(2)]
+    yield sims
+    for sim in sims:
+        sim.stop()
+
+
+@pytest.fixture
+def machines(simulators):
+    machines = grbl_fleet.discover([sim.portName for sim in simulators])
+    yield machines
+    for machine in machines:
+        machine.close()
+
+
+def test_fleet_plots_every_job(tmp_path, simulators, machines):
+    assert len(machines) == 2
+    journal = compileJournal(tmp_path, 'four', FOUR_PATHS)
+    fleet = grbl_fleet.Fleet(machines)
+    jobs = [fleet.submit(journal) for i in range(4)]
+    elapsed = fleet.run()
+
+    assert [job.error for job in jobs] == [None] * 4
+    assert all(job.moves > 0 for job in jobs)
+    assert sum(len(machine.jobs) for machine in machines) == 4
+    assert sum(sim.errors for sim in simulators) == 0
+    assert fleet.report(elapsed)[-1].startswith('4 jobs on 2 machines')
+
+
+def test_fleet_pauses_for_pen_change(tmp_path, simulators, machines):
+    journal = compileJournal(tmp_path, 'layers', TWO_LAYERS,
+                             '--mode=layers', '--batchLayers=true')
+    reader = plot_journal.JournalReader(journal)
+    changes = [count for index, op, flags, count, x, y in reader.records()
+               if op == plot_journal.PEN_CHANGE]
+    reader.close()
+    assert changes == [2]
+
+    sim = simulators[0]
+    machine = machines[0]
+    presser = pressResumeWhenHeld(sim, machine.motion)
+    fleet = grbl_fleet.Fleet([machine])
+    job = fleet.submit(journal)
+    fleet.run()
+    presser.join()
+
+    assert presser.held == [True]
+    assert job.error is None
+    assert sim.errors == 0
+
+
+def test_fleet_reports_lost_machine(tmp_path, machines):
+    journal = compileJournal(tmp_path, 'four', FOUR_PATHS)
+    machine = machines[0]
+
+    def timeout(x, y, tag=None):
+        # What GrblSerial.command does when GRBL stops answering
+        raise SystemExit()
+    machine.motion.doAbsoluteMove = timeout
+
+    fleet = grbl_fleet.Fleet([machine])
+    first = fleet.submit(journal)
+    second = fleet.submit(journal)
+    fleet.run()
+
+    assert first.error == 'lost contact with the machine'
+    assert second.error == 'no machine was left to plot it'
+    report = fleet.report(1.0)
+    assert any(line.startswith('four.journal failed on ') for line in report)
@@ -0,0 +1,105 @@
+import io
+from array import array
+
+from lxml import etree
+
+import eggbot_hatch
+
+SQUARE = '''<svg xmlns="http://www.w3.org/2000/svg" width="100mm" height="100mm" viewBox="0 0 100 100">
+  <path id="square" d="M 10,10 L 40,10 L 40,40 L 10,40 Z" style="fill:#ff0000"/>
+</svg>
+'''
+
+
+def hatch(filename):
+    '''Hatch the file in place, as a run of the extension would.'''
+    output = io.BytesIO()
+    eggbot_hatch.Eggbot_Hatch().run([str(filename), '--useCache=false'], output=output)
+    # inkex writes nothing back if the document is unchanged
+    if output.getvalue():
+        filename.write_bytes(output.getvalue())
+    return etree.fromstring(filename.read_bytes())
+
+
+def hatchGroups(root):
+    return root.xpath('//*[@%s]' % eggbot_hatch.HATCH_HASH_ATTRIB)
+
+
+def test_rehatch_leaves_unchanged_element(tmp_path):
+    svg = tmp_path / 'square.svg'
+    svg.write_text(SQUARE)
+    first = hatchGroups(hatch(svg))
+    assert len(first) == 1
+    second = hatchGroups(hatch(svg))
+    assert len(second) == 1
+    assert etree.tostring(first[0]) == etree.tostring(second[0])
+
+
+def test_rehatch_removes_stale_group(tmp_path):
+    svg = tmp_path / 'square.svg'
+    svg.write_text(SQUARE)
+    assert len(hatchGroups(hatch(svg))) == 1
+
+    # Edited into an open path, with nothing left to hatch
+    root = etree.fromstring(svg.read_bytes())
+    square = root.xpath('//*[@id="square"]')[0]
+    square.set('d', 'M 10,10 L 40,10 L 40,40')
+    svg.write_bytes(etree.tostring(root))
+
+    root = hatch(svg)
+    assert hatchGroups(root) == []
+    assert root.xpath('//*[@%s]' % eggbot_hatch.HATCH_FILL_ATTRIB) == []
+    square = root.xpath('//*[@id="square"]')[0]
+    assert square.getparent() is root
+
+
+def test_flatten_cache_keeps_entries_of_other_elements(tmp_path):
+    filename = str(tmp_path / 'flatten.cache')
+    first = eggbot_hatch.FlattenCache(filename)
+    first.put('a', [array('d', [0, 0, 1, 0, 1, 1])])
+    first.put('b', [array('d', [2, 2, 3, 2, 3, 3])])
+    first.save()
+
+    # A later run, on a selection that only has element a
+    second = eggbot_hatch.FlattenCache(filename)
+    second.now += 2 * eggbot_hatch.FLATTEN_CACHE_TOUCH_INTERVAL
+    second.load()
+    assert second.get('a') is not None
+    second.put('c', [array('d', [4, 4, 5, 4, 5, 5])])
+    second.save()
+
+    third = eggbot_hatch.FlattenCache(filename)
+    third.load()
+    assert sorted(third.entries) == ['a', 'b', 'c']
+    assert third.entries['a'][0] == second.now
+
+
+def test_flatten_cache_drops_least_recently_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(eggbot_hatch, 'FLATTEN_CACHE_MAX_COORDS', 12)
+    cache = eggbot_hatch.FlattenCache(str(tmp_path / 'flatten.cache'))
+    square = [array('d', [0, 0, 1, 0, 1, 1])]
+    cache.entries = {
+        'expired': (cache.now - eggbot_hatch.FLATTEN_CACHE_MAX_AGE - 1, square),
+        'older': (cache.now - 20, square),
+        'newer': (cache.now - 10, square),
+    }
+    cache.put('current', square)
+    cache.save()
+    assert sorted(cache.entries) == ['current', 'newer']
+
+
+def test_flatten_cache_not_rewritten_when_only_read(tmp_path):
+    filename = tmp_path / 'flatten.cache'
+    first = eggbot_hatch.FlattenCache(str(filename))
+    first.put('a', [array('d', [0, 0, 1, 0, 1, 1])])
+    first.save()
+    written = filename.stat().st_mtime_ns
+
+    # The next run, soon after, finds everything it needs in the cache
+    second = eggbot_hatch.FlattenCache(str(filename))
+    second.now += 60
+    second.load()
+    assert second.get('a') is not None
+    second.save()
+    assert not second.modified
+    assert filename.stat().st_mtime_ns == written
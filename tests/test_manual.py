@@ -0,0 +1,31 @@
+import subprocess
+import sys
+
+from conftest import ROOT, openSimulator
+
+import fourxidraw_conf
+import grbl_manual
+from grbl_motion import GrblMotion
+
+
+def test_tools_start_without_inkex():
+    # Imported as a command-line tool would be
+    script = ('import sys, grbl_manual, grbl_daemon, grbl_fleet, grbl_control; '
+              'print("inkex" in sys.modules)')
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=ROOT)
+    assert output.decode().strip() == 'False'
+
+
+def test_pen_and_version(simulator, capsys):
+    serialPort = openSimulator(simulator)
+    try:
+        motion = GrblMotion(serialPort, fourxidraw_conf.DPI_16X,
+                            fourxidraw_conf.PenUpPos, fourxidraw_conf.PenDownPos)
+        grbl_manual.raisePen(motion)
+        assert simulator.spindle == fourxidraw_conf.PenUpPos
+        grbl_manual.togglePen(motion)
+        assert simulator.spindle == fourxidraw_conf.PenDownPos
+        grbl_manual.versionCheck(motion)
+    finally:
+        serialPort.close()
+    assert 'VER:1.1h' in capsys.readouterr().out
@@ -0,0 +1,135 @@
+import pytest
+
+from conftest import FOUR_PATHS, TWO_LAYERS, loadExtension, openSimulator, pressResumeWhenHeld
+
+import grbl_serial
+import plot_resume
+
+
+def test_pause_before_first_checkpoint(tmp_path, simulator):
+    svg = tmp_path / 'four.svg'
+    svg.write_text(FOUR_PATHS)
+    e = loadExtension(svg)
+    e.serialPort = openSimulator(simulator)
+    try:
+        e.createMotion()
+        e.penUp()
+        e.EnableMotors()
+        journal = e.compileJournal()
+        assert journal is not None
+        # The resume data is still that of the start of the plot
+        assert (e.resume.lastPath, e.resume.lastPathNC, e.resume.layer) == (0, 0, 12345)
+
+        # Pause as soon as the first move has been sent
+        doAbsoluteMove = e.motion.doAbsoluteMove
+
+        def moveThenPause(x, y, tag=None):
+            doAbsoluteMove(x, y, tag)
+            e.motion.requestPause()
+        e.motion.doAbsoluteMove = moveThenPause
+        e.streamJournal(journal, 0)
+    finally:
+        e.serialPort.close()
+
+    assert e.bStopped
+    assert e.resume.lastPath == 0
+    assert e.resume.lastPathNC == 0
+    assert e.resume.layer == 12345
+    assert e.resume.journalPos <= 1
+
+
+def loadLayerBatch(filename):
+    '''A FourxiDrawClass set up to plot every numbered layer, as effect() would.'''
+    e = loadExtension(filename, '--mode=layers', '--batchLayers=true')
+    e.options.mode = 'layers'
+    e.PrintInLayersMode = True
+    e.plotCurrentLayer = False
+    e.layerBatch = e.getLayerIndex().numbers()
+    e.resume.layer = e.layerBatch[0]
+    return e
+
+
+@pytest.mark.parametrize('layer', [1, 2])
+def test_pause_saves_layer_being_plotted(tmp_path, simulator, layer):
+    svg = tmp_path / 'layers.svg'
+    svg.write_text(TWO_LAYERS)
+    e = loadLayerBatch(svg)
+    e.serialPort = openSimulator(simulator)
+    e.createMotion()
+    # The feed hold of the pause itself must not be taken for the pen change
+    presser = pressResumeWhenHeld(simulator, e.motion) if layer > 1 else None
+    try:
+        e.penUp()
+        e.EnableMotors()
+        journal = e.compileJournal()
+
+        # Pause at the first move made in that layer
+        doAbsoluteMove = e.motion.doAbsoluteMove
+
+        def moveThenPause(x, y, tag=None):
+            doAbsoluteMove(x, y, tag)
+            if e.resume.layer == layer:
+                e.motion.requestPause()
+        e.motion.doAbsoluteMove = moveThenPause
+        e.streamJournal(journal, 0)
+    finally:
+        if presser is not None:
+            presser.join()
+        e.serialPort.close()
+
+    assert e.bStopped
+    assert e.resume.layer == layer
+
+
+def test_pen_change_without_journal(tmp_path, simulator, monkeypatch):
+    svg = tmp_path / 'layers.svg'
+    svg.write_text(TWO_LAYERS)
+    # GrblSerial gives up after 30 reads with no reply: make that 1.5 s
+    monkeypatch.setattr(grbl_serial, 'READ_TIMEOUT', 0.05)
+    e = loadLayerBatch(svg)
+    e.serialPort = openSimulator(simulator)
+    e.createMotion()
+    # As if the journal could not be written: plot from the document
+    monkeypatch.setattr(e, 'compileJournal', lambda: None)
+    presser = pressResumeWhenHeld(simulator, e.motion, changeTime=3.0)
+    try:
+        e.plotDocument()
+    finally:
+        presser.join()
+        e.serialPort.close()
+
+    assert presser.held == [True]
+    assert not e.bStopped
+    assert simulator.moves > 0
+
+
+def test_first_plot_of_fresh_document(tmp_path, simulator):
+    svg = tmp_path / 'four.svg'
+    svg.write_text(FOUR_PATHS)
+    e = loadExtension(svg, '--fileOutput=true')
+    assert plot_resume.findElement(e.svg) is not None
+    e.serialPort = openSimulator(simulator)
+    try:
+        e.createMotion()
+        e.penUp()
+        e.EnableMotors()
+        journal = e.compileJournal()
+        doAbsoluteMove = e.motion.doAbsoluteMove
+
+        def moveThenPause(x, y, tag=None):
+            doAbsoluteMove(x, y, tag)
+            e.motion.requestPause()
+        e.motion.doAbsoluteMove = moveThenPause
+        e.streamJournal(journal, 0)
+    finally:
+        e.serialPort.close()
+    e.UpdateSVGWCBData()
+
+    # Saved, and read back, as the next run of the extension would
+    saved = tmp_path / 'saved.svg'
+    e.document.write(str(saved))
+    again = loadExtension(saved, '--fileOutput=true')
+    assert len(again.svg.findall(plot_resume.WCB_TAG)) == 1
+    assert again.resumeOld.layer == 12345
+    assert again.resumeOld.lastPath == 0
+    assert again.resumeOld.journal == e.resume.journal
@@ -0,0 +1,39 @@
+from conftest import openSimulator
+
+import grbl_serial
+
+
+def test_wait_for_grbl09_hold_to_stop(simulator, monkeypatch):
+    # GRBL 0.9 says Hold both while decelerating and once stopped
+    reports = ['<Hold,MPos:10.000,5.000,0.000,WPos:10.000,5.000,0.000>',
+               '<Hold,MPos:10.800,5.000,0.000,WPos:10.800,5.000,0.000>',
+               '<Hold,MPos:11.200,5.000,0.000,WPos:11.200,5.000,0.000>',
+               '<Hold,MPos:11.200,5.000,0.000,WPos:11.200,5.000,0.000>',
+               '<Hold,MPos:11.200,5.000,0.000,WPos:11.200,5.000,0.000>']
+    polled = []
+
+    def pollStatus():
+        polled.append(reports[len(polled)])
+        return grbl_serial.parseStatus(polled[-1])
+    monkeypatch.setattr(grbl_serial, 'STATUS_INTERVAL', 0.0)
+    serialPort = openSimulator(simulator)
+    try:
+        serialPort.pollStatus = pollStatus
+        status = serialPort.waitForHold()
+    finally:
+        serialPort.close()
+    assert len(polled) == 4
+    assert status['MPos'] == (11.2, 5.0)
+
+
+def test_cached_port_is_probed_once(monkeypatch):
+    probed = []
+
+    def testPort(comPort):
+        probed.append(comPort)
+        return None
+    monkeypatch.setattr(grbl_serial, 'cachedPort', lambda: '/dev/ttyUSB1')
+    monkeypatch.setattr(grbl_serial, 'findPorts', lambda: ['/dev/ttyUSB0', '/dev/ttyUSB1', '/dev/ttyACM0'])
+    monkeypatch.setattr(grbl_serial, 'testPort', testPort)
+    assert grbl_serial.openPort(False, False) is None
+    assert probed == ['/dev/ttyUSB1', '/dev/ttyUSB0', '/dev/ttyACM0']